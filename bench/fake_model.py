@@ -0,0 +1,75 @@
+import re
+import json
+import time
+import random
+import asyncio
+from typing import Iterator, List
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeChatModel:
+    """Детерминированная замена GigaChat для бенчмарков: заданная задержка и заготовленные ответы.
+
+    Поддерживает те же методы, что использует llm.py: invoke, stream, ainvoke, astream.
+    На промпты с просьбой вернуть JSON отвечает JSON с фильтрами, на остальные — коротким текстом.
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, token_latency: float = 0.02,
+                 genres: List[str] = None, seed: int = 42):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.genres = genres or ["Фэнтези", "Детектив", "Классика", "Фантастика"]
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def _reply(self, messages) -> str:
+        prompt = messages[-1].content
+        batch = re.search(r"JSON-объект с полями ([^:]+):", prompt)
+        if batch:
+            # Пакетный запрос prompts.batch_ask: по ответу на каждое поле
+            fields = re.findall(r'"(\w+)"', batch.group(1))
+            return json.dumps({field: "📚 Отличный выбор! ✨" for field in fields}, ensure_ascii=False)
+        if "JSON" in prompt:
+            return json.dumps({
+                "genre": self.random.choice(self.genres),
+                "age_limit": self.random.choice(["12+", "16+", "18+"])
+            }, ensure_ascii=False)
+        return "📚 Отличный выбор! Эти книги объединяет яркий сюжет и запоминающиеся герои. ✨"
+
+    def _tokens(self, text: str) -> List[str]:
+        words = text.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def invoke(self, messages) -> FakeMessage:
+        self.calls += 1
+        time.sleep(self._delay())
+        return FakeMessage(self._reply(messages))
+
+    __call__ = invoke
+
+    def stream(self, messages) -> Iterator[FakeMessage]:
+        self.calls += 1
+        time.sleep(self._delay())
+        for token in self._tokens(self._reply(messages)):
+            time.sleep(self.token_latency)
+            yield FakeMessage(token)
+
+    async def ainvoke(self, messages) -> FakeMessage:
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        return FakeMessage(self._reply(messages))
+
+    async def astream(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        for token in self._tokens(self._reply(messages)):
+            await asyncio.sleep(self.token_latency)
+            yield FakeMessage(token)
@@ -0,0 +1,65 @@
+import time
+import argparse
+import tracemalloc
+from typing import Callable, Dict, List
+from bench.synthetic import generate_books
+from records import Book, BOOK_FIELDS
+
+ALL_COLUMNS = ("id",) + BOOK_FIELDS[1:7] + ("description",) + BOOK_FIELDS[7:]
+
+
+def _reencode(rows: List[Dict]) -> List[Dict]:
+    """Прежняя обработка строк: копия словаря с перекодировкой каждого строкового поля"""
+    books = []
+    for row in rows:
+        book = {}
+        for key, value in row.items():
+            book[key] = value.encode("utf-8", errors="replace").decode("utf-8") if isinstance(value, str) else value
+        books.append(book)
+    return books
+
+
+def dict_rows(rows: List[tuple]) -> List[Dict]:
+    """SELECT * в RealDictCursor и перекодировка в tools.py и ещё раз в main.py"""
+    return _reencode(_reencode([dict(zip(ALL_COLUMNS, row)) for row in rows]))
+
+
+def book_records(rows: List[tuple]) -> List[Book]:
+    """Явный список колонок без описания, записи Book прямо из кортежей курсора"""
+    return [Book.from_row(row[:7] + row[8:]) for row in rows]
+
+
+def measure(build: Callable[[List[tuple]], list], rows: List[tuple]) -> Dict[str, float]:
+    # CPU меряется отдельно: tracemalloc сам заметно замедляет выделения памяти
+    started = time.process_time()
+    result = build(rows)
+    cpu = time.process_time() - started
+    del result
+
+    tracemalloc.start()
+    result = build(rows)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"cpu_sec": cpu, "retained_mb": current / 2 ** 20, "peak_mb": peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память и CPU: словари RealDictCursor против записей Book")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    # Кортежи в порядке SELECT * — так их отдаёт драйвер до построения словарей
+    rows = [tuple(book[column] for column in ALL_COLUMNS[1:]) for book in generate_books(args.rows)]
+    rows = [(i,) + row for i, row in enumerate(rows, 1)]
+
+    results = {"dict": measure(dict_rows, rows), "book": measure(book_records, rows)}
+    for name, stats in results.items():
+        print(f"{name:5} CPU {stats['cpu_sec']:.3f} сек, удержано {stats['retained_mb']:.1f} МБ, "
+              f"пик {stats['peak_mb']:.1f} МБ")
+    print(f"📉 Память: в {results['dict']['retained_mb'] / results['book']['retained_mb']:.1f} раза меньше, "
+          f"CPU: в {results['dict']['cpu_sec'] / results['book']['cpu_sec']:.1f} раза быстрее")
+
+
+if __name__ == "__main__":
+    main()
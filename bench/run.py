@@ -0,0 +1,170 @@
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from typing import Callable, Dict, List
+from bench.fake_model import FakeChatModel
+from bench.synthetic import SCALES, GENRES, ORIGINS, AGE_LIMITS, KEYWORDS, load_synthetic, drop_synthetic
+from bench.scenarios import SCENARIOS, SCENARIO_USER_OFFSET, run_scenario
+from database import get_pool, apply_migrations
+from history import history_writer
+from llm import usage_stats
+from tools import get_book_recommendations, get_random_book, add_to_search_history, get_books_count
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(values: List[float], elapsed: float = None) -> Dict[str, float]:
+    elapsed = elapsed if elapsed is not None else sum(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+        "throughput": len(values) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(func: Callable[[], object], iterations: int, warmup: int = 5) -> Dict[str, float]:
+    for _ in range(warmup):
+        func()
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - call_started)
+    return summarize(timings, time.perf_counter() - started)
+
+
+def tool_benchmarks(iterations: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """Микробенчмарки инструментов со случайными, но воспроизводимыми фильтрами"""
+    rnd = random.Random(seed)
+
+    def filters() -> Dict:
+        return {
+            "genre": rnd.choice(GENRES),
+            "age_limit": rnd.choice(AGE_LIMITS),
+            "author_origin": rnd.choice(ORIGINS),
+        }
+
+    results = {
+        "tool:get_book_recommendations": measure(
+            lambda: get_book_recommendations.invoke(filters()), iterations),
+        "tool:get_book_recommendations+keywords": measure(
+            lambda: get_book_recommendations.invoke(dict(filters(), keywords=[rnd.choice(KEYWORDS)])), iterations),
+        "tool:get_random_book": measure(
+            lambda: get_random_book.invoke(filters()), iterations),
+        "tool:get_books_count": measure(
+            lambda: get_books_count.invoke({"genre": rnd.choice(GENRES + [None])}), iterations),
+        "tool:add_to_search_history": measure(
+            lambda: add_to_search_history.invoke({
+                "user_id": SCENARIO_USER_OFFSET + rnd.randrange(100),
+                "search_query": "бенчмарк",
+                "results": [{"id": rnd.randrange(1, 1000)} for _ in range(5)]
+            }), iterations),
+    }
+    # Запись истории асинхронная: отдельно меряем, сколько занимает сброс накопленной очереди
+    started = time.perf_counter()
+    history_writer.flush()
+    results["history:flush"] = summarize([time.perf_counter() - started])
+    return results
+
+
+def scenario_benchmarks(model, repeats: int, seed: int) -> Dict[str, Dict[str, float]]:
+    random.seed(seed)
+    timings: Dict[str, List[float]] = {}
+    session = 0
+    for _ in range(repeats):
+        for name in SCENARIOS:
+            run_scenario(name, model, session, timings)
+            session += 1
+    history_writer.flush()
+    return {name: summarize(values) for name, values in timings.items()}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Список регрессий: p95 вырос больше чем на tolerance относительно базовой линии"""
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if not previous or not previous["p95"]:
+            continue
+        ratio = current["p95"] / previous["p95"]
+        marker = "🔺" if ratio > 1 + tolerance else "  "
+        print(f"{marker} {name:45} p95 {previous['p95'] * 1000:9.2f} → {current['p95'] * 1000:9.2f} мс "
+              f"({ratio - 1:+.0%})")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def report(results: Dict):
+    print(f"\n{'операция':47} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'оп/сек':>9}")
+    for name, stats in sorted(results.items()):
+        print(f"{name:47} {stats['p50'] * 1000:9.2f} {stats['p95'] * 1000:9.2f} "
+              f"{stats['p99'] * 1000:9.2f} {stats['throughput']:9.1f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки ассистента на локальном PostgreSQL")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="1k")
+    parser.add_argument("--load", action="store_true", help="заново сгенерировать синтетический каталог")
+    parser.add_argument("--drop", action="store_true", help="удалить синтетические данные после прогона")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--conversations", type=int, default=5, help="повторов каждого сценария")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка фейковой модели, сек")
+    parser.add_argument("--token-latency", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", help="JSON с базовой линией для сравнения")
+    parser.add_argument("--save", help="сохранить результаты в JSON (например, как новую базовую линию)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p95")
+    args = parser.parse_args()
+
+    get_pool()
+    apply_migrations()
+    if args.load:
+        load_synthetic(args.scale, args.seed)
+
+    model = FakeChatModel(latency=args.latency, jitter=args.latency / 5,
+                          token_latency=args.token_latency, genres=GENRES, seed=args.seed)
+    results = tool_benchmarks(args.iterations, args.seed)
+    results.update(scenario_benchmarks(model, args.conversations, args.seed))
+    report(results)
+    usage = usage_stats()
+    print(f"\n🤖 Вызовов модели: {model.calls}, на ход: {usage['calls_per_turn']:.2f}, "
+          f"входных токенов на вызов: {usage['prompt_tokens_per_call']:.0f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"scale": args.scale, "results": results, "usage": usage}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.save}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            print(f"⚠️ Базовая линия снята на масштабе {baseline.get('scale')}, текущий — {args.scale}")
+        print("\n📊 Сравнение с базовой линией:")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n❌ Регрессии: {', '.join(regressions)}")
+        else:
+            print("\n✅ Регрессий нет")
+
+    if args.drop:
+        drop_synthetic()
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import time
+from typing import Dict, List
+from main import ChatState, greet, handle_message
+from database import get_connection
+from profiles import preferences, snapshots
+from ranking import invalidate_profile
+from bench.synthetic import USER_ID_OFFSET
+
+# Сценарии проходят весь конечный автомат ChatState: знакомство, предпочтения и основное меню
+SCENARIOS: Dict[str, List[str]] = {
+    "onboarding": [
+        "Анна", "Фэнтези", "16+", "Зарубежный", "магия, драконы",
+        "рекомендации", "выход",
+    ],
+    "search": [
+        "Иван", "Детектив", "18+", "Русский", "",
+        "найди детектив 18+ про расследование",
+        "найди фантастику про космос и роботов",
+        "найди что-нибудь необычное",
+        "выход",
+    ],
+    "random": [
+        "Мария", "Классика", "12+", "Русский", "семья",
+        "случайная книга", "выбери фантастику 16+", "не знаю", "привет, как дела?",
+        "выход",
+    ],
+}
+
+# Сессии сценариев получают отдельный диапазон user_id, который удаляется вместе с синтетикой
+SCENARIO_USER_OFFSET = USER_ID_OFFSET + 900_000
+
+
+def discard_output(text: str = "", end: str = "\n"):
+    pass
+
+
+def reset_user(user_id: int):
+    """Удаляет сохранённую сессию и предпочтения пользователя сценария вместе с их кэшами:
+    иначе повторный прогон продолжил бы прошлую сессию из main_menu, а не со знакомства"""
+    snapshots.writer.discard(user_id)
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM chat_sessions WHERE user_id = %s;", (user_id,))
+        cur.execute("DELETE FROM user_preferences WHERE user_id = %s;", (user_id,))
+    snapshots.invalidate(user_id)
+    preferences.invalidate(user_id)
+    invalidate_profile(user_id)
+
+
+def run_scenario(name: str, model, session: int, timings: Dict[str, List[float]]):
+    """Прогоняет сценарий и записывает время каждого шага в timings по имени состояния"""
+    reset_user(SCENARIO_USER_OFFSET + session)
+    state = ChatState(user_id=SCENARIO_USER_OFFSET + session, output=discard_output)
+    started = time.perf_counter()
+    greet(state)
+    timings.setdefault("turn:greet", []).append(time.perf_counter() - started)
+
+    for message in SCENARIOS[name]:
+        step = state.current_step
+        turn_started = time.perf_counter()
+        running = handle_message(state, message, model)
+        timings.setdefault(f"turn:{step}", []).append(time.perf_counter() - turn_started)
+        if not running:
+            break
+    timings.setdefault(f"conversation:{name}", []).append(time.perf_counter() - started)
@@ -0,0 +1,147 @@
+import io
+import csv
+import time
+import random
+import argparse
+from typing import Dict, Iterator, List
+from database import get_connection
+from catalog import invalidate_catalog
+from import_books import COLUMNS, NULL, _array_literal, _copy_value
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+# Синтетические записи помечаются префиксом ссылки и диапазоном user_id,
+# чтобы их можно было удалить, не трогая настоящий каталог
+URL_PREFIX = "https://www.litres.ru/bench/"
+USER_ID_OFFSET = 1_000_000
+USER_ID_LIMIT = USER_ID_OFFSET + 1_000_000
+
+GENRES = ["Фэнтези", "Детектив", "Классика", "Фантастика", "Любовный роман", "Ужасы",
+          "Приключения", "Исторический роман", "Триллер", "Поэзия", "Психология", "Биография"]
+ORIGINS = ["Русский", "Зарубежный"]
+AGE_LIMITS = ["0+", "6+", "12+", "16+", "18+"]
+KEYWORDS = ["магия", "драконы", "любовь", "война", "путешествия", "космос", "вампиры", "готика",
+            "расследование", "убийство", "дружба", "семья", "революция", "будущее", "роботы",
+            "море", "пираты", "школа", "взросление", "мистика", "призраки", "политика", "история",
+            "искусство", "музыка", "философия", "психология", "нравственность", "выживание", "тайна"]
+WORDS = ["герой", "город", "судьба", "тайна", "путь", "история", "мир", "время", "надежда", "выбор",
+         "прошлое", "семья", "враг", "дорога", "память", "сила", "правда", "ночь", "дом", "мечта"]
+FIRST_NAMES = ["Анна", "Иван", "Мария", "Пётр", "Елена", "John", "Mary", "Stephen", "Agatha", "Ray"]
+LAST_NAMES = ["Иванов", "Смирнова", "Кузнецов", "Попова", "Орлов", "Smith", "King", "Christie", "Miller", "Brown"]
+
+
+def generate_books(count: int, seed: int = 42) -> Iterator[Dict]:
+    """Детерминированный поток книг с распределением жанров, возрастов и рейтингов, близким к каталогу"""
+    rnd = random.Random(seed)
+    authors = [f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {i}" for i in range(max(count // 20, 10))]
+    for i in range(count):
+        title_words = rnd.sample(WORDS, 2)
+        yield {
+            "title": f"{title_words[0].capitalize()} и {title_words[1]} {i}",
+            "author": rnd.choice(authors),
+            "genre": rnd.choice(GENRES),
+            "age_limit": rnd.choice(AGE_LIMITS),
+            "author_origin": rnd.choice(ORIGINS),
+            "keywords": rnd.sample(KEYWORDS, rnd.randint(2, 4)),
+            "description": " ".join(rnd.choices(WORDS + KEYWORDS, k=rnd.randint(20, 60))).capitalize() + ".",
+            "url": f"{URL_PREFIX}{i}/",
+            "rating": round(rnd.uniform(3.0, 5.0), 1) if rnd.random() > 0.05 else None,
+        }
+
+
+def generate_users(count: int, seed: int = 42) -> Iterator[Dict]:
+    rnd = random.Random(seed + 1)
+    for i in range(count):
+        yield {
+            "user_id": USER_ID_OFFSET + i,
+            "name": rnd.choice(FIRST_NAMES),
+            "preferred_genres": rnd.sample(GENRES, rnd.randint(1, 2)),
+            "preferred_authors": [],
+            "age_limit": rnd.choice(AGE_LIMITS[2:]),
+            "author_origin_preference": rnd.choice(ORIGINS),
+        }
+
+
+def _user_value(value):
+    if value is None:
+        return NULL
+    if isinstance(value, list):
+        return _array_literal(value)
+    return value
+
+
+def _copy(cur, table: str, columns: List[str], rows: Iterator[List], chunk_size: int) -> int:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    loaded = in_buffer = 0
+
+    def flush():
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        writer.writerow(row)
+        in_buffer += 1
+        if in_buffer >= chunk_size:
+            flush()
+            loaded += in_buffer
+            in_buffer = 0
+    if in_buffer:
+        flush()
+        loaded += in_buffer
+    return loaded
+
+
+def drop_synthetic():
+    """Удаляет синтетические книги, пользователей, их историю и сохранённые сессии"""
+    with get_connection() as conn, conn.cursor() as cur:
+        # Диапазон ограничен сверху: выше начинаются user_id сессий (session_users)
+        users = (USER_ID_OFFSET, USER_ID_LIMIT)
+        cur.execute("DELETE FROM search_history WHERE user_id >= %s AND user_id < %s;", users)
+        cur.execute("DELETE FROM user_preferences WHERE user_id >= %s AND user_id < %s;", users)
+        cur.execute("DELETE FROM chat_sessions WHERE user_id >= %s AND user_id < %s;", users)
+        cur.execute("DELETE FROM books WHERE url LIKE %s;", (URL_PREFIX + "%",))
+    invalidate_catalog()
+
+
+def load_synthetic(scale: str, seed: int = 42, chunk_size: int = 50_000) -> Dict[str, int]:
+    """Заполняет локальную БД синтетическим каталогом заданного масштаба (старые синтетические данные удаляются)"""
+    books = SCALES[scale]
+    users = max(books // 10, 10)
+    started = time.monotonic()
+    drop_synthetic()
+
+    user_columns = ["user_id", "name", "preferred_genres", "preferred_authors",
+                    "age_limit", "author_origin_preference"]
+    with get_connection() as conn, conn.cursor() as cur:
+        loaded_books = _copy(
+            cur, "books", COLUMNS,
+            ([_copy_value(column, book[column]) for column in COLUMNS] for book in generate_books(books, seed)),
+            chunk_size
+        )
+        loaded_users = _copy(
+            cur, "user_preferences", user_columns,
+            ([_user_value(user[column]) for column in user_columns] for user in generate_users(users, seed)),
+            chunk_size
+        )
+        cur.execute("ANALYZE books;")
+        cur.execute("ANALYZE user_preferences;")
+    invalidate_catalog()
+
+    print(f"🧪 Синтетические данные ({scale}): {loaded_books} книг, {loaded_users} пользователей "
+          f"за {time.monotonic() - started:.1f} сек")
+    return {"books": loaded_books, "users": loaded_users}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Синтетический каталог для бенчмарков")
+    parser.add_argument("scale", nargs="?", choices=sorted(SCALES), default="1k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drop", action="store_true", help="только удалить синтетические данные")
+    args = parser.parse_args()
+    if args.drop:
+        drop_synthetic()
+    else:
+        load_synthetic(args.scale, args.seed)
@@ -0,0 +1,265 @@
+import os
+import bisect
+import threading
+from typing import Dict, List, Optional, Tuple
+import psycopg2
+from database import get_connection, _connect
+from records import Book, RECORD_COLUMNS, rating_key
+
+CATALOG_INDEX_ENABLED = os.getenv("CATALOG_INDEX", "1") == "1"
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def parse_age_limit(value) -> Optional[int]:
+    """Переводит возрастное ограничение вида '16+' в число (16)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    return int(digits) if digits else None
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога с инвертированными индексами.
+
+    Все списки идентификаторов (posting lists) отсортированы по рейтингу,
+    поэтому top-k по фильтрам — это пересечение списков до первых k совпадений.
+    После построения снимок не меняется: перезагрузка собирает новый и подменяет
+    одну ссылку, поэтому поиск в других потоках работает без блокировки
+    и никогда не смешивает старые списки с новыми книгами.
+    """
+
+    def __init__(self, rows: List[Book], version=None, generation: int = 0):
+        """Строит индексы по записям книг (описания в памяти не хранятся)"""
+        rows = sorted(rows, key=lambda b: rating_key(b.rating, b.id))
+
+        books, order = {}, []
+        by_genre, by_origin, by_keyword, by_age = {}, {}, {}, {}
+        for book in rows:
+            book_id = book.id
+            books[book_id] = book
+            order.append(book_id)
+            by_genre.setdefault(book.genre, []).append(book_id)
+            by_origin.setdefault(book.author_origin, []).append(book_id)
+            for keyword in book.keywords or []:
+                by_keyword.setdefault(keyword, []).append(book_id)
+            age = parse_age_limit(book.age_limit)
+            if age is not None:
+                by_age.setdefault(age, []).append(book_id)
+
+        # Для возраста храним накопленные списки: by_age[16] — все книги с ограничением <= 16
+        ages = sorted(by_age)
+        cumulative, upto = set(), {}
+        for age in ages:
+            cumulative.update(by_age[age])
+            upto[age] = [book_id for book_id in order if book_id in cumulative]
+
+        self.version = version
+        self.generation = generation
+        self.books: Dict[int, Book] = books
+        self.order: List[int] = order
+        self.by_genre: Dict[str, List[int]] = by_genre
+        self.by_origin: Dict[str, List[int]] = by_origin
+        self.by_keyword: Dict[str, List[int]] = by_keyword
+        self.by_age: Dict[int, List[int]] = upto
+        self._ages: List[int] = ages
+        # Множества для проверки вхождения: строятся лениво, ключ — (поле, значение)
+        self._sets: Dict[Tuple, frozenset] = {}
+
+    def _set(self, key: Tuple, posting: List[int]) -> frozenset:
+        result = self._sets.get(key)
+        if result is None:
+            result = self._sets[key] = frozenset(posting)
+        return result
+
+    def _age_posting(self, age_limit) -> Optional[Tuple[Tuple, List[int]]]:
+        max_age = parse_age_limit(age_limit)
+        if max_age is None:
+            return None
+        suitable = [age for age in self._ages if age <= max_age]
+        if not suitable:
+            return ("age", None), []
+        return ("age", suitable[-1]), self.by_age[suitable[-1]]
+
+    def _postings(self, genre=None, age_limit=None, author_origin=None, keywords=None) -> List[Tuple[Tuple, List[int]]]:
+        """Списки по фильтрам вместе с ключами (поле, значение) для кэша множеств"""
+        postings = []
+        if genre:
+            postings.append((("genre", genre), self.by_genre.get(genre, [])))
+        if author_origin:
+            postings.append((("origin", author_origin), self.by_origin.get(author_origin, [])))
+        for keyword in keywords or []:
+            postings.append((("keyword", keyword), self.by_keyword.get(keyword, [])))
+        age_posting = self._age_posting(age_limit)
+        if age_posting is not None:
+            postings.append(age_posting)
+        return postings
+
+    def _order_key(self, book_id: int) -> Tuple:
+        book = self.books[book_id]
+        return rating_key(book.rating, book_id)
+
+    def iter_ids(self, genre=None, age_limit=None, author_origin=None, keywords=None,
+                 after: Tuple = None):
+        """Идентификаторы подходящих книг в порядке убывания рейтинга.
+        after — позиция (rating, id), после которой начинать (следующая страница)"""
+        postings = self._postings(genre, age_limit, author_origin, keywords)
+        base_key, base = min(postings, key=lambda item: len(item[1])) if postings else (None, self.order)
+        others = [self._set(key, posting) for key, posting in postings if key != base_key]
+        # Списки отсортированы тем же ключом, поэтому начало страницы находится бинарным поиском
+        start = 0 if after is None else bisect.bisect_right(base, rating_key(*after), key=self._order_key)
+        for i in range(start, len(base)):
+            book_id = base[i]
+            if all(book_id in other for other in others):
+                yield book_id
+
+    def search(self, genre=None, age_limit=None, author_origin=None,
+               keywords=None, limit: int = 5, after: Tuple = None) -> List[Book]:
+        """Top-k книг по рейтингу с теми же фильтрами, что и get_book_recommendations"""
+        result = []
+        for book_id in self.iter_ids(genre, age_limit, author_origin, keywords, after):
+            result.append(self.books[book_id])
+            if len(result) >= limit:
+                break
+        return result
+
+
+class CatalogIndex:
+    """Каталог книг в памяти: текущий снимок и его актуализация.
+    Актуальность поддерживается через LISTEN books_changed и таблицу catalog_version.
+    Первый снимок строится сразу, последующие — в фоновом потоке: до подмены
+    читатели получают прежний снимок и не ждут перечитывания таблицы.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.snapshot = CatalogSnapshot([])
+        self._listener = None
+        self._reload_lock = threading.Lock()
+        self._reloader = None
+        self._stale = False
+        self._failed = False
+
+    def load(self, rows: List[Book], version=None):
+        """Собирает новый снимок и подменяет им текущий одним присваиванием"""
+        self.snapshot = CatalogSnapshot(rows, version, self.snapshot.generation + 1)
+        self.version = version
+
+    def reload(self):
+        """Перечитывает таблицу books целиком"""
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT version FROM catalog_version;")
+            row = cur.fetchone()
+            version = row[0] if row else None
+            cur.execute(f"SELECT {RECORD_COLUMNS} FROM books;")
+            rows = [Book.from_row(row) for row in cur]
+        self.load(rows, version)
+        print(f"📚 Каталог загружен в память: {len(self.snapshot.books)} книг (версия {version})")
+
+    def _schedule_reload(self):
+        """Запускает перестройку снимка в фоне; изменения во время перестройки дадут ещё один проход"""
+        with self._reload_lock:
+            self._stale = True
+            self._failed = False
+            if self._reloader is not None:
+                return
+            self._reloader = threading.Thread(target=self._reload_loop, name="catalog-reload", daemon=True)
+            self._reloader.start()
+
+    def _reload_loop(self):
+        while True:
+            with self._reload_lock:
+                if not self._stale:
+                    self._reloader = None
+                    return
+                self._stale = False
+            try:
+                self.reload()
+            except psycopg2.Error as e:
+                print(f"⚠️ Каталог не перечитан, пока работает прежний снимок: {e}")
+                with self._reload_lock:
+                    # Повторим при следующем обращении к каталогу
+                    self._failed = True
+                    self._reloader = None
+                return
+
+    def _refresh(self):
+        if self.snapshot.generation == 0:
+            self.reload()
+        else:
+            self._schedule_reload()
+
+    def _listen(self):
+        self._listener = _connect()
+        with self._listener.cursor() as cur:
+            cur.execute("LISTEN books_changed;")
+            cur.execute("SELECT version FROM catalog_version;")
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def _close_listener(self):
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except psycopg2.Error:
+                pass
+            self._listener = None
+
+    def invalidate(self):
+        """Сбрасывает подписку: при следующем обращении версия каталога будет сверена заново"""
+        self.version = None
+        self._close_listener()
+
+    def refresh_if_stale(self):
+        """Перестраивает снимок, если пришло уведомление об изменении books"""
+        if self._failed:
+            self._schedule_reload()
+
+        if self._listener is None or self._listener.closed:
+            # Подписываемся до чтения books, чтобы не пропустить изменения между ними
+            version = self._listen()
+            if self.version is None or version != self.version:
+                self._refresh()
+            return
+
+        try:
+            self._listener.poll()
+        except psycopg2.Error:
+            self._close_listener()
+            self.refresh_if_stale()
+            return
+
+        if self._listener.notifies:
+            self._listener.notifies.clear()
+            self._refresh()
+
+
+def get_catalog() -> Optional[CatalogSnapshot]:
+    """Возвращает актуальный снимок каталога или None, если индекс выключен или недоступен.
+    Снимок не меняется, поэтому вызывающий код может работать с ним без блокировок"""
+    global _catalog
+    if not CATALOG_INDEX_ENABLED:
+        return None
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = CatalogIndex()
+        try:
+            _catalog.refresh_if_stale()
+        except psycopg2.Error as e:
+            print(f"⚠️ Индекс каталога недоступен, использую запросы к БД: {e}")
+            _catalog.invalidate()
+            return None
+        return _catalog.snapshot
+
+
+def invalidate_catalog():
+    """Сбрасывает индекс каталога (например, после массовой загрузки книг):
+    следующее обращение заново построит снимок, не отдавая прежний"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is not None:
+            _catalog.invalidate()
+            _catalog = None
@@ -1,53 +1,475 @@
 import os
 import time
+import random
+import functools
+import threading
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, List, Optional
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN, QueryCanceledError, parse_dsn
+from psycopg2.pool import PoolError
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from tracing import span, count, set_gauge
 
 load_dotenv()
 
-_conn = None
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", "60"))
+DB_READY_INTERVAL = float(os.getenv("DB_READY_INTERVAL", "0.1"))
+DB_READY_MAX_INTERVAL = float(os.getenv("DB_READY_MAX_INTERVAL", "2"))
 
-def wait_for_db(max_retries=5, delay=3):
-    """Ожидание готовности БД с экспоненциальной задержкой"""
-    retries = 0
-    while retries < max_retries:
+# Реплики для чтения: DSN через запятую ("host=replica1 port=5432 dbname=... user=..." или postgresql://...)
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn.strip()]
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", os.getenv("DB_POOL_MAX", "10")))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_EJECT_SECONDS = float(os.getenv("DB_REPLICA_EJECT_SECONDS", "30"))
+# Сколько секунд после записи чтения сессии идут на основной сервер (0 — не закреплять)
+DB_READ_YOUR_WRITES = float(os.getenv("DB_READ_YOUR_WRITES", "5"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_topology = None
+_topology_lock = threading.Lock()
+
+
+def _connect(connect_timeout=5, dsn: str = None):
+    """Открывает новое подключение к основному серверу или, если задан dsn, к реплике"""
+    if dsn:
+        conn = psycopg2.connect(dsn, connect_timeout=connect_timeout, client_encoding="UTF8")
+    else:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            port=int(os.getenv("DB_PORT", "5678")),
+            dbname=os.getenv("POSTGRES_DB"),
+            user=os.getenv("POSTGRES_USER"),
+            password=os.getenv("POSTGRES_PASSWORD"),
+            connect_timeout=connect_timeout,
+            # Строки декодируются один раз драйвером, повторная перекодировка в коде не нужна
+            client_encoding="UTF8"
+        )
+    conn.autocommit = True
+    return conn
+
+
+class ConnectionPool:
+    """Пул подключений с проверкой живости и переподключением"""
+
+    def __init__(self, minconn: int = 1, maxconn: int = 10, timeout: float = 30.0,
+                 check_interval: float = 30.0, initial=None, connect=_connect):
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = max(maxconn, minconn, 1)
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        # Подключения, вернувшиеся в пул раньше этого момента, проверяются SELECT 1 при выдаче:
+        # после обрыва одного подключения (перезапуск сервера) остальные простаивающие тоже под подозрением
+        self._suspect_before = 0.0
+        self._stats = {
+            "checkouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "opened": 0,
+            "reconnects": 0,
+            "failures": 0,
+            "timeouts": 0,
+        }
+
+        for conn in initial or []:
+            self._idle.append((conn, time.monotonic()))
+            self._size += 1
+        while self._size < self.minconn:
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["opened"] += 1
+        return conn
+
+    def _is_alive(self, conn, last_used: float) -> bool:
+        """Дешёвая проверка по состоянию драйвера, запрос SELECT 1 — только для давно простаивающих
+        и для тех, что простаивали во время обрыва другого подключения"""
+        if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - last_used < self.check_interval and last_used >= self._suspect_before:
+            return True
         try:
-            conn = psycopg2.connect(
-                host=os.getenv("DB_HOST"),
-                port=int(os.getenv("DB_PORT", "5678")),
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                connect_timeout=3
-            )
-            conn.close()
-            print("✅ База данных готова")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
             return True
-        except psycopg2.OperationalError as e:
-            retries += 1
-            wait_time = delay * (2 ** retries) 
-            print(f"⚠️ Ожидание БД (попытка {retries}/{max_retries}), жду {wait_time} сек...")
-            time.sleep(wait_time)
-    raise Exception("Не удалось подключиться к БД после нескольких попыток")
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkout(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn, last_used = None, 0.0
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolError(f"Нет свободных подключений за {self.timeout} сек")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif not self._is_alive(conn, last_used):
+                self._discard(conn)
+                conn = self._open()
+                with self._cond:
+                    self._stats["reconnects"] += 1
+        except psycopg2.Error:
+            with self._cond:
+                self._size -= 1
+                self._stats["failures"] += 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        return conn
+
+    def _checkin(self, conn, broken: bool = False):
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or conn.closed:
+                self._size -= 1
+                self._stats["failures"] += 1
+                self._suspect_before = time.monotonic()
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт подключение из пула и возвращает его обратно после использования"""
+        with span("db.checkout"):
+            conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+    def stats(self) -> dict:
+        """Статистика пула: размер, занятость, ожидание и сбои"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._in_use
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / checkouts if checkouts else 0.0
+        return stats
+
+    def close(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+
+
+def wait_for_db(timeout: float = DB_READY_TIMEOUT, interval: float = DB_READY_INTERVAL,
+                max_interval: float = DB_READY_MAX_INTERVAL):
+    """Ожидание готовности БД: частые проверки с ограниченной экспоненциальной задержкой и случайным
+    разбросом (чтобы перезапущенные экземпляры не стучались одновременно), но не дольше timeout.
+    Возвращает первое удачное подключение, чтобы пул использовал его, а не открывал заново."""
+    deadline = time.monotonic() + timeout
+    attempts = 0
+    with span("db.wait_for_db") as current:
+        while True:
+            try:
+                conn = _connect(connect_timeout=2)
+                print("✅ База данных готова")
+                current.set(retries=attempts)
+                return conn
+            except psycopg2.OperationalError as e:
+                attempts += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    current.set(retries=attempts)
+                    break
+                wait_time = min(max_interval, interval * 2 ** attempts, remaining) * random.uniform(0.5, 1.0)
+                if attempts == 1 or attempts % 10 == 0:
+                    print(f"⚠️ Ожидание БД (попытка {attempts}, осталось {remaining:.0f} сек): {e}")
+                time.sleep(wait_time)
+    raise Exception(f"Не удалось подключиться к БД за {timeout:.0f} сек")
+
+
+def get_pool() -> ConnectionPool:
+    """Возвращает общий пул подключений, создавая его при первом обращении"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                first = wait_for_db()
+                try:
+                    _pool = ConnectionPool(
+                        minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                        maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                        timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                        initial=[first]
+                    )
+                    print("✅ Установлено подключение к БД")
+                except Exception as e:
+                    print(f"❌ Ошибка подключения: {e}")
+                    raise
+    return _pool
+
 
 def get_connection():
-    global _conn
-    if _conn is None:
-        wait_for_db() 
-        
+    """Контекстный менеджер: подключение к основному серверу на время блока with.
+    Для записей и чтений, которым нужны самые свежие данные; остальные чтения — get_read_connection"""
+    return get_pool().connection()
+
+
+# Отставание реплики в секундах; 0, если всё полученное уже применено (или это не реплика)
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() IS NULL OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END;
+"""
+
+
+class Replica:
+    """Реплика для чтения: свой пул подключений и состояние исключения"""
+
+    def __init__(self, dsn: str):
+        params = parse_dsn(dsn)
+        self.name = f"{params.get('host', 'localhost')}:{params.get('port', '5432')}"
+        self.pool = ConnectionPool(minconn=0, maxconn=DB_REPLICA_POOL_MAX,
+                                   timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                                   connect=partial(_connect, connect_timeout=2, dsn=dsn))
+        self.ejected_until = 0.0
+        self.checked_at = 0.0
+        self.lag = 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+
+class Topology:
+    """Основной сервер и реплики.
+
+    Чтения уходят на наименее занятую из живых реплик. Реплика, к которой не удалось подключиться,
+    которая оборвала запрос или отстала больше DB_REPLICA_MAX_LAG секунд, исключается на
+    DB_REPLICA_EJECT_SECONDS, после чего снова пробуется. Если живых реплик нет, читаем с основного.
+    Сессия (например, user_id), которая только что писала, DB_READ_YOUR_WRITES секунд читает
+    с основного сервера, чтобы увидеть свои изменения.
+    """
+
+    def __init__(self, replica_dsns: List[str], pin_seconds: float = DB_READ_YOUR_WRITES):
+        self.replicas = [Replica(dsn) for dsn in replica_dsns]
+        self.pin_seconds = pin_seconds
+        self._pinned: Dict[object, float] = {}
+        self._lock = threading.Lock()
+        set_gauge("db_replicas_healthy", len(self.replicas))
+
+    def mark_written(self, session):
+        if session is None or self.pin_seconds <= 0 or not self.replicas:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pinned[session] = now + self.pin_seconds
+            # Истёкшие закрепления чистим заодно, чтобы словарь не рос
+            if len(self._pinned) > 1000:
+                self._pinned = {key: until for key, until in self._pinned.items() if until > now}
+
+    def _is_pinned(self, session) -> bool:
+        if session is None:
+            return False
+        with self._lock:
+            until = self._pinned.get(session)
+        return until is not None and until > time.monotonic()
+
+    def _eject(self, replica: Replica, reason: str):
+        replica.ejected_until = time.monotonic() + DB_REPLICA_EJECT_SECONDS
+        count("db_replica_ejections", replica=replica.name)
+        self._healthy()
+        print(f"⚠️ Реплика {replica.name} исключена на {DB_REPLICA_EJECT_SECONDS:.0f} сек: {reason}")
+
+    def _healthy(self) -> List[Replica]:
+        """Живые реплики; датчик db_replicas_healthy пересчитывается при каждой оценке,
+        поэтому реплика, у которой истёк срок исключения, снова в нём учитывается"""
+        healthy = [replica for replica in self.replicas if replica.healthy()]
+        set_gauge("db_replicas_healthy", len(healthy))
+        return healthy
+
+    def _lagging(self, replica: Replica, conn) -> bool:
+        """Проверка отставания — не чаще раза в DB_REPLICA_CHECK_INTERVAL секунд"""
+        if time.monotonic() - replica.checked_at < DB_REPLICA_CHECK_INTERVAL:
+            return False
+        replica.checked_at = time.monotonic()
+        with conn.cursor() as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            replica.lag = float(cur.fetchone()[0] or 0)
+        return replica.lag > DB_REPLICA_MAX_LAG
+
+    def _acquire(self):
+        """Подключение к наименее занятой живой реплике или (None, None)"""
+        candidates = self._healthy()
+        candidates.sort(key=lambda replica: (replica.pool.stats()["in_use"], random.random()))
+        for replica in candidates:
+            try:
+                with span("db.checkout", replica=replica.name):
+                    conn = replica.pool._checkout()
+            except PoolError:
+                continue
+            except psycopg2.Error as e:
+                self._eject(replica, str(e).strip())
+                continue
+            try:
+                lagging = self._lagging(replica, conn)
+            except psycopg2.Error as e:
+                replica.pool._checkin(conn, broken=True)
+                self._eject(replica, str(e).strip())
+                continue
+            if lagging:
+                replica.pool._checkin(conn)
+                self._eject(replica, f"отставание {replica.lag:.1f} сек")
+                continue
+            return replica, conn
+        return None, None
+
+    @contextmanager
+    def read(self, session=None):
+        replica, conn = (None, None) if self._is_pinned(session) else self._acquire()
+        if replica is None:
+            with get_pool().connection() as conn:
+                yield conn
+            return
+
+        broken = False
         try:
-            _conn = psycopg2.connect(
-                host=os.getenv("DB_HOST"),
-                port=int(os.getenv("DB_PORT", "5678")),
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                connect_timeout=5
-            )
-            _conn.autocommit = True
-            print("✅ Установлено подключение к БД")
-        except Exception as e:
-            print(f"❌ Ошибка подключения: {e}")
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            broken = True
+            self._eject(replica, str(e).strip())
             raise
-    return _conn
\ No newline at end of file
+        finally:
+            replica.pool._checkin(conn, broken)
+
+    def stats(self) -> Dict[str, Dict]:
+        self._healthy()
+        return {
+            replica.name: dict(replica.pool.stats(), healthy=replica.healthy(), lag=replica.lag)
+            for replica in self.replicas
+        }
+
+
+def get_topology() -> Topology:
+    global _topology
+    if _topology is None:
+        with _topology_lock:
+            if _topology is None:
+                _topology = Topology(DB_REPLICA_DSNS)
+                if _topology.replicas:
+                    print(f"✅ Реплики для чтения: {', '.join(r.name for r in _topology.replicas)}")
+    return _topology
+
+
+def get_read_connection(session=None):
+    """Контекстный менеджер: подключение для чтения — к реплике, если они настроены (DB_REPLICA_DSNS).
+    session — ключ сессии (например, user_id) для read-your-writes: после mark_written(session)
+    её чтения какое-то время идут на основной сервер"""
+    return get_topology().read(session)
+
+
+def retry_read(func):
+    """Декоратор для идемпотентных чтений: если подключение из пула оказалось разорванным
+    (сервер закрыл его, пока оно простаивало меньше check_interval), чтение повторяется один раз.
+    Повтор получает уже проверенное подключение: после обрыва пул проверяет простаивавшие SELECT 1.
+    Отмена по statement_timeout не повторяется — второй такой же запрос упадёт так же"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except QueryCanceledError:
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            count("db_read_retries")
+            print(f"⚠️ Подключение к БД разорвано, чтение повторяется: {str(e).strip()}")
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def mark_written(session):
+    """Отмечает запись сессии на основном сервере: её следующие чтения не уйдут на отстающую реплику"""
+    get_topology().mark_written(session)
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def apply_migrations():
+    """Применяет ещё не применённые SQL-миграции из migrations/ в порядке имён файлов"""
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name VARCHAR(255) PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        # Несколько экземпляров приложения не должны применять миграции одновременно
+        cur.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'));")
+        try:
+            cur.execute("SELECT name FROM schema_migrations;")
+            applied = {row[0] for row in cur.fetchall()}
+
+            for name in sorted(os.listdir(MIGRATIONS_DIR)):
+                if not name.endswith(".sql") or name in applied:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                    sql = f.read()
+
+                conn.autocommit = False
+                try:
+                    cur.execute(sql)
+                    cur.execute("INSERT INTO schema_migrations (name) VALUES (%s);", (name,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+                print(f"🛠 Применена миграция {name}")
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'));")
@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+from itertools import product
+from typing import Dict, Iterable, Optional, Tuple
+from database import get_read_connection, retry_read
+from catalog import get_catalog, parse_age_limit
+from tracing import traced
+
+FACETS_TTL = float(os.getenv("FACETS_TTL", "30"))
+
+_facets = None
+_facets_lock = threading.Lock()
+
+
+class FacetCounts:
+    """Число книг для любой комбинации фильтров за O(1).
+
+    Строится из таблицы book_facets, которую поддерживают триггеры на books.
+    Для каждой комбинации (жанр, происхождение автора, возрастная корзина),
+    где любой из фильтров может отсутствовать (None), заранее сложено число книг —
+    так же, как массивы id в BookSampler. Корзина возраста N — книги с ограничением <= N.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str, int, int]], version: Optional[int] = None):
+        rows = list(rows)
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self._ages = sorted({age for _, _, age, _ in rows if age >= 0})
+        self._counts: Dict[Tuple, int] = {}
+
+        for genre, origin, age, count in rows:
+            ages = [None] + ([a for a in self._ages if a >= age] if age >= 0 else [])
+            for key in product((None, genre), (None, origin), ages):
+                self._counts[key] = self._counts.get(key, 0) + count
+
+    def _bucket(self, age_limit) -> Optional[int]:
+        max_age = parse_age_limit(age_limit)
+        if max_age is None:
+            return None
+        suitable = [age for age in self._ages if age <= max_age]
+        return suitable[-1] if suitable else -1
+
+    def count(self, genre=None, age_limit=None, author_origin=None) -> int:
+        return self._counts.get((genre or None, author_origin or None, self._bucket(age_limit)), 0)
+
+
+@traced("facets.load")
+@retry_read
+def load_facets() -> FacetCounts:
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT version FROM catalog_version;")
+        row = cur.fetchone()
+        cur.execute("SELECT genre, author_origin, age_min, count FROM book_facets;")
+        return FacetCounts(cur.fetchall(), row[0] if row else None)
+
+
+def get_facets() -> FacetCounts:
+    """Счётчики для текущей версии каталога.
+    С индексом каталога версия известна по LISTEN без запросов; без него счётчики живут FACETS_TTL секунд"""
+    global _facets
+    catalog = get_catalog()
+    version = catalog.version if catalog is not None else None
+    with _facets_lock:
+        if _facets is None \
+                or (version is not None and (_facets.version is None or _facets.version < version)) \
+                or (version is None and time.monotonic() - _facets.loaded_at > FACETS_TTL):
+            _facets = load_facets()
+        return _facets
+
+
+def count_books(genre: str = None, age_limit=None, author_origin: str = None) -> int:
+    """Число книг по фильтрам без COUNT(*) по таблице books"""
+    return get_facets().count(genre, age_limit, author_origin)
+
+
+def invalidate_facets():
+    """Сбрасывает счётчики: при следующем обращении они будут перечитаны"""
+    global _facets
+    with _facets_lock:
+        _facets = None
@@ -0,0 +1,225 @@
+import os
+import time
+import uuid
+import queue
+import atexit
+import threading
+from datetime import datetime
+from typing import Dict, List
+import psycopg2
+from psycopg2.extras import execute_values, RealDictCursor
+from database import get_connection, get_read_connection, mark_written, retry_read
+
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "2"))
+HISTORY_RETENTION = int(os.getenv("HISTORY_RETENTION", "200"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_RETRIES = int(os.getenv("HISTORY_RETRIES", "3"))
+HISTORY_RETRY_DELAY = float(os.getenv("HISTORY_RETRY_DELAY", "0.5"))
+
+
+class HistoryWriter:
+    """Фоновая (write-behind) запись истории поиска.
+
+    Записи копятся в очереди и сбрасываются в search_history одним многострочным
+    INSERT, когда набралось batch_size записей или прошло flush_interval секунд.
+    После записи у затронутых пользователей остаются только последние retention записей.
+    Сетевые сбои при записи пачки повторяются до retries раз с паузой retry_delay, 2·retry_delay, ...
+    У каждой записи свой entry_id: повтор пачки, уже записанной до обрыва связи, не создаёт дублей.
+    """
+
+    def __init__(self, batch_size: int = HISTORY_BATCH_SIZE, flush_interval: float = HISTORY_FLUSH_INTERVAL,
+                 retention: int = HISTORY_RETENTION, max_queue: int = HISTORY_QUEUE_SIZE,
+                 retries: int = HISTORY_RETRIES, retry_delay: float = HISTORY_RETRY_DELAY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._inflight: List[tuple] = []
+        self._collecting: List[tuple] = []
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0, "retries": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def add(self, user_id: int, query: str, result_ids: List[int]):
+        """Ставит запись в очередь, не дожидаясь БД"""
+        self.start()
+        entry = (user_id, query, list(result_ids), datetime.now().astimezone(), str(uuid.uuid4()))
+        try:
+            self._queue.put(entry, timeout=1)
+            self.stats["queued"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+            print("⚠️ Очередь истории поиска переполнена, запись пропущена")
+
+    def _drain(self, first=None) -> List[tuple]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            # Набираемая пачка видна в pending, пока не перейдёт в _inflight
+            batch = self._collecting = []
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # Поток не должен завершаться: иначе записи будут только копиться в памяти
+                    self.stats["errors"] += 1
+                    print(f"⚠️ Ошибка фоновой записи истории поиска: {e}")
+            self._collecting = []
+
+    def _write(self, batch: List[tuple]):
+        with self._flush_lock:
+            self._inflight = batch
+            try:
+                if not self._insert(batch):
+                    return
+                users = list({entry[0] for entry in batch})
+                # Следующие чтения истории этих пользователей — с основного сервера, где она уже есть
+                for user_id in users:
+                    mark_written(user_id)
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                self._trim(users)
+            finally:
+                self._inflight = []
+
+    def _insert(self, batch: List[tuple]) -> bool:
+        """INSERT пачки; при сбое подключения повторяется с растущей паузой, пока записи остаются в pending.
+        Повтор безопасен: уже записанные entry_id пропускаются. Пачка теряется, только если ошибка
+        в самих данных (не сетевая и не нехватка подключений) или исчерпаны все попытки"""
+        for attempt in range(self.retries + 1):
+            try:
+                with get_connection() as conn, conn.cursor() as cur:
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO search_history (user_id, query, results, ts, entry_id) VALUES %s
+                        ON CONFLICT (entry_id) DO NOTHING;
+                        """,
+                        batch,
+                        template="(%s, %s, %s, %s, %s::uuid)",
+                        page_size=self.batch_size
+                    )
+                return True
+            except Exception as e:
+                self.stats["errors"] += 1
+                transient = not isinstance(e, psycopg2.Error) or \
+                    isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                if not transient or attempt == self.retries:
+                    self.stats["dropped"] += len(batch)
+                    print(f"⚠️ Не удалось записать историю поиска ({len(batch)} записей): {e}")
+                    return False
+                self.stats["retries"] += 1
+                time.sleep(self.retry_delay * 2 ** attempt)
+        return False
+
+    def _trim(self, users: List[int]):
+        """Оставляет у пользователей последние retention записей. Не повторяется при сбое:
+        лишние записи удалит следующая пачка этих пользователей"""
+        if self.retention <= 0:
+            return
+        try:
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM search_history h
+                    USING (
+                        SELECT id FROM (
+                            SELECT id, row_number() OVER (
+                                PARTITION BY user_id ORDER BY ts DESC, id DESC
+                            ) AS rn
+                            FROM search_history
+                            WHERE user_id = ANY(%s)
+                        ) ranked
+                        WHERE rn > %s
+                    ) old
+                    WHERE h.id = old.id;
+                    """,
+                    (users, self.retention)
+                )
+        except psycopg2.Error as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ Не удалось сократить историю поиска: {e}")
+
+    def flush(self):
+        """Синхронно записывает всё, что накопилось в очереди"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def pending(self, user_id: int) -> List[tuple]:
+        """Записи пользователя, которые ещё не дошли до БД"""
+        with self._queue.mutex:
+            queued = list(self._queue.queue)
+        # Пачка из _collecting после начала записи совпадает с _inflight
+        entries = {entry[4]: entry for entry in self._inflight + self._collecting + queued if entry[0] == user_id}
+        return sorted(entries.values(), key=lambda entry: entry[3])
+
+
+history_writer = HistoryWriter()
+
+
+@retry_read
+def get_recent_history(user_id: int, limit: int = 10) -> List[Dict]:
+    """Последние limit записей истории пользователя, включая ещё не записанные в БД.
+    Незаписанные записи читаются до БД, а дубли (пачка записалась между чтениями) отбрасываются по entry_id"""
+    pending = history_writer.pending(user_id)
+    if len(pending) >= limit:
+        return [
+            {"query": query, "results": results, "timestamp": ts.isoformat()}
+            for _, query, results, ts, _ in reversed(pending[-limit:])
+        ]
+
+    with get_read_connection(user_id) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT query, results, ts, entry_id::text AS entry_id FROM search_history
+            WHERE user_id = %s
+            ORDER BY ts DESC, id DESC
+            LIMIT %s;
+            """,
+            (user_id, limit)
+        )
+        stored = cur.fetchall()
+
+    written = {row["entry_id"] for row in stored}
+    entries = [(ts, query, results) for _, query, results, ts, entry_id in pending if entry_id not in written]
+    entries += [(row["ts"], row["query"], row["results"]) for row in stored]
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    return [
+        {"query": query, "results": results, "timestamp": ts.isoformat()}
+        for ts, query, results in entries[:limit]
+    ]
@@ -0,0 +1,272 @@
+import io
+import os
+import csv
+import json
+import time
+import argparse
+from typing import Dict, Iterator, List, Optional
+import psycopg2
+from database import get_connection
+from catalog import parse_age_limit, invalidate_catalog
+from facets import invalidate_facets
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "50000"))
+
+COLUMNS = ["title", "author", "genre", "age_limit", "author_origin", "keywords", "description", "url", "rating"]
+
+# Индексы, без которых upsert не работает, при --defer-indexes не удаляются
+REQUIRED_INDEXES = ("books_pkey", "books_natural_key_idx")
+
+NULL = "\\N"
+
+
+def read_rows(path: str) -> Iterator[Dict]:
+    """Читает CSV (с заголовком) или JSONL построчно, не загружая файл целиком"""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def normalize_keywords(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.strip("{}[]").replace(";", ",").split(",")
+    keywords = []
+    for keyword in value:
+        keyword = str(keyword).strip().strip('"').strip().lower()
+        if keyword and keyword not in keywords:
+            keywords.append(keyword)
+    return keywords
+
+
+def normalize_row(row: Dict) -> Optional[Dict]:
+    """Приводит строку фида к формату books; строки без обязательных полей пропускаются"""
+    book = {column: row.get(column) for column in COLUMNS}
+    for column in ("title", "author", "genre", "author_origin", "url"):
+        book[column] = (book[column] or "").strip()
+        if not book[column]:
+            return None
+
+    age = parse_age_limit(book["age_limit"])
+    book["age_limit"] = f"{age}+" if age is not None else None
+    book["keywords"] = normalize_keywords(book["keywords"])
+    try:
+        book["rating"] = float(book["rating"]) if book["rating"] not in (None, "") else None
+    except ValueError:
+        book["rating"] = None
+    return book
+
+
+def _array_literal(values: List[str]) -> str:
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'"{value}"' for value in escaped) + "}"
+
+
+def _copy_value(column: str, value):
+    if value is None:
+        return NULL
+    if column == "keywords":
+        return _array_literal(value)
+    return value
+
+
+def _defer_indexes(cur) -> List[str]:
+    cur.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'books' AND indexname <> ALL(%s);",
+        (list(REQUIRED_INDEXES),)
+    )
+    definitions = []
+    for name, definition in cur.fetchall():
+        cur.execute(f'DROP INDEX IF EXISTS "{name}";')
+        definitions.append(definition)
+    return definitions
+
+
+# Одно общее повышение версии каталога за весь импорт: пачки пишутся с catalog.defer_version = on
+CATALOG_VERSION_BUMP = [
+    "UPDATE catalog_version SET version = version + 1, updated_at = now();",
+    "SELECT pg_notify('books_changed', version::text) FROM catalog_version;",
+]
+
+
+def _bump_catalog_version(conn):
+    """Поднимает версию каталога отдельной транзакцией: без этого каталог в памяти, счётчики
+    и предрассчитанные рекомендации не узнают о загрузке. Если подключение импорта разорвано — через новое"""
+    try:
+        conn.rollback()
+        with conn.cursor() as cur:
+            for statement in CATALOG_VERSION_BUMP:
+                cur.execute(statement)
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"⚠️ Подключение импорта недоступно ({e}), поднимаю версию каталога через новое")
+        with get_connection() as fresh, fresh.cursor() as cur:
+            for statement in CATALOG_VERSION_BUMP:
+                cur.execute(statement)
+
+
+def _restore_indexes(conn, definitions: List[str]):
+    """Строит заново отложенные индексы, каждый своей транзакцией.
+    Если очередной индекс не построился, печатает оставшиеся CREATE INDEX для ручного запуска"""
+    definitions = [definition.replace(" INDEX ", " INDEX IF NOT EXISTS ", 1) for definition in definitions]
+    for position, definition in enumerate(definitions):
+        print(f"🛠 Восстанавливаю индекс: {definition}")
+        try:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute(definition)
+            conn.commit()
+        except psycopg2.Error as e:
+            print(f"❌ Индекс не восстановлен: {e}\nВыполните вручную:")
+            for remaining in definitions[position:]:
+                print(f"   {remaining};")
+            return
+
+
+def _cleanup(conn, deferred: List[str]):
+    """Версия каталога, индексы и staging восстанавливаются и при ошибке посреди загрузки.
+    Сбой любого шага только печатается, чтобы не скрыть исходную ошибку импорта"""
+    try:
+        _bump_catalog_version(conn)
+    except Exception as e:
+        print(f"❌ Версия каталога не поднята: {e}. Выполните вручную: {' '.join(CATALOG_VERSION_BUMP)}")
+    _restore_indexes(conn, deferred)
+    try:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS books_staging;")
+        conn.commit()
+    except psycopg2.Error as e:
+        # Временная таблица исчезнет вместе с сессией
+        print(f"⚠️ Не удалось удалить books_staging: {e}")
+    try:
+        conn.autocommit = True
+    except psycopg2.Error:
+        # Разорванное подключение пул не вернёт в оборот
+        pass
+
+
+def _flush_chunk(conn, cur, buffer: io.StringIO):
+    buffer.seek(0)
+    # Триггер версии каталога пропускает только эту транзакцию; записи других процессов версию поднимают
+    cur.execute("SET LOCAL catalog.defer_version = 'on';")
+    cur.copy_expert(
+        f"COPY books_staging ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')",
+        buffer
+    )
+    cur.execute(f"""
+        INSERT INTO books ({', '.join(COLUMNS)})
+        SELECT DISTINCT ON (title, author, url) {', '.join(COLUMNS)}
+        FROM books_staging
+        ORDER BY title, author, url, seq DESC
+        ON CONFLICT (title, author, url) DO UPDATE SET
+            genre = EXCLUDED.genre,
+            age_limit = EXCLUDED.age_limit,
+            author_origin = EXCLUDED.author_origin,
+            keywords = EXCLUDED.keywords,
+            description = EXCLUDED.description,
+            rating = EXCLUDED.rating;
+    """)
+    cur.execute("TRUNCATE books_staging;")
+    conn.commit()
+
+
+def import_books(path: str, chunk_size: int = IMPORT_CHUNK_SIZE, defer_indexes: bool = False,
+                 refresh: bool = True, neighbors: bool = False) -> int:
+    """Потоковый импорт каталога через COPY FROM STDIN с upsert по (title, author, url).
+    neighbors — пересчитать и индекс похожих книг (полный пересчёт по всему каталогу, долго)"""
+    started = time.monotonic()
+    loaded = skipped = 0
+
+    with get_connection() as conn, conn.cursor() as cur:
+        conn.autocommit = False
+        deferred = []
+        try:
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS books_staging (
+                    seq BIGSERIAL,
+                    title TEXT, author TEXT, genre TEXT, age_limit TEXT, author_origin TEXT,
+                    keywords TEXT[], description TEXT, url TEXT, rating FLOAT
+                );
+            """)
+            if defer_indexes:
+                deferred = _defer_indexes(cur)
+            conn.commit()
+
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            in_buffer = 0
+            for row in read_rows(path):
+                book = normalize_row(row)
+                if book is None:
+                    skipped += 1
+                    continue
+                writer.writerow([_copy_value(column, book[column]) for column in COLUMNS])
+                in_buffer += 1
+                if in_buffer >= chunk_size:
+                    _flush_chunk(conn, cur, buffer)
+                    loaded += in_buffer
+                    buffer.seek(0)
+                    buffer.truncate()
+                    in_buffer = 0
+                    elapsed = time.monotonic() - started
+                    print(f"📥 Загружено {loaded} книг ({loaded / elapsed:.0f} строк/сек)")
+            if in_buffer:
+                _flush_chunk(conn, cur, buffer)
+                loaded += in_buffer
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+            raise
+        finally:
+            # Версия каталога поднимается один раз в конце, а не после каждой пачки
+            _cleanup(conn, deferred)
+
+        cur.execute("ANALYZE books;")
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Импорт завершён: {loaded} книг за {elapsed:.1f} сек "
+          f"({loaded / elapsed if elapsed else 0:.0f} строк/сек), пропущено {skipped}")
+
+    if refresh:
+        refresh_derived(neighbors)
+    return loaded
+
+
+def refresh_derived(neighbors: bool = False):
+    """Обновляет производные структуры после изменения каталога.
+    Индекс похожих книг — только по явному запросу: для больших каталогов это отдельный офлайн-шаг"""
+    invalidate_catalog()
+    invalidate_facets()
+    if neighbors:
+        try:
+            from similarity import build_neighbors
+            build_neighbors()
+        except ImportError as e:
+            print(f"⚠️ Индекс похожих книг не обновлён: {e}")
+    else:
+        print("ℹ️ Индекс похожих книг не пересчитывался: python similarity.py (или импорт с --neighbors)")
+    # Версия каталога изменилась — все предрассчитанные рекомендации устарели
+    from precompute import precompute_recommendations
+    precompute_recommendations()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт каталога книг из CSV или JSONL")
+    parser.add_argument("path")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="удалить вторичные индексы на время загрузки и построить их заново в конце")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="не обновлять рекомендации после загрузки")
+    parser.add_argument("--neighbors", action="store_true",
+                        help="после загрузки пересчитать и индекс похожих книг")
+    args = parser.parse_args()
+    import_books(args.path, args.chunk_size, args.defer_indexes, not args.no_refresh, args.neighbors)
@@ -0,0 +1,680 @@
+import os
+import re
+import time
+import queue
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+import psycopg2
+from database import get_connection, get_read_connection
+from tracing import span, record, count, set_gauge, TRACING_ENABLED
+
+system_prompt = """
+Ты — AI-ассистент для рекомендации книг. Твоя задача — помогать пользователям находить книги по их предпочтениям.
+Ты можешь рекомендовать книги по жанру, возрастному ограничению, происхождению автора (русский/зарубежный) и ключевым словам.
+Всегда предоставляй ссылку на книгу в сервисе litres.ru.
+Будь дружелюбным и полезным!
+Отвечай кратко и информативно.
+Используй эмодзи для выразительности.
+"""
+
+# Типы вызовов модели: по ним считается статистика и включается/выключается кэш
+CALL_TYPES = (
+    "filters",             # извлечение фильтров для случайной книги
+    "search_params",       # извлечение параметров для «найди»
+    "book_comment",        # комментарий к случайной книге
+    "collection_summary",  # обзор подборки
+    "fallback_advice",     # советы, когда ничего не найдено
+    "welcome",             # приветствие после ввода предпочтений
+    "greeting",            # приветствие после ввода имени
+    "chat",                # свободный диалог
+    "batch",               # несколько задач одного хода в одном запросе (prompts.batch_ask)
+)
+
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_DISABLED = {
+    name.strip() for name in os.getenv("LLM_CACHE_DISABLED", "chat").split(",") if name.strip()
+}
+
+# Срок ответа по типам вызовов, сек: разбор запроса должен быть быстрым, свободный диалог может подождать.
+# Переопределяется списком LLM_DEADLINES=filters:2,chat:20
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "10"))
+LLM_DEADLINES = {
+    "filters": 3.0,
+    "search_params": 3.0,
+    "greeting": 4.0,
+    "welcome": 5.0,
+    "fallback_advice": 5.0,
+    "book_comment": 6.0,
+    "collection_summary": 6.0,
+    "batch": 8.0,
+    "chat": 15.0,
+}
+LLM_DEADLINES.update(
+    (name.strip(), float(seconds))
+    for name, _, seconds in (item.partition(":") for item in os.getenv("LLM_DEADLINES", "").split(","))
+    if seconds.strip()
+)
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "16"))
+
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_SLOW_RATE = float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.8"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+# Вызов считается медленным, если занял больше этой доли своего срока
+LLM_SLOW_FRACTION = 0.5
+
+
+def normalize_prompt(text: str) -> str:
+    """Приводит промпт к каноническому виду: регистр и пробельные символы не влияют на ключ"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class ResponseCache:
+    """LRU-кэш ответов модели с TTL и необязательным хранением в PostgreSQL"""
+
+    def __init__(self, max_size: int = 1000, ttl: int = 86400, persistent: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(call_type: str, system: str, prompt: str) -> str:
+        raw = "\0".join((call_type, normalize_prompt(system), normalize_prompt(prompt)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, call_type: str, field: str):
+        counters = self._stats.setdefault(call_type, {"hits": 0, "misses": 0})
+        counters[field] += 1
+
+    def get(self, call_type: str, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                response, expires_at = item
+                if expires_at > now:
+                    self._items.move_to_end(key)
+                    self._count(call_type, "hits")
+                    return response
+                del self._items[key]
+
+        response = self._load(key) if self.persistent else None
+        with self._lock:
+            if response is None:
+                self._count(call_type, "misses")
+                return None
+            self._count(call_type, "hits")
+            self._remember(key, response)
+        return response
+
+    def put(self, call_type: str, key: str, response: str):
+        with self._lock:
+            self._remember(key, response)
+        if self.persistent:
+            self._store(call_type, key, response)
+
+    def _remember(self, key: str, response: str):
+        self._items[key] = (response, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[str]:
+        try:
+            with get_read_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT response FROM llm_cache
+                    WHERE key = %s AND created_at > now() - make_interval(secs => %s);
+                    """,
+                    (key, self.ttl)
+                )
+                row = cur.fetchone()
+                return row[0] if row else None
+        except psycopg2.Error as e:
+            print(f"⚠️ Кэш ответов в БД недоступен: {e}")
+            return None
+
+    def _store(self, call_type: str, key: str, response: str):
+        try:
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO llm_cache (key, call_type, response)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (key) DO UPDATE SET
+                        response = EXCLUDED.response,
+                        created_at = now();
+                    """,
+                    (key, call_type, response)
+                )
+        except psycopg2.Error as e:
+            print(f"⚠️ Не удалось сохранить ответ в кэш БД: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {call_type: dict(counters) for call_type, counters in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+response_cache = ResponseCache(
+    max_size=LLM_CACHE_SIZE,
+    ttl=LLM_CACHE_TTL,
+    persistent=LLM_CACHE_BACKEND == "postgres"
+)
+
+
+_timings: Dict[str, Dict[str, float]] = {}
+_timings_lock = threading.Lock()
+
+
+def _record_timing(call_type: str, first_token: float, total: float):
+    with _timings_lock:
+        timing = _timings.setdefault(call_type, {
+            "calls": 0, "ttft_total": 0.0, "ttft_max": 0.0, "total_time": 0.0, "total_max": 0.0
+        })
+        timing["calls"] += 1
+        timing["ttft_total"] += first_token
+        timing["ttft_max"] = max(timing["ttft_max"], first_token)
+        timing["total_time"] += total
+        timing["total_max"] = max(timing["total_max"], total)
+
+
+def generation_stats() -> Dict[str, Dict[str, float]]:
+    """Время до первого токена и полное время генерации по типам вызовов (без попаданий в кэш)"""
+    with _timings_lock:
+        result = {}
+        for call_type, timing in _timings.items():
+            calls = timing["calls"]
+            result[call_type] = dict(
+                timing,
+                ttft_avg=timing["ttft_total"] / calls,
+                total_avg=timing["total_time"] / calls
+            )
+        return result
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (около 4 символов на токен), если модель не вернула usage"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def _usage(message, prompt: str, response: str) -> Dict[str, int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {
+        "prompt_tokens": usage.get("input_tokens") or estimate_tokens(system_prompt) + estimate_tokens(prompt),
+        "response_tokens": usage.get("output_tokens") or estimate_tokens(response),
+    }
+
+
+_turn_usage: contextvars.ContextVar = contextvars.ContextVar("turn_usage", default=None)
+_usage_totals = {"turns": 0, "calls": 0, "prompt_tokens": 0, "response_tokens": 0}
+_usage_lock = threading.Lock()
+
+
+def _new_usage() -> Dict[str, int]:
+    return {"calls": 0, "prompt_tokens": 0, "response_tokens": 0}
+
+
+def _count_usage(usage: Dict[str, int]):
+    """Учитывает реальный вызов модели (попадания в кэш не считаются) в текущем ходе и в итогах"""
+    turn = _turn_usage.get()
+    with _usage_lock:
+        for target in (turn, _usage_totals):
+            if target is not None:
+                target["calls"] += 1
+                target["prompt_tokens"] += usage["prompt_tokens"]
+                target["response_tokens"] += usage["response_tokens"]
+
+
+@contextmanager
+def track_usage():
+    """Считает вызовы модели и токены за ход: with track_usage() as usage: ..."""
+    usage = _new_usage()
+    token = _turn_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _turn_usage.reset(token)
+        with _usage_lock:
+            _usage_totals["turns"] += 1
+
+
+def usage_stats() -> Dict[str, float]:
+    """Итоги по всем ходам: вызовов модели на ход и входных токенов на вызов"""
+    with _usage_lock:
+        totals = dict(_usage_totals)
+    totals["calls_per_turn"] = totals["calls"] / totals["turns"] if totals["turns"] else 0.0
+    totals["prompt_tokens_per_call"] = totals["prompt_tokens"] / totals["calls"] if totals["calls"] else 0.0
+    return totals
+
+
+class LazyModel:
+    """Обёртка над моделью, которая создаёт её при первом вызове.
+
+    Тяжёлые импорты (langchain_gigachat) и подключение к GigaChat не задерживают запуск:
+    они происходят на первом шаге диалога, которому нужна модель. Если создать модель
+    не удалось, обёртка становится ложной (if model: ...) и больше не пытается,
+    а обращения к ней бросают LLMUnavailable, как и при недоступной модели.
+    """
+
+    def __init__(self, factory: Callable):
+        self._factory = factory
+        self._model = None
+        self._failed = False
+        self._lock = threading.Lock()
+        self.init_time: Optional[float] = None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if self._failed:
+                        raise LLMUnavailable("Модель недоступна")
+                    started = time.monotonic()
+                    try:
+                        self._model = self._factory()
+                    except Exception as e:
+                        self._failed = True
+                        raise LLMUnavailable(f"Модель недоступна: {e}") from e
+                    self.init_time = time.monotonic() - started
+        return self._model
+
+    def __bool__(self):
+        return not self._failed
+
+    def invoke(self, messages):
+        return self.get().invoke(messages)
+
+    def stream(self, messages):
+        return self.get().stream(messages)
+
+    def astream(self, messages):
+        return self.get().astream(messages)
+
+
+class LLMUnavailable(RuntimeError):
+    """Модель не ответила в срок или автомат разомкнут: вызывающий код показывает шаблонный ответ"""
+
+
+class CircuitBreaker:
+    """Автомат для вызовов модели.
+
+    Замкнут — вызовы идут как обычно, по последним window исходам считаются доли ошибок
+    (включая истёкшие сроки) и медленных ответов. Если одна из них превысила порог, автомат
+    размыкается: open_seconds вызовы сразу отклоняются. Затем он полуразомкнут — пропускает
+    один пробный вызов и по его исходу замыкается или снова размыкается.
+
+    allow() выдаёт номер поколения — он меняется при каждом переходе состояния. Исход вызова,
+    начатого в другом поколении (например, медленный вызов, запущенный до размыкания), не учитывается:
+    иначе он закрыл бы или снова разомкнул автомат вместо пробного вызова.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    # Значение датчика llm_breaker_state
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, window: int = LLM_BREAKER_WINDOW, min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 failure_rate: float = LLM_BREAKER_FAILURE_RATE, slow_rate: float = LLM_BREAKER_SLOW_RATE,
+                 open_seconds: float = LLM_BREAKER_OPEN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._generation = 0
+        self._lock = threading.Lock()
+        set_gauge("llm_breaker_state", self.STATE_VALUES[self.state])
+
+    def allow(self) -> Optional[int]:
+        """Поколение, в котором разрешён вызов, или None, если обращаться к модели сейчас нельзя"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    count("llm_breaker_rejected")
+                    return None
+                self._set(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    count("llm_breaker_rejected")
+                    return None
+                self._probing = True
+            return self._generation
+
+    def record(self, ticket: int, ok: bool, slow: bool = False):
+        """Исход вызова, которому allow() выдал поколение ticket"""
+        with self._lock:
+            if ticket != self._generation:
+                return
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                self._set(self.CLOSED if ok and not slow else self.OPEN)
+                return
+            self._outcomes.append((ok, slow))
+            total = len(self._outcomes)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for ok, _ in self._outcomes if not ok)
+            slow_calls = sum(1 for _, slow in self._outcomes if slow)
+            if failures / total >= self.failure_rate or slow_calls / total >= self.slow_rate:
+                self._set(self.OPEN)
+
+    def release(self, ticket: int):
+        """Вызов прерван вызывающим кодом: исход не учитывается, пробный вызов можно повторить"""
+        with self._lock:
+            if ticket == self._generation:
+                self._probing = False
+
+    def _set(self, state: str):
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+        if state == self.state:
+            return
+        self.state = state
+        self._generation += 1
+        self._outcomes.clear()
+        count("llm_breaker_transitions", state=state)
+        set_gauge("llm_breaker_state", self.STATE_VALUES[state])
+        print({
+            self.OPEN: f"⚡ GigaChat не справляется — {self.open_seconds:.0f} с отвечаю без модели",
+            self.HALF_OPEN: "⚡ Пробую снова обратиться к GigaChat",
+            self.CLOSED: "✅ GigaChat снова отвечает",
+        }[state])
+
+
+llm_breaker = CircuitBreaker()
+
+# Вызовы модели идут в рабочих потоках, чтобы ход не ждал дольше срока; опоздавший поток
+# доработает в фоне, а его ответ будет отброшен
+_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+_END = object()
+
+
+def deadline_for(call_type: str) -> float:
+    return LLM_DEADLINES.get(call_type, LLM_DEADLINE)
+
+
+def _resolve(model):
+    # Создание модели (импорт клиента) не должно съедать срок первого вызова
+    return model.get() if isinstance(model, LazyModel) else model
+
+
+def _acquire() -> int:
+    ticket = llm_breaker.allow()
+    if ticket is None:
+        raise LLMUnavailable("GigaChat временно недоступен")
+    return ticket
+
+
+def _timed_out(call_type: str, deadline: float, ticket: int) -> LLMUnavailable:
+    llm_breaker.record(ticket, False)
+    count("llm_timeouts", call_type=call_type)
+    return LLMUnavailable(f"GigaChat не ответил за {deadline:.0f} с")
+
+
+def _invoke(model, prompt: str, call_type: str):
+    """model.invoke со сроком call_type; исход учитывается автоматом"""
+    model = _resolve(model)
+    ticket = _acquire()
+    deadline = deadline_for(call_type)
+    started = time.monotonic()
+    future = _executor.submit(model.invoke, _messages(prompt))
+    try:
+        message = future.result(timeout=deadline)
+    except FuturesTimeout:
+        raise _timed_out(call_type, deadline, ticket) from None
+    except Exception:
+        llm_breaker.record(ticket, False)
+        raise
+    llm_breaker.record(ticket, True, slow=time.monotonic() - started >= deadline * LLM_SLOW_FRACTION)
+    return message
+
+
+def _stream(model, prompt: str, call_type: str) -> Iterator[str]:
+    """Токены model.stream; если срок истёк, поток генерации останавливается и бросается LLMUnavailable"""
+    model = _resolve(model)
+    ticket = _acquire()
+    deadline = deadline_for(call_type)
+    started = time.monotonic()
+    chunks: queue.Queue = queue.Queue()
+    cancelled = threading.Event()
+
+    def pump():
+        try:
+            for chunk in model.stream(_messages(prompt)):
+                if cancelled.is_set():
+                    return
+                if chunk.content:
+                    chunks.put(chunk.content)
+            chunks.put(_END)
+        except Exception as e:
+            chunks.put(e)
+
+    _executor.submit(pump)
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=max(0.0, started + deadline - time.monotonic()))
+            except queue.Empty:
+                raise _timed_out(call_type, deadline, ticket) from None
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                llm_breaker.record(ticket, False)
+                raise item
+            yield item
+    except GeneratorExit:
+        llm_breaker.release(ticket)
+        raise
+    finally:
+        cancelled.set()
+    llm_breaker.record(ticket, True, slow=time.monotonic() - started >= deadline * LLM_SLOW_FRACTION)
+
+
+async def _astream(model, prompt: str, call_type: str) -> AsyncIterator[str]:
+    """Асинхронный вариант _stream"""
+    model = _resolve(model)
+    ticket = _acquire()
+    deadline = deadline_for(call_type)
+    started = time.monotonic()
+    chunks = model.astream(_messages(prompt)).__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, started + deadline - time.monotonic()))
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                raise _timed_out(call_type, deadline, ticket) from None
+            except Exception:
+                llm_breaker.record(ticket, False)
+                raise
+            if chunk.content:
+                yield chunk.content
+    except GeneratorExit:
+        llm_breaker.release(ticket)
+        raise
+    llm_breaker.record(ticket, True, slow=time.monotonic() - started >= deadline * LLM_SLOW_FRACTION)
+
+
+def _fallback(call_type: str, fallback: Optional[str], error: Exception, current) -> str:
+    if fallback is None:
+        raise error
+    count("llm_fallbacks", call_type=call_type)
+    current.set(fallback=True, error=type(error).__name__)
+    return fallback
+
+
+def breaker_stats() -> Dict:
+    """Состояние автомата и доля последних неудачных вызовов"""
+    with llm_breaker._lock:
+        outcomes = list(llm_breaker._outcomes)
+    return {
+        "state": llm_breaker.state,
+        "recent_calls": len(outcomes),
+        "recent_failures": sum(1 for ok, _ in outcomes if not ok),
+        "recent_slow": sum(1 for _, slow in outcomes if slow),
+    }
+
+
+def _with_context(prompt: str, context: str) -> str:
+    return f"Контекст диалога:\n{context}\n\n{prompt}" if context else prompt
+
+
+def _messages(prompt: str) -> list:
+    # langchain импортируется при первом вызове модели, а не при запуске
+    from langchain.schema import SystemMessage, HumanMessage
+    return [SystemMessage(content=system_prompt), HumanMessage(content=prompt)]
+
+
+def _cache_key(call_type: str, prompt: str, use_cache: bool, context: str = "") -> Optional[str]:
+    # Кэшируются только вызовы без контекста диалога: в контексте имя, история и предпочтения
+    # пользователя, и ответ для одного пользователя не должен попасть к другому
+    if not use_cache or context or call_type in LLM_CACHE_DISABLED:
+        return None
+    return ResponseCache.make_key(call_type, system_prompt, prompt)
+
+
+def ask(model, prompt: str, call_type: str = "chat", use_cache: bool = True, context: str = "",
+        fallback: Optional[str] = None) -> str:
+    """Отправляет промпт модели вместе с системным промптом (и контекстом диалога) и возвращает текст ответа.
+    Если модель не ответила в срок, автомат разомкнут или вызов упал, возвращает fallback
+    (без него ошибка пробрасывается)"""
+    key = _cache_key(call_type, prompt, use_cache, context)
+    prompt = _with_context(prompt, context)
+    with span(f"llm.{call_type}") as current:
+        if key is not None:
+            cached = response_cache.get(call_type, key)
+            if cached is not None:
+                current.set(cached=True)
+                return cached
+
+        started = time.monotonic()
+        try:
+            message = _invoke(model, prompt, call_type)
+        except Exception as e:
+            return _fallback(call_type, fallback, e, current)
+        response = message.content
+        elapsed = time.monotonic() - started
+        _record_timing(call_type, elapsed, elapsed)
+        usage = _usage(message, prompt, response)
+        _count_usage(usage)
+        current.set(cached=False, **usage)
+
+        if key is not None:
+            response_cache.put(call_type, key, response)
+        return response
+
+
+def stream(model, prompt: str, call_type: str, on_token: Callable[[str], None],
+           use_cache: bool = True, context: str = "", fallback: Optional[str] = None) -> str:
+    """Как ask, но передаёт ответ в on_token по мере генерации. Возвращает полный текст.
+    Если срок истёк посреди ответа, показанная часть завершается многоточием"""
+    key = _cache_key(call_type, prompt, use_cache, context)
+    prompt = _with_context(prompt, context)
+    with span(f"llm.{call_type}", streaming=True) as current:
+        if key is not None:
+            cached = response_cache.get(call_type, key)
+            if cached is not None:
+                current.set(cached=True)
+                on_token(cached)
+                return cached
+
+        started = time.monotonic()
+        first_token = None
+        parts = []
+        tokens = _stream(model, prompt, call_type)
+        while True:
+            # Ошибки модели и истёкший срок перехватываются только здесь, а не в on_token
+            try:
+                token = next(tokens)
+            except StopIteration:
+                break
+            except Exception as e:
+                if not parts:
+                    response = _fallback(call_type, fallback, e, current)
+                    on_token(response)
+                    return response
+                # Часть ответа уже показана: обрываем её, в кэш неполный ответ не попадает
+                on_token(" …")
+                current.set(truncated=True, error=type(e).__name__)
+                return "".join(parts) + " …"
+            if first_token is None:
+                first_token = time.monotonic() - started
+            parts.append(token)
+            on_token(token)
+        total = time.monotonic() - started
+        first_token = first_token if first_token is not None else total
+        _record_timing(call_type, first_token, total)
+
+        response = "".join(parts)
+        usage = _usage(None, prompt, response)
+        _count_usage(usage)
+        current.set(cached=False, ttft_ms=round(first_token * 1000, 1), **usage)
+        if key is not None:
+            response_cache.put(call_type, key, response)
+        return response
+
+
+async def astream(model, prompt: str, call_type: str, use_cache: bool = True,
+                  context: str = "", fallback: Optional[str] = None) -> AsyncIterator[str]:
+    """Асинхронный итератор по токенам ответа — для фронтендов, отличных от CLI.
+    Сроки и автомат — как у stream"""
+    key = _cache_key(call_type, prompt, use_cache, context)
+    prompt = _with_context(prompt, context)
+    if key is not None:
+        cached = response_cache.get(call_type, key)
+        if cached is not None:
+            yield cached
+            return
+
+    started = time.monotonic()
+    first_token = None
+    parts = []
+    try:
+        async for token in _astream(model, prompt, call_type):
+            if first_token is None:
+                first_token = time.monotonic() - started
+            parts.append(token)
+            yield token
+    except Exception:
+        if parts:
+            yield " …"
+            return
+        if fallback is None:
+            raise
+        count("llm_fallbacks", call_type=call_type)
+        yield fallback
+        return
+    total = time.monotonic() - started
+    first_token = first_token if first_token is not None else total
+    _record_timing(call_type, first_token, total)
+
+    response = "".join(parts)
+    usage = _usage(None, prompt, response)
+    _count_usage(usage)
+    if TRACING_ENABLED:
+        # Асинхронный генератор не входит в дерево хода: контекст между yield не сохраняется
+        record(f"llm.{call_type}", total, dict(streaming=True, ttft_ms=round(first_token * 1000, 1), **usage))
+    if key is not None:
+        response_cache.put(call_type, key, response)
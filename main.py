@@ -1,40 +1,146 @@
+from startup import FAST_START, LazyModule, startup_timer, start_warm_up
 import os
 import random
-import json
-from typing import List, Dict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
 from dotenv import load_dotenv
-from langchain.schema import SystemMessage, HumanMessage
-from langchain_gigachat.chat_models import GigaChat
-from tools import (
-    get_book_recommendations,
-    save_user_preferences,
-    get_user_preferences,
-    add_to_search_history,
-    get_random_book,
-    get_books_count
-)
-from database import get_connection
+from database import get_pool, apply_migrations
+from facets import count_books
+from llm import ask, stream, LLM_STREAMING, LazyModel, track_usage
+from prompts import ConversationContext, batch_ask
+from query_parser import extract_filters, parse_query
+from profiles import get_preferences, snapshots
+from tracing import span
+from records import Book, with_descriptions, encode_cursor
+import templates
+
+if TYPE_CHECKING:
+    from langchain_gigachat.chat_models import GigaChat
+
+# Инструменты (langchain.tools) и ранжирование (numpy) загружаются при первом обращении
+# или заранее фоновым прогревом — приглашение их не ждёт
+tools = LazyModule("tools")
+ranking = LazyModule("ranking")
 
 load_dotenv()
 
-system_prompt = """
-Ты — AI-ассистент для рекомендации книг. Твоя задача — помогать пользователям находить книги по их предпочтениям.
-Ты можешь рекомендовать книги по жанру, возрастному ограничению, происхождению автора (русский/зарубежный) и ключевым словам.
-Всегда предоставляй ссылку на книгу в сервисе litres.ru.
-Будь дружелюбным и полезным!
-Отвечай кратко и информативно.
-Используй эмодзи для выразительности.
-"""
+PAGE_SIZE = int(os.getenv("RECOMMENDATION_LIMIT", "5"))
+PREFETCH_NEXT_PAGE = os.getenv("PREFETCH_NEXT_PAGE", "1") == "1"
+MORE_COMMANDS = ("ещё", "еще", "дальше")
+RESET_COMMANDS = ("начать заново", "новый пользователь")
+# Постоянный id пользователя консольной версии; без него каждый запуск — новое знакомство
+CLI_USER_ID = os.getenv("CLI_USER_ID")
+SNAPSHOT_VERSION = 1
+
+# Вопросы анкеты: по ним же сессия, восстановленная посреди анкеты, повторяет незаданный ответ
+STEP_PROMPTS = {
+    "get_name": "Как тебя зовут?",
+    "get_genre": "Какой жанр тебе интересен? (например, фантастика, детектив, классика)",
+    "get_age_limit": "🔞 Какой возрастной лимит вас интересует? (например, 12+, 16+, 18+)",
+    "get_author_origin": "🌍 Вы предпочитаете русских или зарубежных авторов?",
+    "get_keywords": "🔤 Какие ключевые слова вас интересуют? (например, 'вампиры, готика')",
+}
+MENU_HINT = "ℹ️ Я могу: 'рекомендовать книги', 'найти по параметрам', 'выбрать случайную', 'ещё', 'начать заново'"
+
+# Следующая страница подгружается в фоне, пока пользователь читает текущую
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+def console_output(text: str = "", end: str = "\n"):
+    print(text, end=end, flush=True)
 
 class ChatState:
-    def __init__(self):
-        self.user_id: int = 1
+    def __init__(self, user_id: int = 1, output=console_output):
+        self.user_id: int = user_id
         self.user_name: str = ""
         self.current_step: str = "get_name"
         self.preferences: Dict = {}
-        self.last_recommendations: List[Dict] = []
+        self.last_recommendations: List[Book] = []
+        # Последний сохранённый снимок: сессия пишется в БД, только если он изменился
+        self.saved_snapshot: Optional[Dict] = None
+        self.context = ConversationContext()
+        self.turn_usage: Dict[str, int] = {}
+        # Постраничный вывод: фильтры последнего поиска, курсор после последней показанной книги
+        # и фоновая загрузка следующей страницы
+        self.page_params: Optional[Dict] = None
+        self.page_cursor: Optional[str] = None
+        self.page_shown: int = 0
+        self.next_page: Optional[Future] = None
+        self.output = output
+
+    def send(self, text: str = "", end: str = "\n"):
+        """Отправляет сообщение пользователю через текущий фронтенд (по умолчанию — консоль)"""
+        self.output(text, end=end)
+
+    @property
+    def last_recommendations(self) -> List[Book]:
+        # Книги восстановленной сессии загружаются по id только при первом обращении
+        if self._last_ids is not None:
+            self._last_recommendations, self._last_ids = ranking.books_by_ids(self._last_ids), None
+        return self._last_recommendations
+
+    @last_recommendations.setter
+    def last_recommendations(self, books: List[Book]):
+        self._last_recommendations, self._last_ids = books, None
+
+    def snapshot(self) -> Dict:
+        """Компактный снимок сессии для chat_sessions: книги хранятся только по id"""
+        ids = self._last_ids if self._last_ids is not None else [book['id'] for book in self._last_recommendations]
+        return {
+            "v": SNAPSHOT_VERSION,
+            "name": self.user_name,
+            "step": self.current_step,
+            "prefs": dict(self.preferences),
+            "last": ids,
+            "page": [dict(self.page_params), self.page_cursor, self.page_shown] if self.page_cursor else None,
+            "context": self.context.snapshot(),
+        }
+
+    def restore(self, snapshot: Dict):
+        self.user_name = snapshot.get("name") or ""
+        self.current_step = snapshot.get("step") or "get_name"
+        self.preferences = dict(snapshot.get("prefs") or {})
+        self._last_recommendations, self._last_ids = [], list(snapshot.get("last") or [])
+        if snapshot.get("page"):
+            params, self.page_cursor, self.page_shown = snapshot["page"]
+            self.page_params = dict(params)
+        self.context.restore(snapshot.get("context") or {})
+        self.saved_snapshot = snapshot
+
+def send_llm(state: ChatState, model: "GigaChat", prompt: str, call_type: str, prefix: str = "",
+             fallback: str = None) -> str:
+    """Выводит ответ модели; в режиме стриминга текст появляется по мере генерации.
+    fallback — шаблонный ответ, если модель не ответила в срок"""
+    context = state.context.render()
+    if not LLM_STREAMING:
+        text = ask(model, prompt, call_type, context=context, fallback=fallback)
+        state.send(f"{prefix}{text}")
+    else:
+        state.send(prefix, end="")
+        text = stream(model, prompt, call_type, lambda token: state.send(token, end=""), context=context,
+                      fallback=fallback)
+        state.send()
+    state.context.note(text)
+    return text
+
+def send_tasks(state: ChatState, model: "GigaChat", tasks: Dict[str, Tuple[str, str, str]]):
+    """Выполняет задачи модели, нужные ходу, одним запросом и выводит ответы по порядку.
+    tasks: тип вызова → (промпт, префикс ответа, шаблонный ответ на случай недоступности модели)"""
+    if len(tasks) == 1:
+        call_type, (prompt, prefix, fallback) = next(iter(tasks.items()))
+        send_llm(state, model, prompt, call_type, prefix, fallback)
+        return
+
+    try:
+        answers = batch_ask(model, {name: prompt for name, (prompt, _, _) in tasks.items()},
+                            state.context.render())
+    except Exception:
+        answers = {}
+    for name, (_, prefix, fallback) in tasks.items():
+        answer = answers.get(name) or fallback
+        state.send(f"{prefix}{answer}")
+        state.context.note(answer)
 
-def format_book(book: Dict) -> str:
+def format_book(book: Book) -> str:
     return (
         f"📖 {book['title']} - {book['author']}\n"
         f"🔹 Жанр: {book['genre']}\n"
@@ -45,9 +151,9 @@ def format_book(book: Dict) -> str:
         f"🔗 Ссылка: {book['url']}\n"
     )
 
-def recommend_random_book(state: ChatState, model: GigaChat, user_input: str):
+def recommend_random_book(state: ChatState, model: "GigaChat", user_input: str):
     """Рекомендация случайной книги с интеллектуальными фильтрами"""
-    print("\n🎲 Анализирую ваш запрос...")
+    state.send("\n🎲 Анализирую ваш запрос...")
     
     filters = {}
     default_filters = {
@@ -61,7 +167,7 @@ def recommend_random_book(state: ChatState, model: GigaChat, user_input: str):
     
     is_default = any(key in user_input.lower() for key in default_filters.keys())
     
-    if not is_default and model:
+    if not is_default:
         try:
             prompt = f"""
             Пользователь запросил: '{user_input}'. 
@@ -69,27 +175,28 @@ def recommend_random_book(state: ChatState, model: GigaChat, user_input: str):
             Доступные фильтры: genre, age_limit, author_origin.
             Пример: {{"genre": "Фантастика", "age_limit": "16+"}}
             """
-            response = model([SystemMessage(content=system_prompt), HumanMessage(content=prompt)])
-            filters = json.loads(response.content)
-            print(f"🔍 Применяю фильтры: {filters}")
+            filters = extract_filters(model, user_input, "filters", prompt)
+            state.send(f"🔍 Применяю фильтры: {filters}")
         except Exception as e:
-            print(f"⚠️ Не удалось разобрать запрос: {str(e)}")
+            state.send(f"⚠️ Не удалось разобрать запрос: {str(e)}")
             filters = {}
 
-    book = get_random_book.invoke({
+    book = tools.get_random_book.invoke({
         "genre": filters.get("genre"),
         "age_limit": filters.get("age_limit"),
         "author_origin": filters.get("author_origin")
     })
     
     if book:
-        print("\n✨ Вот специально для вас:")
-        print(format_book(book))
+        book = with_descriptions([book])[0]
+        state.send("\n✨ Вот специально для вас:")
+        state.send(format_book(book))
+        state.context.note(f"Рекомендована книга: {book['title']} — {book['author']}")
         
-        add_to_search_history.invoke({
+        tools.add_to_search_history.invoke({
             "user_id": state.user_id,
             "search_query": f"Случайная: {user_input}",
-            "results": [dict(book)]
+            "results": [book]
         })
         
         if model:
@@ -101,24 +208,26 @@ def recommend_random_book(state: ChatState, model: GigaChat, user_input: str):
                 объясни почему она подходит под запрос.
                 Используй эмодзи для выразительности.
                 """
-                comment = model([SystemMessage(content=system_prompt), 
-                              HumanMessage(content=prompt)]).content
-                print(f"\n💡 Мой комментарий:\n{comment}")
+                send_llm(state, model, prompt, "book_comment", "\n💡 Мой комментарий:\n",
+                         templates.book_comment(book))
 
                 if random.random() > 0.3:  
-                    similar = get_random_book.invoke({"genre": book['genre']})
-                    if similar and similar['id'] != book['id']:
-                        print(f"\n📚 Возможно вам понравится также: {similar['title']}")
+                    neighbors = tools.get_similar_books.invoke({"book_id": book['id'], "k": 3})
+                    similar = random.choice(neighbors) if neighbors else tools.get_random_book.invoke(
+                        {"genre": book['genre'], "exclude_id": book['id']}
+                    )
+                    if similar:
+                        state.send(f"\n📚 Возможно вам понравится также: {similar['title']}")
             except Exception as e:
-                print(f"\nℹ️ Не удалось получить комментарий: {str(e)}")
+                state.send(f"\nℹ️ Не удалось получить комментарий: {str(e)}")
     else:
-        print("\n😞 К сожалению, ничего не нашлось.")
+        state.send("\n😞 К сожалению, ничего не нашлось.")
         show_fallback_recommendations(state, model, user_input)
 
-def show_fallback_recommendations(state: ChatState, model: GigaChat, user_input: str):
+def show_fallback_recommendations(state: ChatState, model: "GigaChat", user_input: str):
     """Показывает альтернативные варианты при отсутствии результатов"""
-    total_books = get_books_count.invoke({})
-    print(f"\n📚 В моей коллекции {total_books} книг, но по вашему запросу ничего не найдено.")
+    total_books = tools.get_books_count.invoke({})
+    state.send(f"\n📚 В моей коллекции {total_books} книг, но по вашему запросу ничего не найдено.")
     
     if model:
         try:
@@ -130,246 +239,432 @@ def show_fallback_recommendations(state: ChatState, model: GigaChat, user_input:
             2. Ищите "..."
             3. Вам может понравиться "..."
             """
-            advice = model([SystemMessage(content=system_prompt), 
-                         HumanMessage(content=prompt)]).content
-            print(f"\n💡 Попробуйте:\n{advice}")
+            advice = ask(model, prompt, "fallback_advice", fallback=templates.fallback_advice(user_input))
+            state.send(f"\n💡 Попробуйте:\n{advice}")
         except Exception as e:
-            print(f"\nℹ️ Не удалось получить советы: {str(e)}")
+            state.send(f"\nℹ️ Не удалось получить советы: {str(e)}")
 
-    fallback_book = get_random_book.invoke({})
+    fallback_book = tools.get_random_book.invoke({})
     if fallback_book:
-        print("\n🎲 Могу предложить случайную книгу из коллекции:")
-        print(format_book(fallback_book))
+        state.send("\n🎲 Могу предложить случайную книгу из коллекции:")
+        state.send(format_book(fallback_book))
 
-def recommend_books(state: ChatState, model: GigaChat, params: Dict = None):
-    """Рекомендация книг по параметрам с обработкой ошибок кодировки"""
-    if not params:
+def send_availability(state: ChatState, params: Dict):
+    """Сколько книг есть по каждому фильтру в отдельности — подсказка, какой из них ослабить"""
+    parts = []
+    if params.get('genre'):
+        parts.append(f"в жанре «{params['genre']}» — {count_books(genre=params['genre'])}")
+    if params.get('age_limit'):
+        parts.append(f"для возраста {params['age_limit']}+ — {count_books(age_limit=params['age_limit'])}")
+    if params.get('author_origin'):
+        parts.append(f"авторов «{params['author_origin']}» — {count_books(author_origin=params['author_origin'])}")
+    if parts:
+        state.send(f"\n📊 Книг в коллекции: {'; '.join(parts)}.")
+
+def send_page(state: ChatState, books: List[Book], params: Dict):
+    """Выводит страницу книг (нумерация продолжается с предыдущих страниц) и сохраняет её в истории"""
+    books = with_descriptions(books)
+    for i, book in enumerate(books, state.page_shown + 1):
+        state.send(f"\n{i}. {format_book(book)}")
+    state.page_shown += len(books)
+    state.context.note(f"Показаны книги: {', '.join(b['title'] for b in books)}")
+
+    try:
+        query = ", ".join(f"{k}:{v}" for k, v in params.items() if v)
+        tools.add_to_search_history.invoke({
+            "user_id": state.user_id,
+            "search_query": query,
+            "results": books
+        })
+    except Exception as e:
+        state.send(f"\n⚠️ Не удалось сохранить историю: {str(e)}")
+
+def fetch_page(params: Dict, cursor: str) -> List[Book]:
+    return tools.get_book_recommendations.invoke(dict(params, limit=PAGE_SIZE, after=cursor))
+
+def reset_paging(state: ChatState):
+    if state.next_page is not None:
+        state.next_page.cancel()
+    state.page_params, state.page_cursor, state.page_shown, state.next_page = None, None, 0, None
+
+def remember_page(state: ChatState, params: Dict, books: List[Book]):
+    """Запоминает курсор после показанной страницы и начинает загружать следующую"""
+    state.page_params = params
+    state.page_cursor = encode_cursor(books[-1]) if len(books) >= PAGE_SIZE else None
+    state.next_page = None
+    if state.page_cursor is None:
+        return
+    if PREFETCH_NEXT_PAGE:
+        state.next_page = _prefetch_executor.submit(fetch_page, params, state.page_cursor)
+    state.send("\n➡️ Напишите «ещё», чтобы увидеть следующие книги.")
+
+def show_more(state: ChatState):
+    """Следующая страница последнего поиска — по курсору, без повторного поиска с начала"""
+    if not state.page_cursor:
+        state.send("\nℹ️ Больше книг по последнему поиску нет. Попробуйте 'найди ...' или 'рекомендации'.")
+        return
+
+    try:
+        prefetched, state.next_page = state.next_page, None
+        books = prefetched.result() if prefetched is not None else \
+            fetch_page(state.page_params, state.page_cursor)
+    except Exception as e:
+        state.send(f"\n⚠️ Ошибка при загрузке следующей страницы: {str(e)}")
+        return
+
+    if not books:
+        state.page_cursor = None
+        state.send("\nℹ️ Это были все книги по вашему запросу.")
+        return
+
+    state.last_recommendations = books
+    state.send(f"\n📚 Ещё {len(books)} книг:")
+    send_page(state, books, state.page_params)
+    remember_page(state, state.page_params, books)
+
+def recommend_books(state: ChatState, model: "GigaChat", params: Dict = None,
+                    tasks: Dict[str, Tuple[str, str, str]] = None):
+    """Рекомендация книг по параметрам или по профилю пользователя.
+    tasks — другие задачи модели этого хода: они объединяются с обзором подборки в один запрос"""
+    personalized = not params
+    if personalized:
         try:
-            user_prefs = get_user_preferences.invoke({"user_id": state.user_id})
-            if user_prefs:
+            profile = ranking.get_profile(state.user_id)
+            if profile:
                 params = {
-                    "genre": user_prefs.get("preferred_genres", [None])[0],
-                    "age_limit": user_prefs.get("age_limit"),
-                    "author_origin": user_prefs.get("author_origin_preference"),
-                    "keywords": None
+                    "genre": ", ".join(profile.genres) or None,
+                    "age_limit": profile.age_limit,
+                    "author_origin": profile.origin,
+                    "keywords": sorted(profile.keywords, key=profile.keywords.get, reverse=True)[:5] or None
                 }
         except Exception as e:
-            print(f"\n⚠️ Ошибка загрузки предпочтений: {str(e)}")
+            state.send(f"\n⚠️ Ошибка загрузки предпочтений: {str(e)}")
             params = {}
+    params = params or {}
+
+    # Курсором листаются только выборки по фильтрам: персональные рекомендации и так
+    # исключают показанные книги, а полнотекстовый поиск упорядочен не по рейтингу
+    paged = not personalized and not params.get('query')
+    reset_paging(state)
 
-    print("\n🔍 Ищу рекомендации по параметрам:")
+    state.send("\n🔍 Ищу рекомендации по параметрам:")
+    if params.get('query'):
+        state.send(f"• Запрос: {params['query']}")
     if params.get('genre'):
-        print(f"• Жанр: {params['genre']}")
+        state.send(f"• Жанр: {params['genre']}")
     if params.get('age_limit'):
-        print(f"• Возраст: {params['age_limit']}+")
+        state.send(f"• Возраст: {params['age_limit']}+")
     if params.get('author_origin'):
-        print(f"• Автор: {params['author_origin']}")
+        state.send(f"• Автор: {params['author_origin']}")
     if params.get('keywords'):
-        print(f"• Ключевые слова: {', '.join(params['keywords'])}")
+        state.send(f"• Ключевые слова: {', '.join(params['keywords'])}")
 
     try:
-        books = []
-        raw_books = get_book_recommendations.invoke(params)
-
-        for book in raw_books:
-            clean_book = {}
-            for key, value in book.items():
-                if isinstance(value, str):
-                    try:
-                        clean_book[key] = value.encode('utf-8', errors='replace').decode('utf-8')
-                    except:
-                        clean_book[key] = "[данные повреждены]"
-                else:
-                    clean_book[key] = value
-            books.append(clean_book)
+        if personalized:
+            books = ranking.recommend_for_user(state.user_id)
+        elif not count_books(params.get('genre'), params.get('age_limit'), params.get('author_origin')):
+            # По фильтрам в каталоге нет ни одной книги — поиск заведомо пуст
+            books = []
+        elif params.get('query'):
+            books = tools.search_books.invoke(params)
+        else:
+            books = tools.get_book_recommendations.invoke(dict(params, limit=PAGE_SIZE))
 
         state.last_recommendations = books
 
         if not books:
-            print("\n😞 По вашим критериям ничего не найдено.")
+            if model and tasks:
+                send_tasks(state, model, tasks)
+            state.send("\n😞 По вашим критериям ничего не найдено.")
+            if not personalized:
+                send_availability(state, params)
             show_fallback_recommendations(state, model, params)
             return
 
-        print(f"\n📚 Найдено {len(books)} книг:")
-        for i, book in enumerate(books[:5], 1):
-            print(f"\n{i}. {format_book(book)}")
-
-        try:
-            query = ", ".join(f"{k}:{v}" for k, v in params.items() if v)
-            add_to_search_history.invoke({
-                "user_id": state.user_id,
-                "search_query": query,
-                "results": books[:5]  
-            })
-        except Exception as e:
-            print(f"\n⚠️ Не удалось сохранить историю: {str(e)}")
+        state.send(f"\n📚 Найдено {len(books)} книг:")
+        send_page(state, books[:PAGE_SIZE], params)
+        if paged:
+            remember_page(state, params, books)
 
         if model and books:
-            try:
-                titles = ", ".join(b['title'] for b in books[:3])
-                prompt = f"""Я рекомендовал книги: {titles}.
-                Параметры поиска: {params}.
-                Сделай краткий обзор этой подборки (2-3 предложения).
-                Упомяни общие темы или особенности."""
-                comment = model([SystemMessage(content=system_prompt), 
-                              HumanMessage(content=prompt)]).content
-                print(f"\n💡 О подборке:\n{comment}")
-            except Exception as e:
-                print(f"\nℹ️ Не удалось получить описание подборки: {str(e)}")
+            titles = ", ".join(b['title'] for b in books[:3])
+            prompt = f"""Я рекомендовал книги: {titles}.
+            Параметры поиска: {params}.
+            Сделай краткий обзор этой подборки (2-3 предложения).
+            Упомяни общие темы или особенности."""
+            send_tasks(state, model, dict(tasks or {}, collection_summary=(
+                prompt, "\n💡 О подборке:\n", templates.collection_summary(books[:PAGE_SIZE])
+            )))
 
     except Exception as e:
-        print(f"\n🚨 Ошибка при поиске книг: {str(e)}")
-        print("Попробуйте изменить параметры поиска.")
+        state.send(f"\n🚨 Ошибка при поиске книг: {str(e)}")
+        state.send("Попробуйте изменить параметры поиска.")
         show_fallback_recommendations(state, model, params)
 
-def handle_preferences_step(state: ChatState, user_input: str, model: GigaChat):
+def handle_preferences_step(state: ChatState, user_input: str, model: "GigaChat"):
     """Обработка шагов ввода предпочтений"""
     if state.current_step == "get_genre":
         state.preferences["genre"] = user_input
-        print("\n🔞 Какой возрастной лимит вас интересует? (например, 12+, 16+, 18+)")
+        state.send("\n" + STEP_PROMPTS["get_age_limit"])
         state.current_step = "get_age_limit"
     
     elif state.current_step == "get_age_limit":
         state.preferences["age_limit"] = user_input
-        print("\n🌍 Вы предпочитаете русских или зарубежных авторов?")
+        state.send("\n" + STEP_PROMPTS["get_author_origin"])
         state.current_step = "get_author_origin"
     
     elif state.current_step == "get_author_origin":
         state.preferences["author_origin"] = user_input
-        print("\n🔤 Какие ключевые слова вас интересуют? (например, 'вампиры, готика')")
+        state.send("\n" + STEP_PROMPTS["get_keywords"])
         state.current_step = "get_keywords"
     
     elif state.current_step == "get_keywords":
         if user_input:
             state.preferences["keywords"] = [kw.strip() for kw in user_input.split(",")]
 
-        save_user_preferences.invoke({
+        tools.save_user_preferences.invoke({
             "user_id": state.user_id,
             "name": state.user_name,
             "preferred_genres": [state.preferences.get("genre")],
             "age_limit": state.preferences.get("age_limit"),
-            "author_origin_preference": state.preferences.get("author_origin")
+            "author_origin_preference": state.preferences.get("author_origin"),
+            "keywords": state.preferences.get("keywords")
         })
 
-        print("\n✅ Ваши предпочтения сохранены!")
-        if model:
-            try:
-                prompt = f"""
-                Пользователь {state.user_name} указал предпочтения:
-                Жанр: {state.preferences.get('genre')}
-                Возраст: {state.preferences.get('age_limit')}
-                Автор: {state.preferences.get('author_origin')}
-                Ключевые слова: {state.preferences.get('keywords', [])}
-                
-                Напиши персональное приветственное сообщение (2-3 предложения).
-                """
-                welcome = model([SystemMessage(content=system_prompt), 
-                              HumanMessage(content=prompt)]).content
-                print(f"\n💬 {welcome}")
-            except Exception as e:
-                print(f"\nℹ️ {state.user_name}, будем подбирать книги по вашим вкусам!")
+        state.send("\n✅ Ваши предпочтения сохранены!")
+        prompt = f"""
+        Пользователь {state.user_name} указал предпочтения:
+        Жанр: {state.preferences.get('genre')}
+        Возраст: {state.preferences.get('age_limit')}
+        Автор: {state.preferences.get('author_origin')}
+        Ключевые слова: {state.preferences.get('keywords', [])}
 
+        Напиши персональное приветственное сообщение (2-3 предложения).
+        """
+        # Приветствие и обзор подборки запрашиваются у модели одним вызовом
         recommend_books(state, model, {
             "genre": state.preferences.get("genre"),
             "age_limit": state.preferences.get("age_limit"),
             "author_origin": state.preferences.get("author_origin"),
             "keywords": state.preferences.get("keywords", [])
-        })
+        }, tasks={"welcome": (prompt, "\n💬 ", templates.welcome(state.user_name, state.preferences))})
         state.current_step = "main_menu"
 
-def start_chat():
-    """Основная функция запуска чата"""
+def _build_gigachat() -> "GigaChat":
+    # Импорт клиента GigaChat — самая тяжёлая часть запуска, поэтому он отложен до создания модели
+    from langchain_gigachat.chat_models import GigaChat
+    return GigaChat(
+        credentials=os.getenv("GIGACHAT_KEY"),
+        scope=os.getenv("GIGACHAT_SCOPE"),
+        model=os.getenv("GIGACHAT_MODEL"),
+        verify_ssl_certs=False
+    )
+
+def create_model(lazy: bool = FAST_START):
+    """Создаёт клиент GigaChat или возвращает None, если он недоступен.
+    В режиме lazy клиент создаётся при первом обращении к модели"""
+    if lazy:
+        return LazyModel(_build_gigachat)
     try:
-        print("\n🔄 Подключаюсь к базе данных...")
-        conn = get_connection()
-        
-        if not conn:
-            print("❌ Ошибка подключения к БД!")
-            return
+        model = _build_gigachat()
+        print("🤖 GigaChat подключён!")
+        return model
+    except Exception as e:
+        print(f"⚠️ Ошибка GigaChat: {str(e)}")
+        return None
 
-        print("✅ Успешное подключение!")
+def restore_session(state: ChatState) -> bool:
+    """Восстанавливает сессию по user_id: из снимка, а если его нет — из сохранённых предпочтений.
+    Оба источника читаются через кэш профилей, так что вернувшийся пользователь не ждёт ни БД, ни модели"""
+    snapshot = snapshots.get(state.user_id)
+    if snapshot and snapshot.get("v") == SNAPSHOT_VERSION:
+        if snapshot.get("step") == "get_name":
+            # Пользователь начал заново: прежние предпочтения не подставляем
+            return False
+        state.restore(snapshot)
+        return True
 
-        try:
-            model = GigaChat(
-                credentials=os.getenv("GIGACHAT_KEY"),
-                scope=os.getenv("GIGACHAT_SCOPE"),
-                model=os.getenv("GIGACHAT_MODEL"),
-                verify_ssl_certs=False
-            )
-            print("🤖 GigaChat подключён!")
-        except Exception as e:
-            print(f"⚠️ Ошибка GigaChat: {str(e)}")
-            model = None
+    prefs = get_preferences(state.user_id)
+    if not prefs:
+        return False
+    state.user_name = prefs["name"]
+    state.preferences = {
+        "genre": (prefs["preferred_genres"] or [None])[0],
+        "age_limit": prefs["age_limit"],
+        "author_origin": prefs["author_origin_preference"],
+        "keywords": prefs.get("keywords") or [],
+    }
+    state.current_step = "main_menu"
+    return True
+
+def save_session(state: ChatState):
+    """Сохраняет снимок сессии в конце хода, если он изменился (в БД он попадает в фоне)"""
+    snapshot = state.snapshot()
+    if snapshot == state.saved_snapshot:
+        return
+    try:
+        snapshots.put(state.user_id, snapshot)
+        state.saved_snapshot = snapshot
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить сессию: {str(e)}")
+
+def start_over(state: ChatState):
+    """Сбрасывает сессию к знакомству; сохранённый снимок заменится при записи этого хода"""
+    reset_paging(state)
+    state.user_name = ""
+    state.preferences = {}
+    state.last_recommendations = []
+    state.context = ConversationContext()
+    state.current_step = "get_name"
+    state.send("\n🔄 Начнём сначала.")
+    state.send(STEP_PROMPTS["get_name"])
+
+def greet(state: ChatState, with_count: bool = True, wait_db=None, restore: bool = True):
+    """Первое сообщение новой сессии. Вернувшегося пользователя сразу возвращает туда, где он остановился.
+    wait_db — ожидание прогрева БД в режиме быстрого запуска; restore=False — всегда начинать со знакомства"""
+    if with_count:
+        with span("turn", user_id=state.user_id, step="greet"):
+            total_books = tools.get_books_count.invoke({})
+        state.send(f"\n📚 Привет! Я твой книжный ассистент. В моей коллекции {total_books} книг.")
+    else:
+        state.send("\n📚 Привет! Я твой книжный ассистент.")
+
+    restored = False
+    try:
+        if restore:
+            if wait_db is not None:
+                wait_db()
+            with span("session.restore", user_id=state.user_id):
+                restored = restore_session(state)
+    except Exception as e:
+        print(f"⚠️ Не удалось восстановить сессию: {str(e)}")
+
+    if not restored:
+        state.send(STEP_PROMPTS["get_name"])
+    elif state.current_step == "main_menu":
+        state.send(f"👋 С возвращением, {state.user_name}!")
+        state.send(MENU_HINT)
+    else:
+        state.send(f"👋 С возвращением, {state.user_name}! Продолжим знакомство.")
+        state.send(STEP_PROMPTS[state.current_step])
+
+def handle_message(state: ChatState, user_input: str, model: "GigaChat") -> bool:
+    """Обрабатывает одно сообщение пользователя. Возвращает False, когда диалог завершён"""
+    with span("turn", user_id=state.user_id, step=state.current_step) as current, track_usage() as usage:
+        running = _handle_message(state, user_input, model)
+        state.context.end_turn(user_input)
+        state.turn_usage = dict(usage)
+        current.set(model_calls=usage["calls"], prompt_tokens=usage["prompt_tokens"])
+        save_session(state)
+        return running
+
+def _handle_message(state: ChatState, user_input: str, model: "GigaChat") -> bool:
+    if user_input.lower().strip(" !.,") in RESET_COMMANDS:
+        start_over(state)
+    elif state.current_step == "get_name":
+        state.user_name = user_input
+        state.send(f"\n👋 Приятно познакомиться, {state.user_name}!")
+
+        if model:
+            try:
+                prompt = f"""
+                Приветствуй нового пользователя {state.user_name},
+                который будет искать книги. Будь дружелюбным
+                и предложи начать (1-2 предложения).
+                """
+                send_llm(state, model, prompt, "greeting", "\n💬 ", templates.greeting(state.user_name))
+            except Exception as e:
+                state.send("\nℹ️ Давайте подберём вам отличные книги!")
         
-        state = ChatState()
-        total_books = get_books_count.invoke({})
-        print(f"\n📚 Привет! Я твой книжный ассистент. В моей коллекции {total_books} книг.")
-        print("Как тебя зовут?")
+        state.send("\nДавай узнаем твои предпочтения.")
+        state.send(STEP_PROMPTS["get_genre"])
+        state.current_step = "get_genre"
+    
+    elif state.current_step in ["get_genre", "get_age_limit", "get_author_origin", "get_keywords"]:
+        handle_preferences_step(state, user_input, model)
+    
+    elif state.current_step == "main_menu":
+        if user_input.lower().partition(" ")[0].strip("!.,") in MORE_COMMANDS:
+            show_more(state)
+        elif any(word in user_input.lower() for word in ["рекомендации", "книги", "посоветуй", "что почитать"]):
+            recommend_books(state, model)
+        elif any(word in user_input.lower() for word in ["найди", "поиск", "ищи", "найти"]):
+            try:
+                state.send("\n🤖 Анализирую запрос...")
+                parsed = parse_query(user_input)
+                if parsed.remainder:
+                    # Нераспознанный текст ищем полнотекстово, распознанные фильтры применяем как есть
+                    params = dict(parsed.filters, query=parsed.remainder)
+                else:
+                    params = extract_filters(model, user_input, "search_params",
+                                             f"Извлеки параметры поиска из: '{user_input}' в JSON")
+                state.send(f"🔍 Параметры: {params}")
+                recommend_books(state, model, params)
+            except Exception as e:
+                state.send(f"\n⚠️ Ошибка: {str(e)}")
+                state.send("Попробуйте уточнить запрос, например: 'найди фантастику 16+'")
+        elif any(word in user_input.lower() for word in ["случай", "рандом", "не знаю", "выбери", "предложи"]):
+            recommend_random_book(state, model, user_input)
+        elif user_input.lower() in ["выход", "завершить", "стоп"]:
+            state.send("\n📖 До новых встреч! Возвращайтесь за рекомендациями.")
+            return False
+        else:
+            if model:
+                try:
+                    state.send("\n🤖 Обрабатываю запрос...")
+                    response = ask(model, user_input, "chat", context=state.context.render(),
+                                   fallback=templates.chat())
+                    state.send(f"\n💬 {response}")
+                    state.context.note(response)
+                except Exception as e:
+                    state.send(f"\n⚠️ Ошибка: {str(e)}")
+                    state.send("Попробуйте: 'найди книги', 'случайная рекомендация'")
+            else:
+                state.send("\n" + MENU_HINT)
+    return True
+
+def start_chat():
+    """Основная функция запуска чата (CLI)"""
+    try:
+        startup_timer.mark("импорты")
+        if FAST_START:
+            # БД и кэши прогреваются в фоне, приглашение показывается сразу
+            warm = start_warm_up()
+        else:
+            print("\n🔄 Подключаюсь к базе данных...")
+            with startup_timer.phase("БД"):
+                get_pool()
+            print("✅ Успешное подключение!")
+            with startup_timer.phase("миграции"):
+                apply_migrations()
+
+        with startup_timer.phase("модель"):
+            model = create_model()
+
+        # Сессия восстанавливается, только если задан постоянный CLI_USER_ID: иначе все, кто
+        # запускает консоль, были бы пользователем 1 и продолжали бы чужой диалог
+        state = ChatState(user_id=int(CLI_USER_ID)) if CLI_USER_ID else ChatState()
+        greet(state, with_count=not FAST_START, wait_db=warm.wait_db if FAST_START else None,
+              restore=bool(CLI_USER_ID))
+        startup_timer.mark("приглашение")
+        phases = ("импорты", "модель", "приглашение") if FAST_START else \
+            ("импорты", "БД", "миграции", "модель", "приглашение")
+        print(f"⏱ Запуск: {startup_timer.report(*phases)}")
         
         while True:
             try:
+                if FAST_START:
+                    # Сообщения фонового прогрева выводятся между ходами, а не поверх ввода
+                    for message in warm.messages():
+                        state.send(f"\n{message}")
                 user_input = input("\n> ").strip()
                 if not user_input:
                     continue
-                    
-                if state.current_step == "get_name":
-                    state.user_name = user_input
-                    print(f"\n👋 Приятно познакомиться, {state.user_name}!")
-
-                    if model:
-                        try:
-                            prompt = f"""
-                            Приветствуй нового пользователя {state.user_name},
-                            который будет искать книги. Будь дружелюбным
-                            и предложи начать (1-2 предложения).
-                            """
-                            greeting = model([SystemMessage(content=system_prompt), 
-                                          HumanMessage(content=prompt)]).content
-                            print(f"\n💬 {greeting}")
-                        except Exception as e:
-                            print("\nℹ️ Давайте подберём вам отличные книги!")
-                    
-                    print("\nДавай узнаем твои предпочтения.")
-                    print("Какой жанр тебе интересен? (например, фантастика, детектив, классика)")
-                    state.current_step = "get_genre"
-                
-                elif state.current_step in ["get_genre", "get_age_limit", "get_author_origin", "get_keywords"]:
-                    handle_preferences_step(state, user_input, model)
-                
-                elif state.current_step == "main_menu":
-                    if any(word in user_input.lower() for word in ["рекомендации", "книги", "посоветуй", "что почитать"]):
-                        recommend_books(state, model)
-                    elif any(word in user_input.lower() for word in ["найди", "поиск", "ищи", "найти"]):
-                        if model:
-                            try:
-                                print("\n🤖 Анализирую запрос...")
-                                response = model([SystemMessage(content=system_prompt), 
-                                               HumanMessage(content=f"Извлеки параметры поиска из: '{user_input}' в JSON")])
-                                params = json.loads(response.content)
-                                print(f"🔍 Параметры: {params}")
-                                recommend_books(state, model, params)
-                            except Exception as e:
-                                print(f"\n⚠️ Ошибка: {str(e)}")
-                                print("Попробуйте уточнить запрос, например: 'найди фантастику 16+'")
-                        else:
-                            print("\nℹ️ Функция поиска недоступна. Укажите параметры вручную.")
-                    elif any(word in user_input.lower() for word in ["случай", "рандом", "не знаю", "выбери", "предложи"]):
-                        recommend_random_book(state, model, user_input)
-                    elif user_input.lower() in ["выход", "завершить", "стоп"]:
-                        print("\n📖 До новых встреч! Возвращайтесь за рекомендациями.")
-                        break
-                    else:
-                        if model:
-                            try:
-                                print("\n🤖 Обрабатываю запрос...")
-                                response = model([SystemMessage(content=system_prompt), 
-                                               HumanMessage(content=user_input)])
-                                print(f"\n💬 {response.content}")
-                            except Exception as e:
-                                print(f"\n⚠️ Ошибка: {str(e)}")
-                                print("Попробуйте: 'найди книги', 'случайная рекомендация'")
-                        else:
-                            print("\nℹ️ Я могу: 'рекомендовать книги', 'найти по параметрам', 'выбрать случайную'")
+                if FAST_START and state.current_step != "get_name":
+                    # Знакомство обходится без БД, остальным шагам нужны подключение и миграции
+                    warm.wait_db()
+                if not handle_message(state, user_input, model):
+                    break
                         
             except (EOFError, KeyboardInterrupt):
                 print("\n📖 До свидания! Заходите ещё.")
@@ -380,4 +675,4 @@ def start_chat():
         print("Пожалуйста, перезапустите приложение")
 
 if __name__ == "__main__":
-    start_chat()
\ No newline at end of file
+    start_chat()
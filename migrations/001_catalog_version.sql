@@ -0,0 +1,25 @@
+-- Версия каталога: увеличивается при любом изменении books,
+-- in-process индекс (catalog.py) по ней и по NOTIFY понимает, что пора перечитать книги
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO catalog_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = now()
+    RETURNING version INTO new_version;
+    PERFORM pg_notify('books_changed', new_version::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS books_catalog_version ON books;
+CREATE TRIGGER books_catalog_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON books
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
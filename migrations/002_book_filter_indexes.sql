@@ -0,0 +1,18 @@
+-- Числовое возрастное ограничение: '16+' -> 16.
+-- Строковое сравнение age_limit <= '16+' не использует индексы и ошибается ('6+' > '18+').
+ALTER TABLE books ADD COLUMN IF NOT EXISTS age_min SMALLINT
+    GENERATED ALWAYS AS (NULLIF(regexp_replace(age_limit, '\D', '', 'g'), '')::SMALLINT) STORED;
+
+-- genre = ? [AND author_origin = ?] ORDER BY rating DESC: поиск по индексу без сортировки всей таблицы
+CREATE INDEX IF NOT EXISTS books_genre_origin_rating_idx
+    ON books (genre, author_origin, rating DESC NULLS LAST, id);
+
+-- Top-k без фильтра по жанру
+CREATE INDEX IF NOT EXISTS books_rating_idx
+    ON books (rating DESC NULLS LAST, id);
+
+-- keywords @> ARRAY[...]
+CREATE INDEX IF NOT EXISTS books_keywords_gin_idx
+    ON books USING GIN (keywords);
+
+ANALYZE books;
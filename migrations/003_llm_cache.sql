@@ -0,0 +1,9 @@
+-- Постоянный кэш ответов GigaChat (LLM_CACHE_BACKEND=postgres)
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key CHAR(64) PRIMARY KEY,
+    call_type VARCHAR(50) NOT NULL,
+    response TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS llm_cache_created_at_idx ON llm_cache (created_at);
@@ -0,0 +1,23 @@
+-- История поиска: отдельная append-only таблица вместо растущего JSONB-массива в user_preferences
+CREATE TABLE IF NOT EXISTS search_history (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    query TEXT NOT NULL,
+    results INTEGER[] NOT NULL DEFAULT '{}',
+    ts TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS search_history_user_ts_idx ON search_history (user_id, ts DESC);
+
+-- Переносим накопленную историю из user_preferences.search_history
+INSERT INTO search_history (user_id, query, results, ts)
+SELECT
+    p.user_id,
+    COALESCE(entry->>'query', ''),
+    ARRAY(SELECT jsonb_array_elements_text(COALESCE(entry->'results', '[]'::jsonb))::INTEGER),
+    COALESCE((entry->>'timestamp')::TIMESTAMPTZ, now())
+FROM user_preferences p
+CROSS JOIN LATERAL jsonb_array_elements(p.search_history) AS entry
+WHERE jsonb_typeof(p.search_history) = 'array';
+
+UPDATE user_preferences SET search_history = NULL WHERE search_history IS NOT NULL;
@@ -0,0 +1,30 @@
+-- Полнотекстовый поиск по названию, автору, ключевым словам и описанию (русская морфология)
+ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE OR REPLACE FUNCTION books_search_vector(
+    title TEXT, author TEXT, keywords TEXT[], description TEXT
+) RETURNS TSVECTOR AS $$
+    SELECT
+        setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(author, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(array_to_string(keywords, ' '), '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'C');
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION books_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := books_search_vector(NEW.title, NEW.author, NEW.keywords, NEW.description);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS books_search_vector_trigger ON books;
+CREATE TRIGGER books_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, author, keywords, description ON books
+FOR EACH ROW EXECUTE FUNCTION books_search_vector_update();
+
+UPDATE books
+SET search_vector = books_search_vector(title, author, keywords, description)
+WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS books_search_vector_idx ON books USING GIN (search_vector);
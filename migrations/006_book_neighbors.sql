@@ -0,0 +1,7 @@
+-- Предрассчитанные похожие книги (строится similarity.py): поиск похожих — одно чтение по ключу
+CREATE TABLE IF NOT EXISTS book_neighbors (
+    book_id INTEGER PRIMARY KEY REFERENCES books (id) ON DELETE CASCADE,
+    neighbor_ids INTEGER[] NOT NULL,
+    scores REAL[] NOT NULL,
+    built_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
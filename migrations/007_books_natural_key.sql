@@ -0,0 +1,2 @@
+-- Естественный ключ книги для upsert при массовом импорте (import_books.py)
+CREATE UNIQUE INDEX IF NOT EXISTS books_natural_key_idx ON books (title, author, url);
@@ -0,0 +1,24 @@
+-- Время изменения предпочтений: по нему пакетный пересчёт (precompute.py) находит устаревшие рекомендации
+ALTER TABLE user_preferences ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_preferences_updated_at ON user_preferences;
+CREATE TRIGGER user_preferences_updated_at
+BEFORE UPDATE ON user_preferences
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- Предрассчитанные персональные рекомендации: актуальны, пока не изменились
+-- предпочтения пользователя (updated_at) и каталог (catalog_version)
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    user_id INTEGER PRIMARY KEY REFERENCES user_preferences (user_id) ON DELETE CASCADE,
+    book_ids INTEGER[] NOT NULL,
+    scores REAL[] NOT NULL,
+    catalog_version BIGINT NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,95 @@
+-- Число книг по фасетам (жанр, происхождение автора, возраст): подсчёт по любым фильтрам без COUNT(*) по books.
+-- Книги без возрастного ограничения учитываются с age_min = -1
+CREATE TABLE IF NOT EXISTS book_facets (
+    genre VARCHAR(100) NOT NULL,
+    author_origin VARCHAR(50) NOT NULL,
+    age_min SMALLINT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (genre, author_origin, age_min)
+);
+
+-- Триггеры уровня оператора с таблицами переходов: пачка из COPY или INSERT ... SELECT
+-- даёт одно обновление на фасет, а не на строку
+CREATE OR REPLACE FUNCTION book_facets_add() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO book_facets (genre, author_origin, age_min, count)
+    SELECT genre, author_origin, COALESCE(age_min, -1), count(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3
+    ON CONFLICT (genre, author_origin, age_min) DO UPDATE SET count = book_facets.count + EXCLUDED.count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION book_facets_remove() RETURNS trigger AS $$
+BEGIN
+    UPDATE book_facets f SET count = f.count - d.count
+    FROM (
+        SELECT genre, author_origin, COALESCE(age_min, -1) AS age_min, count(*) AS count
+        FROM old_rows
+        GROUP BY 1, 2, 3
+    ) d
+    WHERE f.genre = d.genre AND f.author_origin = d.author_origin AND f.age_min = d.age_min;
+    DELETE FROM book_facets WHERE count <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION book_facets_update() RETURNS trigger AS $$
+BEGIN
+    -- Для UPDATE сначала вычитаем старые значения фасетов, затем добавляем новые
+    UPDATE book_facets f SET count = f.count - d.count
+    FROM (
+        SELECT genre, author_origin, COALESCE(age_min, -1) AS age_min, count(*) AS count
+        FROM old_rows
+        GROUP BY 1, 2, 3
+    ) d
+    WHERE f.genre = d.genre AND f.author_origin = d.author_origin AND f.age_min = d.age_min;
+
+    INSERT INTO book_facets (genre, author_origin, age_min, count)
+    SELECT genre, author_origin, COALESCE(age_min, -1), count(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3
+    ON CONFLICT (genre, author_origin, age_min) DO UPDATE SET count = book_facets.count + EXCLUDED.count;
+
+    DELETE FROM book_facets WHERE count <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION book_facets_truncate() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM book_facets;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS books_facets_insert ON books;
+CREATE TRIGGER books_facets_insert
+AFTER INSERT ON books
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION book_facets_add();
+
+DROP TRIGGER IF EXISTS books_facets_update ON books;
+CREATE TRIGGER books_facets_update
+AFTER UPDATE ON books
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION book_facets_update();
+
+DROP TRIGGER IF EXISTS books_facets_delete ON books;
+CREATE TRIGGER books_facets_delete
+AFTER DELETE ON books
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION book_facets_remove();
+
+DROP TRIGGER IF EXISTS books_facets_truncate ON books;
+CREATE TRIGGER books_facets_truncate
+AFTER TRUNCATE ON books
+FOR EACH STATEMENT EXECUTE FUNCTION book_facets_truncate();
+
+-- Начальное заполнение по текущему каталогу
+TRUNCATE book_facets;
+INSERT INTO book_facets (genre, author_origin, age_min, count)
+SELECT genre, author_origin, COALESCE(age_min, -1), count(*)
+FROM books
+GROUP BY 1, 2, 3;
@@ -0,0 +1,10 @@
+-- Ключевые слова из анкеты раньше не сохранялись
+ALTER TABLE user_preferences ADD COLUMN IF NOT EXISTS keywords TEXT[];
+
+-- Снимок состояния диалога (main.ChatState): вернувшийся пользователь продолжает с того же шага.
+-- Без внешнего ключа: снимок пишется и во время анкеты, до появления строки в user_preferences
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    user_id INTEGER PRIMARY KEY,
+    snapshot JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,10 @@
+-- user_id для сессий, чей фронтенд не передаёт свой: выдаётся из последовательности и закрепляется
+-- за session_id, поэтому разные сессии никогда не получают один и тот же user_id (в отличие от хэша).
+-- Диапазон начинается с 1 000 000 000, чтобы не пересекаться с id фронтендов и синтетических пользователей
+CREATE SEQUENCE IF NOT EXISTS session_user_ids AS INTEGER START WITH 1000000000;
+
+CREATE TABLE IF NOT EXISTS session_users (
+    session_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL UNIQUE DEFAULT nextval('session_user_ids'),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
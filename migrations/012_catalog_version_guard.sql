@@ -0,0 +1,20 @@
+-- Отложенное повышение версии каталога только для своей транзакции: импорт (import_books.py)
+-- выставляет SET LOCAL catalog.defer_version = 'on' и поднимает версию один раз в конце.
+-- Раньше для этого триггер выключался через ALTER TABLE ... DISABLE TRIGGER — глобально,
+-- и записи из других процессов на время загрузки не меняли версию каталога
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    IF current_setting('catalog.defer_version', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    UPDATE catalog_version SET version = version + 1, updated_at = now()
+    RETURNING version INTO new_version;
+    PERFORM pg_notify('books_changed', new_version::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер мог остаться выключенным после прерванного импорта старой версии
+ALTER TABLE books ENABLE TRIGGER books_catalog_version;
@@ -0,0 +1,6 @@
+-- Идентификатор записи истории, который выдаёт клиент (history.HistoryWriter):
+-- повтор пачки после потерянного подтверждения COMMIT не создаёт дублей (ON CONFLICT DO NOTHING),
+-- а чтение истории по нему отбрасывает ещё не записанные записи, которые уже попали в БД
+ALTER TABLE search_history ADD COLUMN IF NOT EXISTS entry_id UUID;
+
+CREATE UNIQUE INDEX IF NOT EXISTS search_history_entry_id_idx ON search_history (entry_id);
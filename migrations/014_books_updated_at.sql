@@ -0,0 +1,8 @@
+-- Время изменения книги: предрассчитанные рекомендации (ranking.py) отбрасывают только книги,
+-- изменённые после расчёта, а не весь список при любом изменении каталога
+ALTER TABLE books ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+DROP TRIGGER IF EXISTS books_updated_at ON books;
+CREATE TRIGGER books_updated_at
+BEFORE UPDATE ON books
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
@@ -0,0 +1,3 @@
+-- Случайная выборка без индекса каталога (tools._sample_books): genre = ? AND id >= ? ORDER BY id LIMIT 1 —
+-- поиск по индексу вместо перебора первичного ключа до первой книги нужного жанра
+CREATE INDEX IF NOT EXISTS books_genre_id_idx ON books (genre, id);
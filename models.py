@@ -1,6 +1,6 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, ARRAY, Float
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Computed, BigInteger, Integer, SmallInteger, String, Text, DateTime, ARRAY, Float, ForeignKey, func
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 
 Base = declarative_base()
 
@@ -11,6 +11,7 @@ class Book(Base):
     author = Column(String(255), nullable=False)
     genre = Column(String(100), nullable=False)
     age_limit = Column(String(10))
+    age_min = Column(SmallInteger, Computed("NULLIF(regexp_replace(age_limit, '\\D', '', 'g'), '')::SMALLINT"))
     author_origin = Column(String(50), nullable=False)
     keywords = Column(ARRAY(String))
     description = Column(String)
@@ -25,4 +26,36 @@ class UserPreferences(Base):
     preferred_authors = Column(ARRAY(String))
     age_limit = Column(String(10))
     author_origin_preference = Column(String(50))
-    search_history = Column(JSONB)
\ No newline at end of file
+    keywords = Column(ARRAY(Text))
+    search_history = Column(JSONB)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class SearchHistory(Base):
+    __tablename__ = "search_history"
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    query = Column(Text, nullable=False)
+    results = Column(ARRAY(Integer), nullable=False, default=list)
+    ts = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    entry_id = Column(UUID(as_uuid=True), unique=True)
+
+class UserRecommendations(Base):
+    __tablename__ = "user_recommendations"
+    user_id = Column(Integer, ForeignKey("user_preferences.user_id", ondelete="CASCADE"), primary_key=True)
+    book_ids = Column(ARRAY(Integer), nullable=False)
+    scores = Column(ARRAY(Float), nullable=False)
+    catalog_version = Column(BigInteger, nullable=False)
+    computed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class BookFacet(Base):
+    __tablename__ = "book_facets"
+    genre = Column(String(100), primary_key=True)
+    author_origin = Column(String(50), primary_key=True)
+    age_min = Column(SmallInteger, primary_key=True)
+    count = Column(BigInteger, nullable=False)
+
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+    user_id = Column(Integer, primary_key=True)
+    snapshot = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from psycopg2.extras import RealDictCursor, execute_values
+from database import get_connection
+from catalog import get_catalog
+from records import Book, RECORD_COLUMNS
+from ranking import BookFeatures, make_profile, PROFILE_HISTORY_SIZE
+
+PRECOMPUTE_TOP_N = int(os.getenv("PRECOMPUTE_TOP_N", "50"))
+PRECOMPUTE_CHUNK = int(os.getenv("PRECOMPUTE_CHUNK", "1000"))
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "4"))
+
+
+def _load_features():
+    """Признаки всех книг и версия каталога, для которой они построены"""
+    catalog = get_catalog()
+    if catalog is not None:
+        return catalog.version, BookFeatures([catalog.books[book_id] for book_id in catalog.order])
+
+    with get_connection() as conn, conn.cursor() as cur:
+        # Версия читается до книг: если каталог изменится во время чтения, результат сочтётся устаревшим
+        cur.execute("SELECT version FROM catalog_version;")
+        version = cur.fetchone()[0]
+        cur.execute(f"SELECT {RECORD_COLUMNS} FROM books;")
+        return version, BookFeatures([Book.from_row(row) for row in cur.fetchall()])
+
+
+def _stale_users(version: int, full: bool) -> List[int]:
+    """Пользователи без рекомендаций или с рекомендациями старше предпочтений или каталога"""
+    with get_connection() as conn, conn.cursor() as cur:
+        if full:
+            cur.execute("SELECT user_id FROM user_preferences ORDER BY user_id;")
+        else:
+            cur.execute(
+                """
+                SELECT p.user_id FROM user_preferences p
+                LEFT JOIN user_recommendations r USING (user_id)
+                WHERE r.user_id IS NULL
+                   OR r.computed_at < p.updated_at
+                   OR r.catalog_version <> %s
+                ORDER BY p.user_id;
+                """,
+                (version,)
+            )
+        return [row[0] for row in cur.fetchall()]
+
+
+def _process_chunk(user_ids: List[int], features: BookFeatures, books_by_id: Dict[int, Book],
+                   version: int, top_n: int) -> int:
+    """Загружает предпочтения и историю пачки пользователей двумя запросами, ранжирует и сохраняет"""
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Момент снимка: предпочтения, изменённые позже, сделают результат устаревшим
+        cur.execute("SELECT now() AS snapshot;")
+        snapshot = cur.fetchone()["snapshot"]
+        cur.execute(
+            """
+            SELECT user_id, preferred_genres, preferred_authors, age_limit, author_origin_preference, keywords
+            FROM user_preferences WHERE user_id = ANY(%s);
+            """,
+            (user_ids,)
+        )
+        prefs = cur.fetchall()
+        cur.execute(
+            """
+            SELECT user_id, results FROM (
+                SELECT user_id, results,
+                       row_number() OVER (PARTITION BY user_id ORDER BY ts DESC, id DESC) AS position
+                FROM search_history WHERE user_id = ANY(%s)
+            ) h
+            WHERE position <= %s;
+            """,
+            (user_ids, PROFILE_HISTORY_SIZE)
+        )
+        shown: Dict[int, set] = {}
+        for row in cur.fetchall():
+            shown.setdefault(row["user_id"], set()).update(row["results"])
+
+    rows = []
+    for row in prefs:
+        user_shown = shown.get(row["user_id"], set())
+        profile = make_profile(row["user_id"], row, user_shown,
+                               [books_by_id[book_id] for book_id in user_shown if book_id in books_by_id])
+        best, scores = features.best(profile, top_n)
+        rows.append((row["user_id"], features.ids[best].tolist(), scores.tolist(), version, snapshot))
+
+    with get_connection() as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO user_recommendations (user_id, book_ids, scores, catalog_version, computed_at) VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                book_ids = EXCLUDED.book_ids,
+                scores = EXCLUDED.scores,
+                catalog_version = EXCLUDED.catalog_version,
+                computed_at = EXCLUDED.computed_at;
+            """,
+            rows,
+            page_size=1000
+        )
+    return len(rows)
+
+
+def precompute_recommendations(full: bool = False, top_n: int = PRECOMPUTE_TOP_N,
+                               chunk_size: int = PRECOMPUTE_CHUNK, workers: int = PRECOMPUTE_WORKERS) -> int:
+    """Пересчитывает рекомендации устаревших пользователей (с full — всех). Возвращает число пользователей"""
+    started = time.monotonic()
+    version, features = _load_features()
+    user_ids = _stale_users(version, full)
+    if not user_ids:
+        print("✅ Предрассчитанные рекомендации актуальны")
+        return 0
+
+    books_by_id = {book.id: book for book in features.books}
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    # Векторные операции NumPy отпускают GIL, а загрузка и запись пачек пересекаются со скорингом
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        done = sum(executor.map(
+            lambda chunk: _process_chunk(chunk, features, books_by_id, version, top_n), chunks
+        ))
+
+    elapsed = time.monotonic() - started
+    print(f"📚 Рекомендации пересчитаны для {done} пользователей за {elapsed:.1f} сек "
+          f"({done / elapsed if elapsed else 0:.0f} пользователей/сек)")
+    return done
+
+
+if __name__ == "__main__":
+    precompute_recommendations(full="--full" in sys.argv)
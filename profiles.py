@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from database import get_connection, get_read_connection, mark_written, retry_read
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+SNAPSHOT_FLUSH_INTERVAL = float(os.getenv("SNAPSHOT_FLUSH_INTERVAL", "5"))
+
+PREFERENCE_COLUMNS = "user_id, name, preferred_genres, preferred_authors, age_limit, author_origin_preference, keywords"
+
+
+class WriteThroughCache:
+    """LRU-кэш записей по user_id со сквозной записью.
+
+    put сначала пишет в БД, затем кладёт сохранённую запись в кэш, поэтому чтение
+    сразу после записи не ходит в БД. Промах читается из БД; отсутствие записи тоже
+    кэшируется, чтобы новый пользователь не порождал запрос на каждом шаге.
+    Записи других процессов становятся видны по истечении ttl.
+    Пока запись читается из БД, у неё ведётся версия: put или invalidate, случившиеся
+    за время чтения, повышают её, и прочитанное (уже устаревшее) значение в кэш не попадает.
+    """
+
+    def __init__(self, load: Callable[[int], Optional[Dict]], store: Callable[[int, Dict], Dict],
+                 max_size: int = PROFILE_CACHE_SIZE, ttl: int = PROFILE_CACHE_TTL):
+        self._load = load
+        self._store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[int, tuple]" = OrderedDict()
+        # user_id -> [число идущих чтений из БД, версия]; только для записей, которые сейчас читаются
+        self._loading: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "stale_loads": 0}
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is not None and item[1] > now:
+                self._items.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return item[0]
+            self.stats["misses"] += 1
+            loading = self._loading.setdefault(user_id, [0, 0])
+            loading[0] += 1
+            version = loading[1]
+        try:
+            value = self._load(user_id)
+        except Exception:
+            with self._lock:
+                self._loaded(user_id, loading)
+            raise
+        with self._lock:
+            self._loaded(user_id, loading)
+            if loading[1] == version:
+                self._remember(user_id, value)
+            else:
+                self.stats["stale_loads"] += 1
+        return value
+
+    def put(self, user_id: int, value: Dict) -> Dict:
+        saved = self._store(user_id, value)
+        with self._lock:
+            self._written(user_id)
+            self._remember(user_id, saved)
+            self.stats["writes"] += 1
+        return saved
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._written(user_id)
+            self._items.pop(user_id, None)
+
+    def _loaded(self, user_id: int, loading: List[int]):
+        loading[0] -= 1
+        if loading[0] == 0:
+            del self._loading[user_id]
+
+    def _written(self, user_id: int):
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def _remember(self, user_id: int, value: Optional[Dict]):
+        """Кладёт запись в кэш; вызывается под self._lock"""
+        self._items[user_id] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+@retry_read
+def _load_preferences(user_id: int) -> Optional[Dict]:
+    with get_read_connection(user_id) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"SELECT {PREFERENCE_COLUMNS} FROM user_preferences WHERE user_id = %s;", (user_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+
+def _store_preferences(user_id: int, prefs: Dict) -> Dict:
+    with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            f"""
+            INSERT INTO user_preferences
+            (user_id, name, preferred_genres, preferred_authors, age_limit, author_origin_preference, keywords)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                name = EXCLUDED.name,
+                preferred_genres = EXCLUDED.preferred_genres,
+                preferred_authors = EXCLUDED.preferred_authors,
+                age_limit = EXCLUDED.age_limit,
+                author_origin_preference = EXCLUDED.author_origin_preference,
+                keywords = EXCLUDED.keywords
+            RETURNING {PREFERENCE_COLUMNS};
+            """,
+            (user_id, prefs["name"], prefs.get("preferred_genres"), prefs.get("preferred_authors"),
+             prefs.get("age_limit"), prefs.get("author_origin_preference"), prefs.get("keywords"))
+        )
+        saved = dict(cur.fetchone())
+        conn.commit()
+    mark_written(user_id)
+    return saved
+
+
+@retry_read
+def _load_snapshot(user_id: int) -> Optional[Dict]:
+    with get_read_connection(user_id) as conn, conn.cursor() as cur:
+        cur.execute("SELECT snapshot FROM chat_sessions WHERE user_id = %s;", (user_id,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def _store_snapshots(batch: Dict[int, Dict]):
+    # Без mark_written: снимки читаются через кэш, а закрепление на основном сервере после
+    # каждого хода отменило бы чтение с реплик для всех остальных данных пользователя
+    with get_connection() as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO chat_sessions (user_id, snapshot) VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET snapshot = EXCLUDED.snapshot, updated_at = now();
+            """,
+            [(user_id, Json(snapshot, dumps=_dumps)) for user_id, snapshot in batch.items()]
+        )
+
+
+def _dumps(value) -> str:
+    # Компактная запись: без пробелов после разделителей и без \u-экранирования кириллицы
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SnapshotWriter:
+    """Фоновая (write-behind) запись снимков сессий.
+
+    Из снимков пользователя нужен только последний, поэтому в очереди хранится один снимок
+    на user_id, и раз в flush_interval секунд все накопившиеся пишутся одним upsert.
+    Ход диалога не ждёт БД. Если запись не удалась, снимки возвращаются в очередь
+    (если за это время не появился более новый) и пишутся при следующем сбросе.
+    """
+
+    def __init__(self, flush_interval: float = SNAPSHOT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, Dict] = {}
+        self._inflight: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "errors": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def add(self, user_id: int, snapshot: Dict) -> Dict:
+        """Ставит снимок в очередь, заменяя ещё не записанный снимок того же пользователя"""
+        self.start()
+        with self._lock:
+            self._pending[user_id] = snapshot
+            self.stats["queued"] += 1
+        return snapshot
+
+    def pending(self, user_id: int) -> Optional[Dict]:
+        """Снимок пользователя, который ещё не дошёл до БД"""
+        with self._lock:
+            return self._pending.get(user_id, self._inflight.get(user_id))
+
+    def discard(self, user_id: int):
+        """Отменяет незаписанный снимок (например, перед удалением сессии из БД)"""
+        with self._flush_lock, self._lock:
+            self._pending.pop(user_id, None)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Синхронно записывает все накопившиеся снимки"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return
+            try:
+                _store_snapshots(batch)
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+            except Exception as e:
+                # Любая ошибка (не только БД) оставляет снимки в очереди и не останавливает поток записи
+                self.stats["errors"] += 1
+                print(f"⚠️ Не удалось сохранить сессии ({len(batch)}), повторю позже: {e}")
+                with self._lock:
+                    for user_id, snapshot in batch.items():
+                        self._pending.setdefault(user_id, snapshot)
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+class SnapshotCache(WriteThroughCache):
+    """Кэш снимков сессий с отложенной записью: put сразу обновляет кэш,
+    а в БД снимок попадает через SnapshotWriter. Незаписанный снимок виден и после вытеснения из кэша"""
+
+    def __init__(self, writer: SnapshotWriter, **kwargs):
+        super().__init__(_load_snapshot, writer.add, **kwargs)
+        self.writer = writer
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        pending = self.writer.pending(user_id)
+        return pending if pending is not None else super().get(user_id)
+
+
+preferences = WriteThroughCache(_load_preferences, _store_preferences)
+snapshot_writer = SnapshotWriter()
+snapshots = SnapshotCache(snapshot_writer)
+
+
+def get_preferences(user_id: int) -> Optional[Dict]:
+    """Предпочтения пользователя из кэша (при промахе — из БД)"""
+    return preferences.get(user_id)
+
+
+def save_preferences(user_id: int, name: str, preferred_genres: List[str] = None,
+                     preferred_authors: List[str] = None, age_limit: str = None,
+                     author_origin_preference: str = None, keywords: List[str] = None) -> Dict:
+    """Сохраняет предпочтения в БД и сразу обновляет кэш"""
+    return preferences.put(user_id, {
+        "name": name,
+        "preferred_genres": preferred_genres,
+        "preferred_authors": preferred_authors,
+        "age_limit": age_limit,
+        "author_origin_preference": author_origin_preference,
+        "keywords": keywords,
+    })
@@ -0,0 +1,120 @@
+import os
+import re
+import json
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+from llm import ask, estimate_tokens, LLMUnavailable
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "4"))
+
+# Длина строки, до которой сжимаются старые реплики в сводке
+SUMMARY_LINE_LENGTH = 80
+
+ROLE_NAMES = {"user": "Пользователь", "assistant": "Ассистент"}
+
+
+def _condense(text: str, limit: int = SUMMARY_LINE_LENGTH) -> str:
+    """Первое предложение реплики, обрезанное до limit символов"""
+    text = re.sub(r"\s+", " ", text).strip()
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1].rstrip() + "…"
+
+
+class ConversationContext:
+    """Скользящий контекст диалога с бюджетом токенов.
+
+    Последние реплики хранятся целиком; когда бюджет превышен, самые старые
+    сжимаются до первого предложения и уходят в сводку, а сводка, в свою очередь,
+    теряет самые старые строки. Реплики ассистента за ход копятся в pending
+    и попадают в контекст вместе с сообщением пользователя в конце хода.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, recent_turns: int = CONTEXT_RECENT_TURNS):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self.summary: Deque[str] = deque()
+        self.messages: Deque[Tuple[str, str]] = deque()
+        self.pending: List[str] = []
+
+    def note(self, text: str):
+        """Реплика ассистента в текущем ходе"""
+        if text:
+            self.pending.append(text)
+
+    def end_turn(self, user_input: str):
+        self.messages.append(("user", user_input))
+        if self.pending:
+            self.messages.append(("assistant", "\n".join(self.pending)))
+            self.pending = []
+        self._compress()
+
+    def tokens(self) -> int:
+        return sum(estimate_tokens(line) for line in self.summary) + \
+            sum(estimate_tokens(text) for _, text in self.messages)
+
+    def _compress(self):
+        # Реплик в полном виде не больше recent_turns ходов (по две на ход) и не больше бюджета
+        while self.messages and (len(self.messages) > self.recent_turns * 2 or self.tokens() > self.budget):
+            role, text = self.messages.popleft()
+            self.summary.append(f"{ROLE_NAMES[role]}: {_condense(text)}")
+        while self.summary and self.tokens() > self.budget:
+            self.summary.popleft()
+
+    def render(self) -> str:
+        parts = []
+        if self.summary:
+            parts.append("Ранее в диалоге:\n" + "\n".join(self.summary))
+        if self.messages:
+            parts.append("\n".join(f"{ROLE_NAMES[role]}: {text}" for role, text in self.messages))
+        return "\n\n".join(parts)
+
+    def snapshot(self) -> Dict:
+        """Сводка и реплики для сохранения сессии (незавершённый ход не сохраняется)"""
+        return {"summary": list(self.summary), "messages": [list(message) for message in self.messages]}
+
+    def restore(self, data: Dict):
+        self.summary = deque(data.get("summary") or [])
+        self.messages = deque(tuple(message) for message in data.get("messages") or [])
+        self.pending = []
+        self._compress()
+
+
+def _parse_json(text: str) -> Dict:
+    """JSON-объект из ответа модели (в том числе обёрнутый в ```json ... ```)"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        parsed = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def batch_ask(model, tasks: Dict[str, str], context: str = "") -> Dict[str, str]:
+    """Выполняет несколько задач одним запросом к модели: ответ — JSON с полем на каждую задачу.
+    Задачи, для которых модель не вернула поле, досылаются по отдельности; если модель недоступна,
+    поля в результате нет"""
+    if len(tasks) == 1:
+        name, instruction = next(iter(tasks.items()))
+        return {name: ask(model, instruction, name, context=context)}
+
+    fields = ", ".join(f'"{name}"' for name in tasks)
+    prompt = "Выполни несколько задач за один ответ.\n\n" + "\n\n".join(
+        f'Задача "{name}":\n{instruction.strip()}' for name, instruction in tasks.items()
+    ) + f"\n\nВерни только JSON-объект с полями {fields}: в каждом поле — текст ответа на задачу, без пояснений."
+
+    parsed = _parse_json(ask(model, prompt, "batch", context=context))
+    results = {}
+    for name, instruction in tasks.items():
+        value = parsed.get(name)
+        if isinstance(value, str) and value.strip():
+            results[name] = value.strip()
+            continue
+        try:
+            results[name] = ask(model, instruction, name, context=context)
+        except LLMUnavailable:
+            # Модель перестала отвечать: для этой задачи будет показан шаблонный ответ
+            continue
+    return results
@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import difflib
+import threading
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+from database import get_read_connection, retry_read
+from catalog import get_catalog
+from llm import ask, LLMUnavailable
+
+QUERY_PARSER_THRESHOLD = float(os.getenv("QUERY_PARSER_THRESHOLD", "0.6"))
+VOCABULARY_TTL = 300
+
+ParseResult = namedtuple("ParseResult", ["filters", "confidence", "remainder"])
+
+_ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ом", "ем",
+    "ам", "ям", "ах", "ях", "ов", "ев", "ую", "юю", "ия", "ии", "ию",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+
+STOP_WORDS = {
+    "найди", "найти", "поиск", "ищи", "ищу", "хочу", "покажи", "посоветуй", "подбери", "предложи",
+    "выбери", "книга", "книги", "книгу", "книг", "книжку", "книжки", "что", "нибудь", "почитать",
+    "про", "о", "об", "и", "в", "во", "на", "с", "со", "для", "мне", "меня", "какую", "какой", "какие",
+    "автор", "автора", "авторы", "авторов", "писатель", "писателя", "писателей", "жанр", "жанре",
+    "лет", "год", "года", "возраст", "от", "до", "не", "старше", "пожалуйста", "плюс", "или",
+    "случайная", "случайную", "рандом", "интересную", "хорошую", "можно",
+}
+
+# Синонимы сводятся к основе слова, которая встречается в словаре каталога
+SYNONYMS = {
+    "фентез": "фэнтез", "fantasy": "фэнтез",
+    "sci": "фантастик", "научн": "фантастик", "научнофантастическ": "фантастик",
+    "хоррор": "ужас", "страшн": "ужас", "horror": "ужас",
+    "детективн": "детектив", "расследовани": "детектив",
+    "романтик": "любовн", "романтическ": "любовн", "любов": "любовн",
+    "классическ": "классик",
+    "отечественн": "русск", "российск": "русск", "наш": "русск",
+    "иностранн": "зарубежн", "заграничн": "зарубежн", "западн": "зарубежн", "переводн": "зарубежн",
+}
+
+AGE_PATTERN = re.compile(r"(\d{1,2})\s*(?:\+|лет|года?)")
+WORD_PATTERN = re.compile(r"[a-zа-я0-9]+")
+
+_vocabulary = None
+_vocabulary_key = None
+_vocabulary_lock = threading.Lock()
+
+parser_stats = {"fast_path": 0, "llm_path": 0}
+
+
+def stem(word: str) -> str:
+    """Упрощённый стеммер для русского: отрезает типичные окончания"""
+    word = word.lower().replace("ё", "е")
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def _stems(text: str) -> Tuple[str, ...]:
+    return tuple(stem(word) for word in WORD_PATTERN.findall(text.lower().replace("ё", "е")))
+
+
+class Vocabulary:
+    """Словарь значений фильтров из каталога: жанры, происхождение авторов, возраст, ключевые слова"""
+
+    def __init__(self, genres: List[str], origins: List[str], ages: List[int], keywords: List[str]):
+        self.ages = sorted(ages)
+        self.entries = []
+        for field, values in (("genre", genres), ("author_origin", origins), ("keywords", keywords)):
+            for value in values:
+                stems = _stems(value)
+                if stems:
+                    self.entries.append((stems, field, value))
+        # Длинные (многословные) значения проверяются первыми: «научная фантастика» раньше «фантастики»
+        self.entries.sort(key=lambda entry: len(entry[0]), reverse=True)
+        self.known_stems = sorted({s for stems, _, _ in self.entries for s in stems})
+        self._known = set(self.known_stems)
+
+    def canonical(self, token_stem: str) -> Tuple[Optional[str], float]:
+        """Сопоставляет основу слова со словарём: точно, через синоним или нечётко"""
+        if token_stem in self._known:
+            return token_stem, 1.0
+        synonym = SYNONYMS.get(token_stem)
+        if synonym and synonym in self._known:
+            return synonym, 1.0
+        if len(token_stem) >= 4:
+            close = difflib.get_close_matches(token_stem, self.known_stems, n=1, cutoff=0.8)
+            if close:
+                return close[0], 0.8
+        return None, 0.0
+
+
+@retry_read
+def _load_vocabulary() -> Vocabulary:
+    catalog = get_catalog()
+    if catalog is not None:
+        return Vocabulary(list(catalog.by_genre), list(catalog.by_origin),
+                          list(catalog.by_age), list(catalog.by_keyword))
+
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT genre FROM books;")
+        genres = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT DISTINCT author_origin FROM books;")
+        origins = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT DISTINCT age_min FROM books WHERE age_min IS NOT NULL;")
+        ages = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT DISTINCT unnest(keywords) FROM books;")
+        keywords = [row[0] for row in cur.fetchall()]
+    return Vocabulary(genres, origins, ages, keywords)
+
+
+def get_vocabulary() -> Vocabulary:
+    """Словарь для текущей версии каталога (без индекса каталога — обновляется раз в VOCABULARY_TTL сек)"""
+    global _vocabulary, _vocabulary_key
+    catalog = get_catalog()
+    key = catalog.generation if catalog is not None else int(time.monotonic() // VOCABULARY_TTL)
+    with _vocabulary_lock:
+        if _vocabulary is None or _vocabulary_key != key:
+            _vocabulary = _load_vocabulary()
+            _vocabulary_key = key
+        return _vocabulary
+
+
+def parse_query(text: str, vocabulary: Vocabulary = None) -> ParseResult:
+    """Разбирает запрос вида «фэнтези, 16+, зарубежный автор» без обращения к модели"""
+    vocabulary = vocabulary or get_vocabulary()
+    text = text.lower().replace("ё", "е")
+    filters: Dict = {}
+    score, meaningful = 0.0, 0
+
+    age_match = AGE_PATTERN.search(text)
+    if age_match:
+        filters["age_limit"] = f"{int(age_match.group(1))}+"
+        text = text[:age_match.start()] + " " + text[age_match.end():]
+        score += 1
+        meaningful += 1
+
+    tokens = [word for word in WORD_PATTERN.findall(text) if word not in STOP_WORDS]
+    meaningful += len(tokens)
+    resolved = {}
+    for position, word in enumerate(tokens):
+        canonical, weight = vocabulary.canonical(stem(word))
+        if canonical is not None:
+            resolved[position] = (canonical, weight)
+
+    consumed = set()
+    for stems, field, value in vocabulary.entries:
+        positions = []
+        for s in stems:
+            position = next((p for p, (c, _) in resolved.items() if c == s and p not in consumed), None)
+            if position is None:
+                break
+            positions.append(position)
+        else:
+            if field == "keywords":
+                filters.setdefault("keywords", []).append(value)
+            elif field in filters:
+                continue
+            else:
+                filters[field] = value
+            consumed.update(positions)
+            score += sum(resolved[p][1] for p in positions)
+
+    remainder = " ".join(word for position, word in enumerate(tokens) if position not in consumed)
+    confidence = score / meaningful if meaningful else 0.0
+    return ParseResult(filters, confidence, remainder)
+
+
+def extract_filters(model, user_input: str, call_type: str, prompt: str,
+                    threshold: float = QUERY_PARSER_THRESHOLD) -> Dict:
+    """Фильтры из свободного текста: сначала локальный разбор, модель — только при низкой уверенности"""
+    parsed = parse_query(user_input)
+    if parsed.confidence >= threshold or not model:
+        parser_stats["fast_path"] += 1
+        return parsed.filters
+
+    parser_stats["llm_path"] += 1
+    try:
+        filters = json.loads(ask(model, prompt, call_type))
+    except (LLMUnavailable, ValueError):
+        # Модель не ответила в срок или вернула не JSON — лучше неуверенный локальный разбор
+        return parsed.filters
+    return filters if isinstance(filters, dict) else parsed.filters
@@ -0,0 +1,262 @@
+import os
+import time
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from database import get_read_connection, retry_read
+from catalog import get_catalog, parse_age_limit
+from records import Book, RECORD_COLUMNS
+from history import get_recent_history
+from profiles import get_preferences
+
+PROFILE_TTL = int(os.getenv("PROFILE_TTL", "300"))
+PROFILE_HISTORY_SIZE = int(os.getenv("PROFILE_HISTORY_SIZE", "50"))
+RANKING_CANDIDATES = int(os.getenv("RANKING_CANDIDATES", "5000"))
+
+# Вклад признаков в итоговый скор
+WEIGHTS = {"genre": 3.0, "author": 2.0, "origin": 1.0, "keyword": 1.5, "rating": 1.0}
+
+_profiles: Dict[int, "UserProfile"] = {}
+_profiles_lock = threading.Lock()
+_features = None
+_features_lock = threading.Lock()
+
+
+class UserProfile:
+    """Профиль пользователя: веса жанров, авторов и ключевых слов и уже показанные книги"""
+
+    def __init__(self, user_id: int, genres: Dict[str, float], authors: Dict[str, float],
+                 keywords: Dict[str, float], origin: Optional[str], age_limit: Optional[str], shown: set):
+        self.user_id = user_id
+        self.genres = genres
+        self.authors = authors
+        self.keywords = keywords
+        self.origin = origin
+        self.age_limit = age_limit
+        self.shown = shown
+        # Предрассчитанные рекомендации (user_recommendations) кэшируются вместе с профилем
+        self.precomputed: Optional[List[int]] = None
+        self.built_at = time.monotonic()
+
+
+class BookFeatures:
+    """Признаки набора книг в виде массивов NumPy для векторного скоринга"""
+
+    def __init__(self, books: List[Book]):
+        self.books = books
+        self.ids = np.array([book.id for book in books], dtype=np.int64)
+        self.genre_names, self.genres = self._encode([book.genre for book in books])
+        self.author_names, self.authors = self._encode([book.author for book in books])
+        self.origin_names, self.origins = self._encode([book.author_origin for book in books])
+        self.ratings = np.array([book.rating or 0.0 for book in books], dtype=np.float32)
+        self.ages = np.array([
+            age if age is not None else -1
+            for age in (parse_age_limit(book.age_limit) for book in books)
+        ], dtype=np.int16)
+
+        # Ключевые слова в разреженном виде: пары (строка книги, код слова)
+        keyword_codes, rows, codes = {}, [], []
+        for row, book in enumerate(books):
+            for keyword in book.keywords or []:
+                rows.append(row)
+                codes.append(keyword_codes.setdefault(keyword, len(keyword_codes)))
+        self.keyword_codes = keyword_codes
+        self.keyword_rows = np.array(rows, dtype=np.int64)
+        self.keyword_ids = np.array(codes, dtype=np.int64)
+
+    @staticmethod
+    def _encode(values: List[str]):
+        names = {}
+        codes = np.array([names.setdefault(value, len(names)) for value in values], dtype=np.int64)
+        return names, codes
+
+    def _lookup(self, names: Dict[str, int], weights: Dict[str, float]) -> np.ndarray:
+        table = np.zeros(len(names) + 1, dtype=np.float32)
+        for name, weight in weights.items():
+            code = names.get(name)
+            if code is not None:
+                table[code] = weight
+        return table
+
+    def score(self, profile: UserProfile) -> np.ndarray:
+        """Скор всех книг набора для профиля за один векторный проход"""
+        n = len(self.books)
+        scores = WEIGHTS["genre"] * self._lookup(self.genre_names, profile.genres)[self.genres]
+        scores += WEIGHTS["author"] * self._lookup(self.author_names, profile.authors)[self.authors]
+        if profile.origin is not None and profile.origin in self.origin_names:
+            scores += WEIGHTS["origin"] * (self.origins == self.origin_names[profile.origin])
+        if profile.keywords and len(self.keyword_rows):
+            keyword_weights = self._lookup(self.keyword_codes, profile.keywords)
+            scores += WEIGHTS["keyword"] * np.bincount(
+                self.keyword_rows, weights=keyword_weights[self.keyword_ids], minlength=n
+            ).astype(np.float32)
+        scores += WEIGHTS["rating"] * self.ratings / 5
+
+        max_age = parse_age_limit(profile.age_limit)
+        if max_age is not None:
+            scores[(self.ages < 0) | (self.ages > max_age)] = -np.inf
+        if profile.shown:
+            scores[np.isin(self.ids, np.fromiter(profile.shown, dtype=np.int64))] = -np.inf
+        return scores
+
+    def best(self, profile: UserProfile, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Номера строк лучших книг и их скоры по убыванию (недопустимые книги отброшены)"""
+        scores = self.score(profile)
+        limit = min(limit, len(scores))
+        if limit == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        best = best[np.isfinite(scores[best])]
+        return best, scores[best]
+
+    def top(self, profile: UserProfile, limit: int) -> List[Book]:
+        rows, _ = self.best(profile, limit)
+        return [self.books[row] for row in rows]
+
+
+@retry_read
+def books_by_ids(ids: List[int]) -> List[Book]:
+    """Книги по id в том же порядке (отсутствующие в каталоге пропускаются)"""
+    catalog = get_catalog()
+    if catalog is not None:
+        return [catalog.books[book_id] for book_id in ids if book_id in catalog.books]
+    if not ids:
+        return []
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT {RECORD_COLUMNS} FROM books WHERE id = ANY(%s);", (list(ids),))
+        books = {book.id: book for book in map(Book.from_row, cur.fetchall())}
+    return [books[book_id] for book_id in ids if book_id in books]
+
+
+def build_profile(user_id: int) -> Optional[UserProfile]:
+    """Строит профиль по user_preferences и последним записям истории поиска"""
+    prefs = get_preferences(user_id)
+    if prefs is None:
+        return None
+
+    shown = set()
+    for entry in get_recent_history(user_id, PROFILE_HISTORY_SIZE):
+        shown.update(entry["results"])
+    profile = make_profile(user_id, prefs, shown, books_by_ids(list(shown)))
+    profile.precomputed = _load_precomputed(user_id)
+    return profile
+
+
+def make_profile(user_id: int, prefs: Dict, shown: set, shown_books: List[Book]) -> UserProfile:
+    """Профиль из строки user_preferences и уже показанных пользователю книг"""
+    genres = Counter({genre: 1.0 for genre in prefs["preferred_genres"] or [] if genre})
+    authors = Counter({author: 1.0 for author in prefs["preferred_authors"] or [] if author})
+    keywords = Counter({keyword: 1.0 for keyword in prefs.get("keywords") or [] if keyword})
+
+    for book in shown_books:
+        genres[book.genre] += 0.3
+        authors[book.author] += 0.3
+        for keyword in book.keywords or []:
+            keywords[keyword] += 0.5
+
+    if keywords:
+        top_weight = max(keywords.values())
+        keywords = Counter({keyword: weight / top_weight for keyword, weight in keywords.items()})
+
+    return UserProfile(user_id, dict(genres), dict(authors), dict(keywords),
+                       prefs["author_origin_preference"], prefs["age_limit"], shown)
+
+
+def get_profile(user_id: int) -> Optional[UserProfile]:
+    """Профиль из кэша; перестраивается по истечении PROFILE_TTL или после invalidate_profile"""
+    with _profiles_lock:
+        profile = _profiles.get(user_id)
+    if profile is not None and time.monotonic() - profile.built_at < PROFILE_TTL:
+        return profile
+    profile = build_profile(user_id)
+    with _profiles_lock:
+        if profile is None:
+            _profiles.pop(user_id, None)
+        else:
+            _profiles[user_id] = profile
+    return profile
+
+
+def invalidate_profile(user_id: int):
+    with _profiles_lock:
+        _profiles.pop(user_id, None)
+
+
+def note_shown(user_id: int, book_ids: List[int]):
+    """Добавляет показанные книги в закэшированный профиль, не перестраивая его"""
+    with _profiles_lock:
+        profile = _profiles.get(user_id)
+        if profile is not None:
+            profile.shown = profile.shown | set(book_ids)
+
+
+@retry_read
+def _candidate_features(profile: UserProfile) -> BookFeatures:
+    global _features
+    catalog = get_catalog()
+    if catalog is not None:
+        with _features_lock:
+            if _features is None or _features[0] != catalog.generation:
+                _features = (catalog.generation, BookFeatures([catalog.books[i] for i in catalog.order]))
+            return _features[1]
+
+    # Без индекса каталога берём лучшие по рейтингу книги, подходящие по возрасту
+    query = f"SELECT {RECORD_COLUMNS} FROM books"
+    params = []
+    max_age = parse_age_limit(profile.age_limit)
+    if max_age is not None:
+        query += " WHERE age_min <= %s"
+        params.append(max_age)
+    query += " ORDER BY rating DESC NULLS LAST, id LIMIT %s;"
+    params.append(RANKING_CANDIDATES)
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute(query, params)
+        return BookFeatures([Book.from_row(row) for row in cur.fetchall()])
+
+
+@retry_read
+def _load_precomputed(user_id: int) -> Optional[List[int]]:
+    """Рекомендации из user_recommendations, если они посчитаны после последнего изменения предпочтений.
+    Изменение каталога отбрасывает не весь список, а только книги, изменённые (или удалённые) после расчёта"""
+    with get_read_connection(user_id) as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT ARRAY(
+                SELECT u.id FROM unnest(r.book_ids) WITH ORDINALITY AS u(id, position)
+                JOIN books b ON b.id = u.id
+                WHERE b.updated_at <= r.computed_at
+                ORDER BY u.position
+            )
+            FROM user_recommendations r
+            JOIN user_preferences p USING (user_id)
+            WHERE r.user_id = %s AND r.computed_at >= p.updated_at;
+            """,
+            (user_id,)
+        )
+        row = cur.fetchone()
+    return list(row[0]) if row is not None else None
+
+
+def _precomputed(profile: UserProfile, limit: int) -> Optional[List[Book]]:
+    """Предрассчитанные рекомендации из профиля без книг, показанных с тех пор"""
+    if profile.precomputed is None:
+        return None
+    ids = [book_id for book_id in profile.precomputed if book_id not in profile.shown][:limit]
+    if len(ids) < min(limit, len(profile.precomputed)):
+        return None
+    return books_by_ids(ids)
+
+
+def recommend_for_user(user_id: int, limit: int = 5) -> List[Book]:
+    """Персональные рекомендации: предрассчитанные (precompute.py), а если их нет или они
+    закончились — скоринг кандидатов по профилю, без уже показанных книг.
+    Всё берётся из закэшированного профиля: ход с готовым профилем не обращается к БД"""
+    profile = get_profile(user_id)
+    if profile is None:
+        return []
+    books = _precomputed(profile, limit)
+    if books is not None:
+        return books
+    return _candidate_features(profile).top(profile, limit)
@@ -0,0 +1,112 @@
+import json
+import base64
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Tuple
+from database import get_read_connection, retry_read
+
+# Поля записи в порядке колонок запроса; совпадают с models.Book (без вычисляемого age_min).
+# Описание — самое большое поле — в выборки не входит и читается отдельно, по требованию
+BOOK_FIELDS = ("id", "title", "author", "genre", "age_limit", "author_origin", "keywords", "url", "rating")
+RECORD_COLUMNS = ", ".join(BOOK_FIELDS)
+
+_NOT_LOADED = object()
+
+
+class Book(Mapping):
+    """Компактная запись книги вместо словаря RealDictCursor.
+
+    Хранится в __slots__, строится из кортежа строки без копирования полей.
+    Поддерживает доступ как к словарю (book["title"], book.get("rating")),
+    поэтому format_book, индекс каталога и инструменты работают с ней без изменений.
+    """
+
+    __slots__ = BOOK_FIELDS + ("_description",)
+
+    def __init__(self, id, title, author, genre, age_limit=None, author_origin=None,
+                 keywords=None, url=None, rating=None, description=_NOT_LOADED):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.genre = genre
+        self.age_limit = age_limit
+        self.author_origin = author_origin
+        self.keywords = keywords
+        self.url = url
+        self.rating = rating
+        self._description = description
+
+    @classmethod
+    def from_row(cls, row) -> "Book":
+        """Строка курсора в порядке BOOK_FIELDS (и, если выбрано, description последним)"""
+        return cls(*row)
+
+    @property
+    def description(self):
+        # Незагруженное описание читается, но не запоминается: запись может быть общей (снимок каталога)
+        if self._description is _NOT_LOADED:
+            return _fetch_descriptions([self.id]).get(self.id)
+        return self._description
+
+    def with_description(self, description) -> "Book":
+        """Копия записи с описанием"""
+        return Book(*(getattr(self, field) for field in BOOK_FIELDS), description=description)
+
+    def __getitem__(self, key):
+        if key == "description":
+            return self.description
+        if key not in BOOK_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        # Незагруженное описание не перечисляется, чтобы dict(book) не ходил в БД
+        yield from BOOK_FIELDS
+        if self._description is not _NOT_LOADED:
+            yield "description"
+
+    def __len__(self):
+        return len(BOOK_FIELDS) + (self._description is not _NOT_LOADED)
+
+    def __contains__(self, key):
+        return key in BOOK_FIELDS or key == "description"
+
+    def __repr__(self):
+        return f"Book(id={self.id!r}, title={self.title!r}, author={self.author!r})"
+
+    def to_dict(self) -> Dict:
+        return {key: self[key] for key in BOOK_FIELDS + ("description",)}
+
+
+@retry_read
+def _fetch_descriptions(book_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, description FROM books WHERE id = ANY(%s);", (list(book_ids),))
+        return dict(cur.fetchall())
+
+
+def with_descriptions(books: Iterable[Book]) -> List[Book]:
+    """Записи с описаниями, подгруженными одним запросом для всех книг, у которых их нет.
+    Исходные записи не меняются: книги из снимка каталога общие для всех сессий,
+    а описания в памяти каталога не хранятся — вместо них возвращаются копии"""
+    books = list(books)
+    missing = {book.id for book in books if book._description is _NOT_LOADED}
+    if not missing:
+        return books
+    found = _fetch_descriptions(missing)
+    return [book.with_description(found.get(book.id)) if book._description is _NOT_LOADED else book
+            for book in books]
+
+
+def rating_key(rating, book_id: int) -> Tuple:
+    """Ключ порядка выдачи: рейтинг по убыванию (книги без рейтинга — в конце), затем id"""
+    return (rating is None, -(rating or 0), book_id)
+
+
+def encode_cursor(book: Book) -> str:
+    """Непрозрачный курсор страницы: позиция (rating, id) последней показанной книги"""
+    return base64.urlsafe_b64encode(json.dumps([book.rating, book.id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[float], int]:
+    rating, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return rating, book_id
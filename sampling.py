@@ -0,0 +1,73 @@
+import random
+import threading
+from array import array
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Tuple
+from catalog import CatalogSnapshot, get_catalog, parse_age_limit
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+class BookSampler:
+    """Случайный выбор книг за O(1) по заранее построенным массивам id.
+
+    Для каждой комбинации (жанр, происхождение автора, возрастная корзина),
+    где любой из фильтров может отсутствовать (None), хранится массив подходящих id.
+    Корзина возраста N содержит все книги с ограничением <= N.
+    """
+
+    def __init__(self, catalog: CatalogSnapshot):
+        self.generation = catalog.generation
+        self._ages = sorted(catalog.by_age)
+        self._arrays: Dict[Tuple, array] = {}
+
+        for book_id in catalog.order:
+            book = catalog.books[book_id]
+            age = parse_age_limit(book.age_limit)
+            ages = [None] + ([a for a in self._ages if a >= age] if age is not None else [])
+            for key in product((None, book.genre), (None, book.author_origin), ages):
+                ids = self._arrays.get(key)
+                if ids is None:
+                    ids = self._arrays[key] = array("l")
+                ids.append(book_id)
+
+    def _bucket(self, age_limit) -> Optional[int]:
+        max_age = parse_age_limit(age_limit)
+        if max_age is None:
+            return None
+        suitable = [age for age in self._ages if age <= max_age]
+        return suitable[-1] if suitable else -1
+
+    def ids_for(self, genre=None, age_limit=None, author_origin=None) -> array:
+        return self._arrays.get((genre or None, author_origin or None, self._bucket(age_limit)), array("l"))
+
+    def sample(self, genre=None, age_limit=None, author_origin=None,
+               k: int = 1, exclude: Iterable[int] = ()) -> List[int]:
+        """k различных случайных id, подходящих под фильтры, без id из exclude"""
+        ids = self.ids_for(genre, age_limit, author_origin)
+        exclude = set(exclude or ())
+        available = len(ids)
+        if k <= 0 or available == 0:
+            return []
+
+        want = min(k + len(exclude), available)
+        picked = [ids[i] for i in random.sample(range(available), want)]
+        result = [book_id for book_id in picked if book_id not in exclude]
+        if len(result) < k and want < available:
+            # Редкий случай: исключённые id съели выборку — добираем перебором
+            rest = [book_id for book_id in ids if book_id not in exclude and book_id not in result]
+            result.extend(random.sample(rest, min(k - len(result), len(rest))))
+        return result[:k]
+
+
+def get_sampler() -> Optional[BookSampler]:
+    """Возвращает сэмплер для текущей версии каталога или None, если индекс каталога выключен"""
+    global _sampler
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    with _sampler_lock:
+        if _sampler is None or _sampler.generation != catalog.generation:
+            _sampler = BookSampler(catalog)
+        return _sampler
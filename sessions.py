@@ -0,0 +1,181 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from startup import warm_up
+from database import get_connection
+from main import ChatState, create_model, greet, handle_message
+
+SESSION_WORKERS = int(os.getenv("SESSION_WORKERS", "32"))
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+
+
+def user_id_for(session_id: str) -> int:
+    """Стабильный user_id для сессии, если фронтенд не передал свой.
+    Берётся из session_users: повторный вызов с тем же session_id возвращает тот же id,
+    а у разных сессий id не совпадают (предпочтения, история и снимки у них свои)"""
+    with get_connection() as conn, conn.cursor() as cur:
+        # DO UPDATE вместо DO NOTHING, чтобы RETURNING вернул id и для уже известной сессии
+        cur.execute(
+            """
+            INSERT INTO session_users (session_id) VALUES (%s)
+            ON CONFLICT (session_id) DO UPDATE SET session_id = EXCLUDED.session_id
+            RETURNING user_id;
+            """,
+            (session_id,)
+        )
+        user_id = cur.fetchone()[0]
+        conn.commit()
+    return user_id
+
+
+class Session:
+    def __init__(self, session_id: str, state: ChatState, on_output: Optional[Callable[[str], None]] = None):
+        self.session_id = session_id
+        self.state = state
+        self.on_output = on_output
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.last_active = time.monotonic()
+        self.closed = False
+
+
+class SessionEngine:
+    """Асинхронный движок, который обслуживает много диалогов в одном процессе.
+
+    У каждой сессии свой ChatState и своя очередь сообщений: сообщения одной сессии
+    обрабатываются строго по порядку, а разные сессии идут параллельно.
+    Шаги диалога (main.handle_message) синхронные — они выполняются в пуле потоков,
+    поэтому ожидание GigaChat и БД в одной сессии не блокирует остальные.
+    """
+
+    def __init__(self, model=None, workers: int = SESSION_WORKERS, idle_timeout: int = SESSION_IDLE_TIMEOUT):
+        self.model = model
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, Session] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat")
+        self._reaper: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self._loop.run_in_executor(self._executor, warm_up)
+        if self.model is None:
+            self.model = await self._loop.run_in_executor(self._executor, create_model)
+        self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def stop(self):
+        if self._reaper:
+            self._reaper.cancel()
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+        self._executor.shutdown(wait=False)
+
+    async def open_session(self, session_id: str, user_id: int = None,
+                           on_output: Callable[[str], None] = None) -> str:
+        """Создаёт сессию и возвращает текст приветствия.
+        user_id — постоянный id пользователя во фронтенде; без него id закрепляется за session_id"""
+        if session_id in self.sessions:
+            return ""
+        if user_id is None:
+            user_id = await self._loop.run_in_executor(self._executor, user_id_for, session_id)
+            if session_id in self.sessions:
+                return ""
+        state = ChatState(user_id=user_id)
+        session = Session(session_id, state, on_output)
+        self.sessions[session_id] = session
+        # Приветствие — первый шаг в очереди сессии: сообщения, пришедшие раньше его конца, ждут за ним
+        future = self._loop.create_future()
+        await session.inbox.put((lambda: greet(state), future, None))
+        session.task = asyncio.create_task(self._run(session))
+        return await future
+
+    def _session(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None or session.closed:
+            raise KeyError(f"Сессия {session_id} не найдена")
+        return session
+
+    async def send(self, session_id: str, text: str) -> str:
+        """Передаёт сообщение пользователя в сессию и возвращает полный ответ на него"""
+        session = self._session(session_id)
+        future = self._loop.create_future()
+        await session.inbox.put((self._reply(session, text), future, None))
+        return await future
+
+    async def stream(self, session_id: str, text: str) -> AsyncIterator[str]:
+        """Как send, но отдаёт ответ по частям: карточки книг сразу, комментарии модели — по токенам"""
+        session = self._session(session_id)
+        future = self._loop.create_future()
+        chunks: asyncio.Queue = asyncio.Queue()
+        future.add_done_callback(lambda _: chunks.put_nowait(None))
+        await session.inbox.put((self._reply(session, text), future, chunks))
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        future.result()
+
+    async def close_session(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.closed = True
+        await session.inbox.put((None, None, None))
+        if session.task:
+            await session.task
+
+    def _reply(self, session: Session, text: str) -> Callable[[], bool]:
+        """Шаг диалога для сообщения пользователя; False — пользователь завершил диалог"""
+        return lambda: handle_message(session.state, text, self.model)
+
+    async def _call(self, session: Session, func, *args, sink: asyncio.Queue = None):
+        """Выполняет синхронный шаг диалога в пуле потоков, собирая весь вывод сессии"""
+        chunks: List[str] = []
+
+        def output(text: str = "", end: str = "\n"):
+            chunk = f"{text}{end}"
+            chunks.append(chunk)
+            if session.on_output is not None:
+                self._loop.call_soon_threadsafe(session.on_output, chunk)
+            if sink is not None:
+                self._loop.call_soon_threadsafe(sink.put_nowait, chunk)
+
+        session.state.output = output
+        await self._loop.run_in_executor(self._executor, func, *args)
+        session.last_active = time.monotonic()
+        return "".join(chunks)
+
+    async def _run(self, session: Session):
+        while True:
+            action, future, sink = await session.inbox.get()
+            if action is None:
+                break
+            alive = [True]
+
+            def step():
+                alive[0] = action() is not False
+
+            try:
+                future.set_result(await self._call(session, step, sink=sink))
+            except Exception as e:
+                future.set_exception(e)
+            if not alive[0]:
+                self.sessions.pop(session.session_id, None)
+                session.closed = True
+                break
+
+        while not session.inbox.empty():
+            _, pending, _ = session.inbox.get_nowait()
+            if pending is not None and not pending.done():
+                pending.set_exception(KeyError(f"Сессия {session.session_id} завершена"))
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if now - session.last_active > self.idle_timeout:
+                    await self.close_session(session_id)
@@ -0,0 +1,172 @@
+import os
+import re
+import time
+from array import array
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+from scipy import sparse
+from psycopg2.extras import execute_values
+from database import get_connection
+from query_parser import stem
+
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "10"))
+SIMILARITY_BATCH = int(os.getenv("SIMILARITY_BATCH", "1024"))
+# Память на один пакет сравнений: ненулевые близости разреженной матрицы (float32 и индекс столбца)
+SIMILARITY_MEMORY_MB = int(os.getenv("SIMILARITY_MEMORY_MB", "512"))
+BYTES_PER_PAIR = 4 + 8
+# Книги читаются серверным курсором порциями по столько строк
+LOAD_CHUNK = 10000
+
+WORD_PATTERN = re.compile(r"[a-zа-яё0-9]+")
+
+# Вес групп признаков: жанр и ключевые слова важнее слов из описания
+FIELD_WEIGHTS = {"genre": 3.0, "author": 2.0, "keyword": 2.0, "word": 1.0}
+
+
+def book_features(book: Dict) -> Counter:
+    """Признаки книги: жанр, автор, ключевые слова и основы слов описания"""
+    features = Counter()
+    features[f"genre:{book['genre'].lower()}"] += FIELD_WEIGHTS["genre"]
+    features[f"author:{book['author'].lower()}"] += FIELD_WEIGHTS["author"]
+    for keyword in book.get("keywords") or []:
+        features[f"keyword:{keyword.lower()}"] += FIELD_WEIGHTS["keyword"]
+        for word in WORD_PATTERN.findall(keyword.lower()):
+            features[f"word:{stem(word)}"] += FIELD_WEIGHTS["word"]
+    for word in WORD_PATTERN.findall((book.get("description") or "").lower()):
+        if len(word) > 3:
+            features[f"word:{stem(word)}"] += FIELD_WEIGHTS["word"]
+    return features
+
+
+def _load_counts() -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """Потоково читает книги и строит разреженную матрицу весов признаков (строка — книга).
+    Описания в памяти не накапливаются: от каждой книги остаются только её признаки"""
+    ids, indptr, indices, data = array("q"), array("q", [0]), array("i"), array("f")
+    columns: Dict[str, int] = {}
+    with get_connection() as conn:
+        # Серверный курсор существует только внутри транзакции
+        conn.autocommit = False
+        try:
+            with conn.cursor(name="similarity_books") as cur:
+                cur.itersize = LOAD_CHUNK
+                cur.execute("SELECT id, genre, author, keywords, description FROM books ORDER BY id;")
+                for book_id, genre, author, keywords, description in cur:
+                    book = {"genre": genre, "author": author, "keywords": keywords, "description": description}
+                    for feature, weight in book_features(book).items():
+                        indices.append(columns.setdefault(feature, len(columns)))
+                        data.append(weight)
+                    indptr.append(len(indices))
+                    ids.append(book_id)
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+
+    counts = sparse.csr_matrix(
+        (np.frombuffer(data, dtype=np.float32), np.frombuffer(indices, dtype=np.int32),
+         np.frombuffer(indptr, dtype=np.int64)),
+        shape=(len(ids), len(columns))
+    )
+    return np.frombuffer(ids, dtype=np.int64), counts
+
+
+def vectorize(counts: sparse.csr_matrix) -> sparse.csr_matrix:
+    """TF-IDF векторы книг, нормированные по L2; матрица остаётся разреженной"""
+    n = counts.shape[0]
+    document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = (np.log((1 + n) / (1 + document_frequency)) + 1).astype(np.float32)
+    matrix = counts.copy()
+    matrix.data *= idf[matrix.indices]
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr)).astype(np.float32)
+    return matrix
+
+
+def _similarity_cost(matrix: sparse.csr_matrix) -> np.ndarray:
+    """Оценка сверху числа ненулевых близостей у каждой книги: сумма частот её признаков"""
+    n = matrix.shape[0]
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    rows = np.repeat(np.arange(n), np.diff(matrix.indptr))
+    cost = np.bincount(rows, weights=document_frequency[matrix.indices], minlength=n)
+    return np.minimum(cost, n)
+
+
+def chunks(cost: np.ndarray, batch: int = SIMILARITY_BATCH,
+           memory_mb: int = SIMILARITY_MEMORY_MB) -> Iterator[Tuple[int, int]]:
+    """Границы пакетов строк: не больше batch строк, а их близости укладываются в memory_mb"""
+    budget = max(1, memory_mb * 1024 * 1024 // BYTES_PER_PAIR)
+    start, total = 0, 0
+    for row, row_cost in enumerate(cost):
+        if row > start and (row - start >= batch or total + row_cost > budget):
+            yield start, row
+            start, total = row, 0
+        total += row_cost
+    if start < len(cost):
+        yield start, len(cost)
+
+
+def top_k_neighbors(matrix: sparse.csr_matrix, transposed: sparse.csr_matrix, start: int, stop: int,
+                    k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Для строк start..stop — номера и косинусная близость не более k ближайших книг.
+    Книги без общих признаков близость не получают и в соседи не попадают"""
+    similarity = matrix[start:stop] @ transposed
+    result = []
+    for offset in range(stop - start):
+        begin, end = similarity.indptr[offset], similarity.indptr[offset + 1]
+        columns, scores = similarity.indices[begin:end], similarity.data[begin:end]
+        keep = columns != start + offset
+        columns, scores = columns[keep], scores[keep]
+        if len(scores) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            columns, scores = columns[part], scores[part]
+        order = np.argsort(-scores, kind="stable")
+        result.append((columns[order], scores[order]))
+    return result
+
+
+def _save_neighbors(rows: List[Tuple[int, List[int], List[float]]]):
+    # Записи удалённых книг убирает внешний ключ book_neighbors (ON DELETE CASCADE)
+    with get_connection() as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO book_neighbors (book_id, neighbor_ids, scores) VALUES %s
+            ON CONFLICT (book_id) DO UPDATE SET
+                neighbor_ids = EXCLUDED.neighbor_ids,
+                scores = EXCLUDED.scores,
+                built_at = now();
+            """,
+            rows,
+            page_size=1000
+        )
+
+
+def build_neighbors(k: int = SIMILARITY_TOP_K) -> int:
+    """Строит индекс похожих книг заново по всему каталогу. Частичного пересчёта нет:
+    IDF зависит от всего каталога, и оценки старых и новых списков были бы несравнимы.
+    Возвращает число записанных книг"""
+    started = time.monotonic()
+    ids, counts = _load_counts()
+    if len(ids) < 2:
+        return 0
+    matrix = vectorize(counts)
+    del counts
+    transposed = matrix.T.tocsr()
+
+    written = 0
+    for start, stop in chunks(_similarity_cost(matrix)):
+        rows = [
+            (int(ids[start + offset]), ids[columns].tolist(), scores.tolist())
+            for offset, (columns, scores) in enumerate(top_k_neighbors(matrix, transposed, start, stop, k))
+        ]
+        _save_neighbors(rows)
+        written += len(rows)
+        print(f"🧮 Похожие книги: {written}/{len(ids)}")
+
+    print(f"📚 Индекс похожих книг: обновлено {written} записей за {time.monotonic() - started:.1f} сек")
+    return written
+
+
+if __name__ == "__main__":
+    build_neighbors()
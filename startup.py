@@ -0,0 +1,132 @@
+import os
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Отсчёт ведётся от импорта этого модуля — main.py импортирует его первым
+STARTED = time.perf_counter()
+
+FAST_START = os.getenv("FAST_START", "1") == "1"
+
+# Модули с тяжёлыми зависимостями (langchain, numpy): main.py обращается к ним через LazyModule,
+# llm.py импортирует langchain.schema при первом вызове модели, а прогрев загружает всё это в фоне,
+# пока пользователь вводит имя
+HEAVY_MODULES = ("tools", "ranking", "langchain.schema")
+
+
+class StartupTimer:
+    """Длительность фаз запуска: импорты, готовность БД, миграции, прогрев кэшей, первое приглашение"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - started
+
+    def mark(self, name: str):
+        """Отметка: время от начала запуска до текущего момента"""
+        with self._lock:
+            self.phases[name] = time.perf_counter() - STARTED
+
+    def report(self, *names: str) -> str:
+        with self._lock:
+            phases = {name: self.phases[name] for name in names or self.phases if name in self.phases}
+        return ", ".join(f"{name} {seconds:.2f} с" for name, seconds in phases.items())
+
+
+startup_timer = StartupTimer()
+
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к его атрибуту"""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        # import_module потокобезопасен и после первой загрузки просто берёт модуль из sys.modules
+        return getattr(importlib.import_module(self._name), attr)
+
+
+def warm_up(db_ready: Optional[threading.Event] = None):
+    """Подключается к БД, применяет миграции, загружает тяжёлые модули и прогревает индекс каталога,
+    счётчики фасетов и словарь разбора запросов"""
+    # Импорты здесь, а не в начале модуля: иначе они попали бы в отсчёт до STARTED
+    from database import get_pool, apply_migrations
+    from catalog import get_catalog
+    from sampling import get_sampler
+    from facets import get_facets
+    from query_parser import get_vocabulary
+
+    with startup_timer.phase("БД"):
+        get_pool()
+    with startup_timer.phase("миграции"):
+        apply_migrations()
+    if db_ready is not None:
+        db_ready.set()
+    with startup_timer.phase("модули"):
+        for name in HEAVY_MODULES:
+            importlib.import_module(name)
+    with startup_timer.phase("каталог"):
+        get_catalog()
+        get_sampler()
+        get_facets()
+    with startup_timer.phase("словарь"):
+        get_vocabulary()
+
+
+class WarmUp(threading.Thread):
+    """Фоновый прогрев: диалог начинается сразу, а шаги, которым нужна БД, ждут только её готовности.
+    Сам поток ничего не печатает, чтобы не вклиниваться в ввод: сообщения забирает диалог между ходами"""
+
+    def __init__(self):
+        super().__init__(name="warm-up", daemon=True)
+        self.db_ready = threading.Event()
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+        self._messages: List[str] = []
+        self._lock = threading.Lock()
+
+    def _note(self, text: str):
+        with self._lock:
+            self._messages.append(text)
+
+    def messages(self) -> List[str]:
+        """Накопленные сообщения прогрева (каждое отдаётся один раз)"""
+        with self._lock:
+            messages, self._messages = self._messages, []
+        return messages
+
+    def run(self):
+        try:
+            warm_up(self.db_ready)
+            self._note(f"⏱ Фоновый прогрев: {startup_timer.report('БД', 'миграции', 'модули', 'каталог', 'словарь')}")
+        except Exception as e:
+            # Ошибка после готовности БД (например, при загрузке каталога) диалогу не мешает
+            if not self.db_ready.is_set():
+                self.error = e
+            self._note(f"⚠️ Ошибка фонового прогрева: {e}")
+        finally:
+            self.db_ready.set()
+            self.done.set()
+
+    def wait_db(self, timeout: float = None):
+        """Ждёт подключения к БД и миграций; пробрасывает ошибку прогрева"""
+        self.db_ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+
+
+def start_warm_up() -> WarmUp:
+    warm = WarmUp()
+    warm.start()
+    return warm
@@ -0,0 +1,67 @@
+import re
+from collections import Counter
+from typing import Dict, List, Union
+from records import Book
+
+# Шаблонные ответы на случай, когда модель не ответила в срок или автомат вызовов разомкнут:
+# собираются из тех же полей, что показывает format_book, и не требуют сетевых вызовов
+
+DESCRIPTION_LENGTH = 200
+
+
+def _first_sentence(text: str, limit: int = DESCRIPTION_LENGTH) -> str:
+    text = re.sub(r"\s+", " ", text or "").strip()
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1].rstrip() + "…"
+
+
+def book_comment(book: Book) -> str:
+    """Анонс книги: жанр, рейтинг, первое предложение описания и ключевые слова"""
+    text = f"📖 «{book['title']}» ({book['author']}) — {str(book['genre']).lower()}"
+    if book.get('rating'):
+        text += f" с рейтингом ⭐ {book['rating']}"
+    text += "."
+    description = _first_sentence(book.get('description'))
+    if description:
+        text += f" {description}"
+    if book.get('keywords'):
+        text += f"\n🔖 Темы: {', '.join(book['keywords'][:5])}"
+    return text
+
+
+def collection_summary(books: List[Book]) -> str:
+    """Обзор подборки: преобладающие жанры, средний рейтинг и лучшая книга"""
+    genres = Counter(book['genre'] for book in books)
+    text = f"📚 В подборке {len(books)} книг"
+    text += f", чаще всего — {', '.join(genre.lower() for genre, _ in genres.most_common(2))}."
+    ratings = [book['rating'] for book in books if book.get('rating')]
+    if ratings:
+        best = max((book for book in books if book.get('rating')), key=lambda book: book['rating'])
+        text += f" Средний рейтинг ⭐ {sum(ratings) / len(ratings):.1f}, выше всех — «{best['title']}»."
+    return text
+
+
+def fallback_advice(query: Union[str, Dict]) -> str:
+    """Три варианта, как ослабить поиск"""
+    genre = query.get('genre') if isinstance(query, dict) else None
+    first = f"Попробуйте искать только по жанру «{genre}», без других фильтров" if genre else \
+        'Попробуйте убрать часть фильтров, например возраст или происхождение автора'
+    return "\n".join([
+        f"1. {first}",
+        '2. Ищите по жанру: "найди фантастику", "найди детектив"',
+        '3. Вам может понравиться "случайная книга"',
+    ])
+
+
+def greeting(name: str) -> str:
+    return f"Рад знакомству, {name}! Давайте подберём вам отличные книги 📚"
+
+
+def welcome(name: str, preferences: Dict) -> str:
+    genre = preferences.get('genre')
+    return f"{name}, буду подбирать книги по вашим вкусам" + (f" — начнём с жанра «{genre}»!" if genre else "!")
+
+
+def chat() -> str:
+    return ("Сейчас я не могу ответить развёрнуто 🙏 Зато могу: 'рекомендации', "
+            "'найди ...', 'случайная книга', 'ещё'.")
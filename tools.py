@@ -1,152 +1,248 @@
 from typing import Dict, List
 from langchain.tools import tool
-from database import get_connection
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
-import json
+from database import get_read_connection, retry_read
+from catalog import get_catalog, parse_age_limit
+from records import Book, BOOK_FIELDS, RECORD_COLUMNS, decode_cursor
+from sampling import get_sampler
+from facets import count_books
+from history import history_writer, get_recent_history
+from ranking import invalidate_profile, note_shown
+from profiles import get_preferences, save_preferences
+from tracing import traced
+import os
+import re
+import random
+
+SEARCH_RATING_WEIGHT = float(os.getenv("SEARCH_RATING_WEIGHT", "0.3"))
+# Сколько раз добирать случайные книги поиском от случайных id, если точки попали на одни и те же книги
+SAMPLE_SEEK_ROUNDS = 4
 
 @tool
+@traced("tool.get_book_recommendations")
+@retry_read
 def get_book_recommendations(genre: str = None, age_limit: str = None, 
-                           author_origin: str = None, keywords: List[str] = None) -> List[Dict]:
-    """Возвращает рекомендации книг с обработкой кодировки"""
-    conn = get_connection()
-    query = "SELECT * FROM books WHERE 1=1"
+                           author_origin: str = None, keywords: List[str] = None,
+                           limit: int = 5, after: str = None) -> List[Book]:
+    """Возвращает рекомендации книг (лучшие по рейтингу) по жанру, возрасту, автору и ключевым словам.
+    after — курсор предыдущей страницы: тогда возвращается следующая страница."""
+    cursor = decode_cursor(after) if after else None
+    catalog = get_catalog()
+    if catalog is not None:
+        return catalog.search(genre, age_limit, author_origin, keywords, limit, cursor)
+
+    query = f"SELECT {RECORD_COLUMNS} FROM books WHERE 1=1"
     params = []
     
     if genre:
         query += " AND genre = %s"
         params.append(genre)
-    if age_limit:
-        query += " AND age_limit <= %s"
-        params.append(age_limit)
+    max_age = parse_age_limit(age_limit)
+    if max_age is not None:
+        query += " AND age_min <= %s"
+        params.append(max_age)
     if author_origin:
         query += " AND author_origin = %s"
         params.append(author_origin)
     if keywords:
-        query += " AND keywords @> %s"
+        query += " AND keywords @> %s::text[]"
         params.append(keywords)
     
-    query += " ORDER BY rating DESC LIMIT 5;"
+    order = " ORDER BY rating DESC NULLS LAST, id LIMIT %s;"
     
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(query, params)
-        rows = cur.fetchall()
-
-        books = []
-        for row in rows:
-            book = {}
-            for key, value in row.items():
-                if isinstance(value, str):
-                    try:
-                        book[key] = value.encode('utf-8', errors='replace').decode('utf-8')
-                    except:
-                        book[key] = "Неизвестно"
-                else:
-                    book[key] = value
-            books.append(book)
-        
+    with get_read_connection() as conn, conn.cursor() as cur:
+        if cursor is None:
+            cur.execute(query + order, params + [limit])
+            return [Book.from_row(row) for row in cur.fetchall()]
+
+        rating, book_id = cursor
+        if rating is None:
+            cur.execute(query + " AND rating IS NULL AND id > %s" + order, params + [book_id, limit])
+            return [Book.from_row(row) for row in cur.fetchall()]
+
+        # Продолжение с позиции курсора поиском по индексу (..., rating DESC NULLS LAST, id) вместо OFFSET.
+        # Книги без рейтинга идут после всех остальных — их дочитываем отдельным запросом
+        cur.execute(query + " AND rating <= %s AND (rating < %s OR id > %s)" + order,
+                    params + [rating, rating, book_id, limit])
+        books = [Book.from_row(row) for row in cur.fetchall()]
+        if len(books) < limit:
+            cur.execute(query + " AND rating IS NULL" + order, params + [limit - len(books)])
+            books += [Book.from_row(row) for row in cur.fetchall()]
         return books
 
 @tool
+@traced("tool.search_books")
+@retry_read
+def search_books(query: str, genre: str = None, age_limit: str = None,
+                 author_origin: str = None, keywords: List[str] = None, limit: int = 5) -> List[Book]:
+    """Полнотекстовый поиск по названию, автору, описанию и ключевым словам с учётом рейтинга.
+    keywords — обязательные ключевые слова книги, как в get_book_recommendations."""
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return []
+
+    # Слова объединяются через ИЛИ: книги, где совпало больше слов, получают больший ранг
+    sql = f"""
+        SELECT {RECORD_COLUMNS},
+               ts_rank(search_vector, q, 32) * (1 - %s) + coalesce(rating, 0) / 5 * %s AS score
+        FROM books, to_tsquery('russian', %s) AS q
+        WHERE search_vector @@ q
+    """
+    params = [SEARCH_RATING_WEIGHT, SEARCH_RATING_WEIGHT, " | ".join(words)]
+
+    if genre:
+        sql += " AND genre = %s"
+        params.append(genre)
+    max_age = parse_age_limit(age_limit)
+    if max_age is not None:
+        sql += " AND age_min <= %s"
+        params.append(max_age)
+    if author_origin:
+        sql += " AND author_origin = %s"
+        params.append(author_origin)
+    if keywords:
+        sql += " AND keywords @> %s::text[]"
+        params.append(keywords)
+
+    sql += " ORDER BY score DESC, id LIMIT %s;"
+    params.append(limit)
+
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        # Последняя колонка — score, она нужна только для сортировки
+        return [Book.from_row(row[:-1]) for row in cur.fetchall()]
+
+@tool
+@traced("tool.save_user_preferences")
 def save_user_preferences(user_id: int, name: str, preferred_genres: List[str] = None, 
                         preferred_authors: List[str] = None, age_limit: str = None,
-                        author_origin_preference: str = None) -> bool:
-    """Сохраняет или обновляет предпочтения пользователя."""
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO user_preferences 
-            (user_id, name, preferred_genres, preferred_authors, age_limit, author_origin_preference)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET
-                name = EXCLUDED.name,
-                preferred_genres = EXCLUDED.preferred_genres,
-                preferred_authors = EXCLUDED.preferred_authors,
-                age_limit = EXCLUDED.age_limit,
-                author_origin_preference = EXCLUDED.author_origin_preference
-            RETURNING user_id;
-            """,
-            (user_id, name, preferred_genres, preferred_authors, age_limit, author_origin_preference)
-        )
-        conn.commit()
-        return cur.fetchone() is not None
+                        author_origin_preference: str = None, keywords: List[str] = None) -> bool:
+    """Сохраняет или обновляет предпочтения пользователя (запись сразу попадает и в кэш профилей)."""
+    saved = save_preferences(user_id, name, preferred_genres, preferred_authors,
+                             age_limit, author_origin_preference, keywords)
+    invalidate_profile(user_id)
+    return saved is not None
 
 @tool
+@traced("tool.get_user_preferences")
 def get_user_preferences(user_id: int) -> Dict:
-    """Возвращает предпочтения пользователя."""
-    conn = get_connection()
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM user_preferences WHERE user_id = %s;", (user_id,))
-        return cur.fetchone()
+    """Возвращает предпочтения пользователя (из кэша профилей, при промахе — из БД)."""
+    return get_preferences(user_id)
 
 @tool
+@traced("tool.add_to_search_history")
 def add_to_search_history(user_id: int, search_query: str, results: List[Dict]) -> bool:
-    """Добавляет запрос в историю поиска пользователя."""
-    conn = get_connection()
-    with conn.cursor() as cur:
-        result_ids = [r["id"] for r in results]
-
-        history_entry = {
-            "query": search_query,
-            "results": result_ids,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        cur.execute(
-            """
-            UPDATE user_preferences 
-            SET search_history = COALESCE(search_history, '[]'::jsonb) || %s::jsonb
-            WHERE user_id = %s
-            RETURNING user_id;
-            """,
-            (json.dumps(history_entry), user_id) 
-        )
-        conn.commit()
-        return cur.fetchone() is not None
-    
-@tool
-def get_random_book() -> Dict:
-    """Возвращает случайную книгу из БД."""
-    conn = get_connection()
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT * FROM books 
-            ORDER BY RANDOM() 
-            LIMIT 1;
-        """)
-        return cur.fetchone() or {}
+    """Добавляет запрос в историю поиска пользователя (запись в БД происходит в фоне пачками)."""
+    result_ids = [r["id"] for r in results]
+    history_writer.add(user_id, search_query, result_ids)
+    note_shown(user_id, result_ids)
+    return True
 
 @tool
-def get_random_book(genre: str = None, age_limit: str = None, author_origin: str = None) -> Dict:
-    """Возвращает случайную книгу с возможностью фильтрации по жанру, возрасту и происхождению автора."""
-    conn = get_connection()
-    query = "SELECT * FROM books WHERE 1=1"
-    params = []
+@traced("tool.get_search_history")
+def get_search_history(user_id: int, limit: int = 10) -> List[Dict]:
+    """Возвращает последние записи истории поиска пользователя."""
+    return get_recent_history(user_id, limit)
     
+@retry_read
+def _sample_books(k: int, genre: str = None, age_limit: str = None, author_origin: str = None,
+                  exclude_ids: List[int] = None) -> List[Book]:
+    """Выбирает k различных случайных книг без сортировки всей выборки"""
+    sampler = get_sampler()
+    if sampler is not None:
+        catalog = get_catalog()
+        ids = sampler.sample(genre, age_limit, author_origin, k=k, exclude=exclude_ids or ())
+        return [catalog.books[book_id] for book_id in ids if book_id in catalog.books]
+
+    # Без индекса каталога: от каждой случайной точки в диапазоне id ищем по индексу первую подходящую
+    # книгу (keyset seek); если после точки подходящих нет — первую с начала диапазона.
+    # В Python попадают только выбранные книги, а не все подходящие id.
+    # Книга после большого разрыва в id выпадает чаще — для случайной подборки это допустимо
+    where = ""
+    params = []
+
     if genre:
-        query += " AND genre = %s"
+        where += " AND genre = %s"
         params.append(genre)
-    if age_limit:
-        query += " AND age_limit <= %s"
-        params.append(age_limit)
+    max_age = parse_age_limit(age_limit)
+    if max_age is not None:
+        where += " AND age_min <= %s"
+        params.append(max_age)
     if author_origin:
-        query += " AND author_origin = %s"
+        where += " AND author_origin = %s"
         params.append(author_origin)
-    
-    query += " ORDER BY RANDOM() LIMIT 1;"
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(query, params)
-        return cur.fetchone() or {}
+
+    picked: Dict[int, Book] = {}
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT min(id), max(id) FROM books;")
+        low, high = cur.fetchone()
+        if low is None:
+            return []
+        for _ in range(SAMPLE_SEEK_ROUNDS):
+            need = k - len(picked)
+            if need <= 0:
+                break
+            # С запасом: несколько точек в одном разрыве id дают одну и ту же книгу
+            starts = [random.randint(low, high) for _ in range(2 * need)]
+            excluded = list(exclude_ids or ()) + list(picked)
+            cur.execute(
+                f"""
+                SELECT b.* FROM unnest(%s::int[]) AS s(start)
+                CROSS JOIN LATERAL (
+                    (SELECT {RECORD_COLUMNS} FROM books
+                     WHERE id >= s.start{where} AND id <> ALL(%s) ORDER BY id LIMIT 1)
+                    UNION ALL
+                    (SELECT {RECORD_COLUMNS} FROM books
+                     WHERE true{where} AND id <> ALL(%s) ORDER BY id LIMIT 1)
+                    LIMIT 1
+                ) b;
+                """,
+                [starts] + params + [excluded] + params + [excluded]
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if len(picked) < k:
+                    picked.setdefault(row[0], Book.from_row(row))
+    return list(picked.values())
+
+@tool
+@traced("tool.get_random_book")
+def get_random_book(genre: str = None, age_limit: str = None, author_origin: str = None,
+                    exclude_id: int = None) -> Book:
+    """Возвращает случайную книгу с возможностью фильтрации по жанру, возрасту и происхождению автора."""
+    books = _sample_books(1, genre, age_limit, author_origin, [exclude_id] if exclude_id else None)
+    return books[0] if books else {}
+
+@tool
+@traced("tool.get_random_books")
+def get_random_books(k: int = 3, genre: str = None, age_limit: str = None, author_origin: str = None,
+                     exclude_ids: List[int] = None) -> List[Book]:
+    """Возвращает k различных случайных книг по фильтрам, исключая указанные id."""
+    return _sample_books(k, genre, age_limit, author_origin, exclude_ids)
+
+@tool
+@traced("tool.get_similar_books")
+@retry_read
+def get_similar_books(book_id: int, k: int = 5) -> List[Book]:
+    """Возвращает похожие книги из предрассчитанного индекса (similarity.py)."""
+    with get_read_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {", ".join("b." + column for column in BOOK_FIELDS)}
+            FROM book_neighbors n
+            CROSS JOIN LATERAL unnest(n.neighbor_ids) WITH ORDINALITY AS u(id, position)
+            JOIN books b ON b.id = u.id
+            WHERE n.book_id = %s
+            ORDER BY u.position
+            LIMIT %s;
+            """,
+            (book_id, k)
+        )
+        return [Book.from_row(row) for row in cur.fetchall()]
 
 @tool
-def get_books_count(genre: str = None) -> int:
-    """Возвращает количество книг в базе с возможностью фильтрации по жанру."""
-    conn = get_connection()
-    with conn.cursor() as cur:
-        if genre:
-            cur.execute("SELECT COUNT(*) FROM books WHERE genre = %s;", (genre,))
-        else:
-            cur.execute("SELECT COUNT(*) FROM books;")
-        return cur.fetchone()[0]
\ No newline at end of file
+@traced("tool.get_books_count")
+def get_books_count(genre: str = None, age_limit: str = None, author_origin: str = None) -> int:
+    """Возвращает количество книг в базе с возможностью фильтрации по жанру, возрасту и происхождению автора."""
+    return count_books(genre, age_limit, author_origin)
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("TRACING", "0") == "1"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "")
+TRACE_METRICS_PATH = os.getenv("TRACE_METRICS_PATH", "")
+
+# Границы корзин гистограмм, сек (как у Prometheus-клиентов по умолчанию, плюс длинные вызовы модели)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_histograms: Dict[str, "Histogram"] = {}
+# Счётчики и датчики (состояние автомата вызовов модели и т. п.): ключ — имя и отсортированные метки
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_gauges: Dict[Tuple[str, Tuple], float] = {}
+_export_lock = threading.Lock()
+
+slow_operations = deque(maxlen=100)
+
+
+class Span:
+    """Операция внутри хода диалога: имя, длительность, атрибуты и вложенные операции"""
+
+    __slots__ = ("name", "attrs", "children", "started", "duration")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class _NoopSpan:
+    """Заглушка при выключенной трассировке: set ничего не делает"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def record(name: str, duration: float, attrs: Dict = None):
+    """Учитывает длительность операции в гистограмме и журнале медленных операций"""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(duration)
+    if duration * 1000 >= TRACE_SLOW_MS:
+        slow_operations.append({"name": name, "duration_ms": round(duration * 1000, 1),
+                                "attrs": attrs or {}, "ts": time.time()})
+        print(f"🐢 Медленная операция {name}: {duration * 1000:.0f} мс {attrs or ''}")
+
+
+def count(name: str, value: float = 1, **labels):
+    """Увеличивает счётчик событий. Ведётся и при выключенной трассировке: события редкие"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Текущее значение величины (например, состояние автомата)"""
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Операция в дереве текущего хода. При выключенной трассировке почти ничего не стоит"""
+    if not TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+
+    parent = _current.get()
+    current = Span(name, attrs)
+    if parent is not None:
+        parent.children.append(current)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.started
+        _current.reset(token)
+        record(name, current.duration, current.attrs)
+        if parent is None:
+            _export_trace(current)
+
+
+def _result_size(result) -> Optional[int]:
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, dict):
+        return 1 if result else 0
+    return None
+
+
+def traced(name: str) -> Callable:
+    """Декоратор: вызов функции — операция name; для списков и словарей записывается число строк.
+    Сигнатура и docstring сохраняются (functools.wraps), поэтому его можно ставить под @tool"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return func(*args, **kwargs)
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                rows = _result_size(result)
+                if rows is not None:
+                    current.set(rows=rows)
+                return result
+        return wrapper
+    return decorator
+
+
+def _export_trace(root: Span):
+    if not TRACE_JSONL_PATH:
+        return
+    line = json.dumps(dict(root.to_dict(), ts=time.time()), ensure_ascii=False, default=str)
+    with _export_lock, open(TRACE_JSONL_PATH, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def histograms() -> Dict[str, Dict]:
+    """Снимок гистограмм: число вызовов, суммарное время и накопленные счётчики по корзинам"""
+    with _lock:
+        result = {}
+        for name, histogram in _histograms.items():
+            cumulative, total = [], 0
+            for count in histogram.counts:
+                total += count
+                cumulative.append(total)
+            result[name] = {"count": histogram.count, "sum": histogram.sum, "buckets": cumulative}
+        return result
+
+
+def _series(values: Dict[Tuple[str, Tuple], float]) -> List[Dict]:
+    return [{"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(values.items())]
+
+
+def counters() -> Dict[str, List[Dict]]:
+    """Снимок счётчиков и датчиков"""
+    with _lock:
+        return {"counters": _series(_counters), "gauges": _series(_gauges)}
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _sample(metric: str, labels: Dict, value) -> str:
+    rendered = ",".join(f'{key}="{_label(label)}"' for key, label in labels.items())
+    return f"{metric}{{{rendered}}} {value}" if rendered else f"{metric} {value}"
+
+
+def prometheus_text() -> str:
+    """Метрики в текстовом формате Prometheus"""
+    lines = [
+        "# HELP book_assistant_operation_seconds Длительность операций ассистента",
+        "# TYPE book_assistant_operation_seconds histogram",
+    ]
+    for name, histogram in sorted(histograms().items()):
+        label = _label(name)
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram["buckets"]):
+            lines.append(f'book_assistant_operation_seconds_bucket{{operation="{label}",le="{bound}"}} {count}')
+        lines.append(f'book_assistant_operation_seconds_sum{{operation="{label}"}} {histogram["sum"]}')
+        lines.append(f'book_assistant_operation_seconds_count{{operation="{label}"}} {histogram["count"]}')
+
+    snapshot = counters()
+    for kind, suffix, series in (("counter", "_total", snapshot["counters"]), ("gauge", "", snapshot["gauges"])):
+        declared = set()
+        for item in series:
+            metric = f"book_assistant_{item['name']}{suffix}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+            lines.append(_sample(metric, item["labels"], item["value"]))
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(path: str = TRACE_METRICS_PATH):
+    """Записывает метрики в файл: .jsonl — строкой JSON, иначе в формате Prometheus"""
+    if not path:
+        return
+    if path.endswith(".jsonl"):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(counters(), ts=time.time(), histograms=histograms()), ensure_ascii=False) + "\n")
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+
+
+if TRACING_ENABLED and TRACE_METRICS_PATH:
+    atexit.register(export_metrics)